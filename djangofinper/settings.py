@@ -43,13 +43,18 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    'finper.middleware.ProfilingMiddleware',
+    'finper.memory.MemoryMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
+    'finper.routers.PrimaryPinningMiddleware',
     'django.middleware.common.CommonMiddleware',
     'django.middleware.csrf.CsrfViewMiddleware',
     'django.contrib.auth.middleware.AuthenticationMiddleware',
     'django.contrib.messages.middleware.MessageMiddleware',
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
+    # Después de AuthenticationMiddleware: perfila sólo a usuarios staff
+    'finper.middleware.CProfileMiddleware',
 ]
 
 ROOT_URLCONF = 'djangofinper.urls'
@@ -83,6 +88,47 @@ DATABASES = {
     }
 }
 
+# PostgreSQL (por ejemplo en un contenedor local), para las pruebas de
+# concurrencia de finper/tests/test_concurrency.py. Requiere psycopg2.
+if os.environ.get('FINPER_POSTGRES_DB'):
+    DATABASES['default'] = {
+        'ENGINE': 'django.db.backends.postgresql',
+        'NAME': os.environ['FINPER_POSTGRES_DB'],
+        'USER': os.environ.get('FINPER_POSTGRES_USER', 'postgres'),
+        'PASSWORD': os.environ.get('FINPER_POSTGRES_PASSWORD', ''),
+        'HOST': os.environ.get('FINPER_POSTGRES_HOST', 'localhost'),
+        'PORT': os.environ.get('FINPER_POSTGRES_PORT', '5432'),
+    }
+
+# Réplica para las lecturas de finper (finper.routers). Para probarla
+# localmente, FINPER_REPLICA_DB es la ruta de una copia de la base, que se
+# actualiza con 'manage.py sync_replica'.
+if os.environ.get('FINPER_REPLICA_DB'):
+    DATABASES['replica'] = {
+        'ENGINE': 'django.db.backends.sqlite3',
+        'NAME': os.environ['FINPER_REPLICA_DB'],
+        'TEST': {'MIRROR': 'default'},
+    }
+
+DATABASE_ROUTERS = ['finper.routers.ReplicaRouter']
+
+FINPER_REPLICA = {
+    'ALIAS': 'replica',
+    'PIN_SECONDS': 10,
+}
+
+
+# Caché de datos derivados del libro (finper/cache.py). Tiene que ser
+# compartido entre los procesos del servidor: con el caché en memoria de
+# cada proceso, los demás no se enteran de las escrituras.
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.filebased.FileBasedCache',
+        'LOCATION': os.path.join(BASE_DIR, 'cache'),
+        'OPTIONS': {'MAX_ENTRIES': 1000},
+    }
+}
+
 
 # Password validation
 # https://docs.djangoproject.com/en/3.0/ref/settings/#auth-password-validators
@@ -124,3 +170,108 @@ STATIC_URL = '/static/'
 STATICFILES_DIRS = [
     os.path.join(BASE_DIR, 'djangofinper/static'),
 ]
+
+
+# Finper
+
+# Mantenimiento de los saldos materializados de los movimientos
+# (Movement.balance_after_in, Movement.balance_after_out):
+#   'incremental': Movement.save() y Movement.delete() los mantienen al día.
+#   'off': no se mantienen; se recalculan con 'manage.py rebuild_balances'.
+FINPER_RUNNING_BALANCES = 'incremental'
+
+# Medición de consultas y tiempos por request (finper.middleware.ProfilingMiddleware).
+# Sin 'ENABLED' ni 'HEADERS', mide y agrega los headers sólo con DEBUG.
+FINPER_PROFILING = {
+    'SLOW_REQUEST_MS': 500,
+}
+
+# Perfil de rendimiento de SQLite, aplicado a cada conexión (finper.sqlite).
+# 'manage.py benchmark_sqlite' compara el rendimiento con y sin el perfil.
+FINPER_SQLITE = {
+    'ENABLED': True,
+    'JOURNAL_MODE': 'WAL',
+    'SYNCHRONOUS': 'NORMAL',
+    'CACHE_SIZE': -64000,
+    'MMAP_SIZE': 256 * 1024 * 1024,
+    'TEMP_STORE': 'MEMORY',
+    'BUSY_TIMEOUT': 5000,
+    'RETRIES': 5,
+    'RETRY_DELAY': 0.05,
+}
+
+# Registro de consultas lentas, con su plan de ejecución (finper.slowqueries)
+FINPER_SLOW_QUERIES = {
+    'ENABLED': False,
+    'THRESHOLD_MS': 100,
+    'FILE': os.path.join(BASE_DIR, 'slow_queries.log'),
+    'MAX_BYTES': 5 * 1024 * 1024,
+    'BACKUP_COUNT': 5,
+    'EXPLAIN': True,
+}
+
+# Métricas de operación (finper.metrics, vista /metrics). Con varios procesos,
+# DIR es un directorio compartido donde cada uno vuelca sus métricas.
+FINPER_METRICS = {
+    'DIR': None,
+    'FLUSH_INTERVAL': 1.0,
+}
+
+# Perfiles cProfile a pedido para usuarios staff (finper.profiling)
+FINPER_CPROFILE = {
+    'ENABLED': True,
+    'DIR': os.path.join(BASE_DIR, 'profiles'),
+    'TOP': 30,
+    'KEEP': 50,
+}
+
+# Medición de memoria con tracemalloc (ver finper/memory.py); hace más lento
+# cada request, activar sólo para diagnosticar
+FINPER_MEMORY = {
+    'ENABLED': False,
+    'TOP': 10,
+    'FRAMES': 1,
+}
+
+# Ingesta de movimientos en NDJSON (finper.ingest, api/movements/ingest/):
+# cada lote se guarda al llegar a BATCH_SIZE líneas o BATCH_SECONDS segundos
+FINPER_INGEST = {
+    'BATCH_SIZE': 500,
+    'BATCH_SECONDS': 2.0,
+    'MAX_LINE_BYTES': 64 * 1024,
+}
+
+# Feed de cambios para copias del libro (finper.changes, api/changes/).
+# 'manage.py compact_changes' descarta las bajas de más de TOMBSTONE_DAYS.
+FINPER_CHANGES = {
+    'PAGE_SIZE': 500,
+    'MAX_PAGE_SIZE': 1000,
+    'TOMBSTONE_DAYS': 90,
+}
+
+# Eventos en vivo de la planilla (finper.events, async/events/). El
+# broadcaster local reparte sólo dentro del proceso: con varios procesos hay
+# que configurar uno compartido.
+FINPER_EVENTS = {
+    'BROADCASTER': 'finper.events.LocalBroadcaster',
+    'QUEUE_SIZE': 100,
+    'KEEPALIVE_SECONDS': 15,
+    # None: el flujo de eventos sólo se sirve bajo ASGI
+    'STREAM': None,
+}
+
+LOGGING = {
+    'version': 1,
+    'disable_existing_loggers': False,
+    'handlers': {
+        'console': {
+            'class': 'logging.StreamHandler',
+        },
+    },
+    'loggers': {
+        'finper': {
+            'handlers': ['console'],
+            'level': 'WARNING',
+        },
+    },
+}
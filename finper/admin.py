@@ -1,7 +1,110 @@
-from django.contrib import admin
+from django.contrib import admin, messages
+from django.contrib.admin import helpers
+from django.db.models import Count
+from django.template.response import TemplateResponse
 
-from .models import Movement, Account
+from .forms import MovementBulkActionForm, MovementModelForm
+from .ledger import LedgerBatch
+from .models import Movement, Account, Category
 
-# Register your models here.
-admin.site.register(Movement)
-admin.site.register(Account)
\ No newline at end of file
+
+class MovementAdmin(admin.ModelAdmin):
+    form = MovementModelForm
+    list_display = ['date', 'title', 'amount', 'currency', 'account_in', 'account_out',
+                    'category']
+    # __str__ y las columnas leen las cuentas y la categoría: sin esto, tres
+    # consultas por fila
+    list_select_related = ['account_in', 'account_out', 'category']
+    # Filtros sobre columnas con índice (columna, fecha)
+    date_hierarchy = 'date'
+    list_filter = ['account_in', 'account_out', 'category', 'currency']
+    # Sin el COUNT(*) de toda la tabla en cada página filtrada
+    show_full_result_count = False
+    actions = ['recategorize', 'reassign_account_in', 'reassign_account_out']
+
+    def delete_queryset(self, request, queryset):
+        """ 'Borrar seleccionados' borra con Movement.delete(), que corrige
+            los saldos, dentro de un LedgerBatch: una actualización de saldo
+            por cuenta. QuerySet.delete() no tocaría los saldos."""
+        with LedgerBatch():
+            for movement in queryset:
+                movement.delete()
+
+    def _bulk_action(self, request, queryset, action):
+        """ Pide la categoría o la cuenta nueva en una página intermedia y
+            aplica el cambio a los movimientos seleccionados."""
+        if 'apply' in request.POST:
+            form = MovementBulkActionForm(request.POST)
+            if form.is_valid():
+                updated = form.apply(queryset)
+                self.message_user(request, f'{updated} movimientos modificados',
+                                  messages.SUCCESS)
+                return None
+        else:
+            form = MovementBulkActionForm(initial={'action': action})
+        form.fields['action'].widget = form.fields['action'].hidden_widget()
+        return TemplateResponse(request, 'admin/finper/movement/bulk_action.html', {
+            **self.admin_site.each_context(request),
+            'title': dict(MovementBulkActionForm.ACTIONS)[action],
+            'opts': self.model._meta,
+            'form': form,
+            'queryset': queryset.select_related('account_in', 'account_out'),
+            'action': request.POST.get('action'),
+            'action_checkbox_name': helpers.ACTION_CHECKBOX_NAME,
+        })
+
+    @admin.action(description='Cambiar la categoría')
+    def recategorize(self, request, queryset):
+        return self._bulk_action(request, queryset, MovementBulkActionForm.RECATEGORIZE)
+
+    @admin.action(description='Cambiar la cuenta de entrada')
+    def reassign_account_in(self, request, queryset):
+        return self._bulk_action(request, queryset, MovementBulkActionForm.ACCOUNT_IN)
+
+    @admin.action(description='Cambiar la cuenta de salida')
+    def reassign_account_out(self, request, queryset):
+        return self._bulk_action(request, queryset, MovementBulkActionForm.ACCOUNT_OUT)
+
+
+class AccountAdmin(admin.ModelAdmin):
+    list_display = ['codename', 'name', 'balance_start', 'balance']
+    search_fields = ['codename', 'name']
+    actions = ['correct_balances']
+
+    def get_readonly_fields(self, request, obj=None):
+        # Los saldos los mantienen los movimientos; el saldo inicial se
+        # corrige desde la planilla (correct_start_balance), que corre
+        # también los saldos materializados
+        if obj is None:
+            return ['balance_previous', 'balance']
+        return ['balance_start', 'balance_previous', 'balance']
+
+    @admin.action(description='Recalcular los saldos a partir de los movimientos')
+    def correct_balances(self, request, queryset):
+        corrected = 0
+        for account in queryset:
+            check = account.check_balance()
+            if not check['saldoOk']:
+                account.balance = account.balance_start + check['movsum']
+                account.save()
+                corrected += 1
+            account.rebuild_running_balances()
+        self.message_user(request, f'{corrected} saldos corregidos', messages.SUCCESS)
+
+
+class CategoryAdmin(admin.ModelAdmin):
+    list_display = ['name', 'description', 'movement_count']
+    search_fields = ['name']
+
+    def get_queryset(self, request):
+        # La cantidad de movimientos de cada categoría, en la misma consulta
+        return super().get_queryset(request).annotate(movement_count=Count('movement'))
+
+    @admin.display(description='Movimientos', ordering='movement_count')
+    def movement_count(self, category):
+        return category.movement_count
+
+
+admin.site.register(Movement, MovementAdmin)
+admin.site.register(Account, AccountAdmin)
+admin.site.register(Category, CategoryAdmin)
@@ -0,0 +1,341 @@
+""" API JSON de movimientos y cuentas.
+
+    api/movements/            GET lista, POST alta
+    api/movements/<pk>/       GET detalle, PUT o PATCH modificación, DELETE baja
+    api/movements/batch/      POST varias operaciones en una transacción
+    api/movements/ingest/     POST ingesta de movimientos en NDJSON
+    api/accounts/             GET lista, POST alta
+    api/accounts/<pk>/        GET detalle, PUT o PATCH modificación, DELETE baja
+    api/changes/              GET cambios posteriores a since (ver finper/changes.py)
+
+    Las listas se paginan por clave: limit, y before (movimientos, del más
+    nuevo al más viejo) o after (cuentas, por pk); la respuesta trae en next
+    el valor para pedir la página siguiente. Con fields=campo,campo se eligen
+    los campos de la respuesta, que se leen con values() sin instanciar
+    modelos (ver finper/serializers.py). Los movimientos se filtran con los
+    mismos parámetros que la planilla (MovementFilterForm).
+
+    Las altas y modificaciones pasan por los formularios y por Movement.save()
+    y Movement.delete(), así que mantienen los saldos igual que las vistas
+    HTML. El lote de movimientos corre dentro de un LedgerBatch: cada cuenta
+    se actualiza una sola vez y, si una operación falla, no se aplica
+    ninguna. El cuerpo de POST, PUT y PATCH tiene que ser JSON
+    (Content-Type: application/json): un formulario de otro sitio no puede
+    mandar ese tipo sin permiso del servidor, así que no hace falta el token
+    CSRF. La ingesta recibe y devuelve NDJSON (application/x-ndjson), en
+    streaming (ver finper/ingest.py).
+"""
+import json
+
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db.models import ProtectedError
+from django.forms import model_to_dict, modelform_factory
+from django.http import HttpResponse, JsonResponse, StreamingHttpResponse
+from django.views.decorators.csrf import csrf_exempt
+
+from .changes import ChangesExpired, changes_since
+from .errors import AccountError
+from .forms import AccountModModelForm, MovementFilterForm, MovementModelForm
+from .ingest import ingest
+from .ledger import LedgerBatch
+from .models import Account, Movement
+from .serializers import (ACCOUNT_FIELDS, MOVEMENT_FIELDS, movement_page,
+                          movement_rows, page_size, parse_cursor, select_fields,
+                          serialize_row, values)
+
+AccountCreateForm = modelform_factory(Account, fields=['codename', 'name', 'balance_start'])
+
+# Cantidad máxima de operaciones de un lote
+MAX_BATCH_OPERATIONS = 1000
+
+
+class ApiError(Exception):
+
+    def __init__(self, status, error):
+        super().__init__(error)
+        self.status = status
+        self.error = error
+
+
+def _dispatch(request, handlers, *args):
+    handler = handlers.get(request.method)
+    if handler is None:
+        response = JsonResponse({'error': f'Método no permitido: {request.method}'},
+                                status=405)
+        response['Allow'] = ', '.join(handlers)
+        return response
+    try:
+        return handler(request, *args)
+    except ApiError as error:
+        return JsonResponse({'error': error.error}, status=error.status)
+
+
+def _json_body(request):
+    if request.content_type != 'application/json':
+        raise ApiError(415, 'El cuerpo tiene que ser JSON (application/json)')
+    try:
+        data = json.loads(request.body or b'{}')
+    except ValueError as error:
+        raise ApiError(400, f'JSON inválido: {error}')
+    if not isinstance(data, dict):
+        raise ApiError(400, 'Se esperaba un objeto JSON')
+    return data
+
+
+def _fields(request, available):
+    try:
+        return select_fields(available, request.GET.get('fields'))
+    except ValueError as error:
+        raise ApiError(400, str(error))
+
+
+def _detail(queryset, pk, fields):
+    """ Un objeto por pk, leído con values() (sin instanciar el modelo)."""
+    try:
+        return serialize_row(values(queryset, fields).get(pk=pk), fields)
+    except queryset.model.DoesNotExist:
+        raise ApiError(404, 'No existe')
+
+
+def _get_object(model, pk):
+    try:
+        return model.objects.get(pk=pk)
+    except (model.DoesNotExist, ValueError):
+        raise ApiError(404, 'No existe')
+
+
+def _patched(form_class, instance, data):
+    """ Los valores actuales del objeto, reemplazados por los de data."""
+    return {**model_to_dict(instance, fields=form_class.base_fields), **data}
+
+
+def _form_data(request, form_class, instance):
+    """ Datos para el formulario: el cuerpo completo (POST y PUT) o, con
+        PATCH, los valores actuales del objeto reemplazados por los del
+        cuerpo."""
+    data = _json_body(request)
+    if request.method == 'PATCH':
+        data = _patched(form_class, instance, data)
+    return data
+
+
+def _save(form):
+    if not form.is_valid():
+        raise ApiError(400, form.errors)
+    try:
+        return form.save()
+    except AccountError as error:
+        raise ApiError(400, str(error))
+
+
+# Movimientos
+
+def _movement_list(request):
+    fields = _fields(request, MOVEMENT_FIELDS)
+    try:
+        before = parse_cursor(request.GET.get('before'))
+        limit = page_size(request.GET.get('limit'))
+    except ValueError as error:
+        raise ApiError(400, str(error))
+    form = MovementFilterForm(request.GET)
+    if not form.is_valid():
+        raise ApiError(400, form.errors)
+    movements = form.filter(Movement.objects.all())
+    rows = list(movement_rows(movements, before, limit, fields))
+    return JsonResponse(movement_page(rows, limit, movements.count(), fields))
+
+
+def _movement_create(request):
+    movement = _save(MovementModelForm(_json_body(request)))
+    return JsonResponse(_detail(Movement.objects.all(), movement.pk, MOVEMENT_FIELDS),
+                        status=201)
+
+
+def _movement_detail(request, pk):
+    return JsonResponse(_detail(Movement.objects.all(), pk,
+                                _fields(request, MOVEMENT_FIELDS)))
+
+
+def _movement_update(request, pk):
+    movement = _get_object(Movement, pk)
+    data = _form_data(request, MovementModelForm, movement)
+    _save(MovementModelForm(data, instance=movement))
+    return JsonResponse(_detail(Movement.objects.all(), pk, MOVEMENT_FIELDS))
+
+
+def _movement_delete(request, pk):
+    _get_object(Movement, pk).delete()
+    return HttpResponse(status=204)
+
+
+def _batch_operation(operation):
+    """ Ejecuta una operación del lote. Devuelve (acción, pk)."""
+    if not isinstance(operation, dict):
+        raise ApiError(400, 'Cada operación tiene que ser un objeto JSON')
+    action = operation.get('op')
+    data = operation.get('data') or {}
+    if not isinstance(data, dict):
+        raise ApiError(400, 'data tiene que ser un objeto JSON')
+    if action == 'create':
+        return action, _save(MovementModelForm(data)).pk
+    if action not in ('update', 'delete'):
+        raise ApiError(400, f'Operación desconocida: {action}')
+    movement = _get_object(Movement, operation.get('id'))
+    pk = movement.pk
+    if action == 'update':
+        _save(MovementModelForm(_patched(MovementModelForm, movement, data),
+                                instance=movement))
+    else:
+        movement.delete()
+    return action, pk
+
+
+def _movement_batch(request):
+    operations = _json_body(request).get('operations')
+    if not isinstance(operations, list):
+        raise ApiError(400, 'Falta la lista operations')
+    if len(operations) > MAX_BATCH_OPERATIONS:
+        raise ApiError(400, f'Se admiten hasta {MAX_BATCH_OPERATIONS} operaciones')
+    done = []
+    with LedgerBatch():
+        for index, operation in enumerate(operations):
+            try:
+                done.append(_batch_operation(operation))
+            except ApiError as error:
+                # Al salir del lote con la excepción se deshace todo
+                error.error = {'index': index, 'error': error.error, 'rolled_back': True}
+                raise
+
+    # Los saldos se leen después de aplicar el lote
+    saved = {row['id']: row for row in values(
+        Movement.objects.filter(pk__in=[pk for action, pk in done if action != 'delete']),
+        MOVEMENT_FIELDS)}
+    status = {'create': 201, 'update': 200, 'delete': 204}
+    return JsonResponse({'results': [
+        {'op': action, 'id': pk, 'status': status[action],
+         'data': serialize_row(saved[pk], MOVEMENT_FIELDS) if pk in saved else None}
+        for action, pk in done]})
+
+
+@csrf_exempt
+def movement_batch(request):
+    """ Lote de operaciones sobre movimientos, en orden, en una transacción:
+        {"operations": [{"op": "create", "data": {...}},
+                        {"op": "update", "id": 5, "data": {...}},
+                        {"op": "delete", "id": 7}]}
+        update modifica sólo los campos presentes en data (como PATCH)."""
+    return _dispatch(request, {'POST': _movement_batch})
+
+
+def _movement_ingest(request):
+    if request.content_type != 'application/x-ndjson':
+        raise ApiError(415, 'El cuerpo tiene que ser NDJSON (application/x-ndjson)')
+    # El cuerpo se lee línea por línea a medida que se genera la respuesta;
+    # request.body lo cargaría entero en memoria
+    lines = (json.dumps(result, cls=DjangoJSONEncoder) + '\n'
+             for result in ingest(request))
+    return StreamingHttpResponse(lines, content_type='application/x-ndjson')
+
+
+@csrf_exempt
+def movement_ingest(request):
+    """ Ingesta de movimientos: un movimiento (los campos de
+        MovementModelForm) por línea. Devuelve el resultado de cada línea y
+        un resumen final, también en NDJSON."""
+    return _dispatch(request, {'POST': _movement_ingest})
+
+
+@csrf_exempt
+def movements(request):
+    return _dispatch(request, {'GET': _movement_list, 'POST': _movement_create})
+
+
+@csrf_exempt
+def movement(request, pk):
+    return _dispatch(request, {'GET': _movement_detail,
+                               'PUT': _movement_update,
+                               'PATCH': _movement_update,
+                               'DELETE': _movement_delete}, pk)
+
+
+# Cuentas
+
+def _account_list(request):
+    fields = _fields(request, ACCOUNT_FIELDS)
+    try:
+        after = int(request.GET['after']) if request.GET.get('after') else None
+        limit = page_size(request.GET.get('limit'))
+    except ValueError as error:
+        raise ApiError(400, str(error))
+    accounts = Account.objects.order_by('pk')
+    if request.GET.get('codename'):
+        accounts = accounts.filter(codename=request.GET['codename'])
+    if after is not None:
+        accounts = accounts.filter(pk__gt=after)
+    rows = list(values(accounts, fields, 'id')[:limit + 1])
+    return JsonResponse({
+        'next': rows[limit - 1]['id'] if len(rows) > limit else None,
+        'results': [serialize_row(row, fields) for row in rows[:limit]],
+    })
+
+
+def _account_create(request):
+    account = _save(AccountCreateForm(_json_body(request)))
+    return JsonResponse(_detail(Account.objects.all(), account.pk, ACCOUNT_FIELDS),
+                        status=201)
+
+
+def _account_detail(request, pk):
+    return JsonResponse(_detail(Account.objects.all(), pk,
+                                _fields(request, ACCOUNT_FIELDS)))
+
+
+def _account_update(request, pk):
+    account = _get_object(Account, pk)
+    data = _form_data(request, AccountModModelForm, account)
+    _save(AccountModModelForm(data, instance=account))
+    return JsonResponse(_detail(Account.objects.all(), pk, ACCOUNT_FIELDS))
+
+
+def _account_delete(request, pk):
+    try:
+        _get_object(Account, pk).delete()
+    except ProtectedError:
+        raise ApiError(409, 'La cuenta tiene movimientos')
+    return HttpResponse(status=204)
+
+
+@csrf_exempt
+def accounts(request):
+    return _dispatch(request, {'GET': _account_list, 'POST': _account_create})
+
+
+@csrf_exempt
+def account(request, pk):
+    return _dispatch(request, {'GET': _account_detail,
+                               'PUT': _account_update,
+                               'PATCH': _account_update,
+                               'DELETE': _account_delete}, pk)
+
+
+# Cambios
+
+def _change_list(request):
+    try:
+        since = int(request.GET.get('since') or 0)
+        limit = int(request.GET['limit']) if request.GET.get('limit') else None
+    except ValueError:
+        raise ApiError(400, 'since y limit tienen que ser números')
+    if since < 0 or (limit is not None and limit < 1):
+        raise ApiError(400, 'since y limit no pueden ser negativos')
+    try:
+        return JsonResponse(changes_since(since, limit))
+    except ChangesExpired as error:
+        raise ApiError(410, {'message': str(error), 'horizon': error.horizon,
+                             'resync': True})
+
+
+def changes(request):
+    """ Cambios de cuentas y movimientos posteriores a ?since=N. Con 410 el
+        cliente tiene que volver a sincronizar desde since=0."""
+    return _dispatch(request, {'GET': _change_list})
@@ -1,5 +1,16 @@
 from django.apps import AppConfig
+from django.db.backends.signals import connection_created
+from django.db.models.signals import post_delete, post_save
 
 
 class FinperConfig(AppConfig):
     name = 'finper'
+
+    def ready(self):
+        from . import events, slowqueries, sqlite
+        from .models import Movement
+        post_save.connect(events.post_save, sender=Movement)
+        post_delete.connect(events.post_delete, sender=Movement)
+        connection_created.connect(sqlite.apply_profile)
+        if slowqueries.slow_queries_settings()['ENABLED']:
+            connection_created.connect(slowqueries.install)
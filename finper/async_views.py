@@ -0,0 +1,104 @@
+""" Vistas JSON asincrónicas de lectura.
+
+    Las mismas respuestas que movements_json, accounts_json y report_json de
+    finper/views.py, pero con el ORM asincrónico (aiterator, aget, acount).
+    Bajo ASGI, un worker atiende muchos clientes a la vez mientras esperan a
+    la base, sin ocupar un hilo por request (los middleware de finper
+    funcionan en los dos modos, así que no obligan a pasar por un hilo).
+
+    movement_events mantiene abierta una conexión por pestaña de la planilla
+    y le manda los eventos de finper/events.py (Server-Sent Events). Sólo
+    se sirve bajo ASGI, donde cada conexión es una corrutina y no un hilo.
+"""
+import json
+
+from asgiref.sync import sync_to_async
+from django.core.serializers.json import DjangoJSONEncoder
+from django.http import Http404, HttpResponse, JsonResponse, StreamingHttpResponse
+
+from .events import events_settings, get_broadcaster, streaming_enabled
+from .forms import MovementFilterForm
+from .models import Account, Movement
+from .serializers import (account_rows, category_report_rows, movement_page,
+                          movement_rows, page_size, parse_cursor,
+                          serialize_account, serialize_report_row)
+
+
+async def _filter_form(request):
+    """ Valida el filtro en un hilo: los ModelChoiceField consultan la base.
+        Devuelve (form, respuesta de error o None)."""
+    form = MovementFilterForm(request.GET)
+    if request.GET and not await sync_to_async(form.is_valid)():
+        return form, JsonResponse({'error': form.errors}, status=400)
+    return form, None
+
+
+async def movements_json(request):
+    try:
+        before = parse_cursor(request.GET.get('before'))
+        limit = page_size(request.GET.get('limit'))
+    except ValueError as error:
+        return JsonResponse({'error': str(error)}, status=400)
+    form, error = await _filter_form(request)
+    if error is not None:
+        return error
+    movements = form.filter(Movement.objects.all())
+    rows = [row async for row in movement_rows(movements, before, limit).aiterator()]
+    return JsonResponse(movement_page(rows, limit, await movements.acount()))
+
+
+async def accounts_json(request):
+    """ Todas las cuentas o, con el parámetro account, sólo esa."""
+    accounts = account_rows()
+    if request.GET.get('account'):
+        try:
+            row = await accounts.aget(pk=int(request.GET['account']))
+        except (ValueError, Account.DoesNotExist):
+            raise Http404('No existe la cuenta')
+        return JsonResponse(serialize_account(row))
+    return JsonResponse({'results': [serialize_account(row)
+                                     async for row in accounts.aiterator()]})
+
+
+async def report_json(request):
+    form, error = await _filter_form(request)
+    if error is not None:
+        return error
+    rows = category_report_rows(form.filter(Movement.objects.all()))
+    return JsonResponse({'results': [serialize_report_row(row)
+                                     async for row in rows.aiterator()]})
+
+
+def _sse(event):
+    return f'event: movement\ndata: {json.dumps(event, cls=DjangoJSONEncoder)}\n\n'
+
+
+async def _event_stream(keepalive):
+    subscription = get_broadcaster().subscribe()
+    try:
+        # Si se corta, el navegador reconecta a los 5 segundos
+        yield 'retry: 5000\n\n'
+        while True:
+            event = await subscription.get(timeout=keepalive)
+            if event is None:
+                yield ': keepalive\n\n'
+                continue
+            yield _sse(event)
+            if event['action'] == 'resync':
+                return
+    finally:
+        subscription.close()
+
+
+async def movement_events(request):
+    """ Eventos en vivo de movimientos (text/event-stream), para la planilla.
+        Si no se sirven (ver finper/events.py) responde 204, que le indica
+        al navegador que no reconecte."""
+    if not streaming_enabled(request):
+        return HttpResponse(status=204)
+    response = StreamingHttpResponse(_event_stream(events_settings()['KEEPALIVE_SECONDS']),
+                                     content_type='text/event-stream')
+    response['Cache-Control'] = 'no-cache'
+    # Sin esto nginx acumula la respuesta y los eventos llegan tarde
+    response['X-Accel-Buffering'] = 'no'
+    return response
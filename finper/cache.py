@@ -0,0 +1,66 @@
+""" Caché de datos derivados del libro de movimientos.
+
+    Todo lo que se calcula a partir de movimientos y saldos se guarda bajo una
+    clave que incluye la versión del libro (ledger version). Cada escritura de
+    Movement, Account o Category incrementa la versión, así que las entradas
+    viejas quedan huérfanas y expiran solas, sin tener que invalidarlas una
+    por una.
+
+    La versión vive en el caché por defecto de Django, que tiene que ser
+    compartido entre los procesos (archivos, memcached, redis; ver CACHES en
+    settings.py): con un caché propio de cada proceso (LocMemCache), los
+    demás procesos no ven el incremento y siguen sirviendo datos viejos.
+"""
+import time
+
+from django.core.cache import cache
+
+from .metrics import CACHE_REQUESTS
+
+LEDGER_VERSION_KEY = 'finper:ledger_version'
+
+# Duración de las entradas derivadas (la versión en la clave las invalida
+# antes si cambia el libro)
+LEDGER_CACHE_TIMEOUT = 60 * 60
+
+
+def ledger_version():
+    """ Devuelve la versión actual del libro de movimientos."""
+    version = cache.get(LEDGER_VERSION_KEY)
+    if version is None:
+        cache.add(LEDGER_VERSION_KEY, time.time_ns(), timeout=None)
+        version = cache.get(LEDGER_VERSION_KEY, 0)
+    return version
+
+
+def bump_ledger_version(*args, **kwargs):
+    """ Cambia la versión del libro de movimientos por una mayor.
+        La versión es el reloj en nanosegundos (o la anterior más uno, si el
+        reloj no avanzó) en lugar de un contador: incr no es atómico en todos
+        los cachés compartidos (en el de archivos, dos procesos podrían
+        escribir el mismo número), y si el caché pierde la clave no vuelve a
+        empezar en un número que ya se usó.
+        Acepta cualquier argumento para poder conectarse directamente a las
+        señales post_save y post_delete."""
+    version = max(time.time_ns(), (cache.get(LEDGER_VERSION_KEY) or 0) + 1)
+    cache.set(LEDGER_VERSION_KEY, version, timeout=None)
+    return version
+
+
+def ledger_cache_key(name, *parts):
+    """ Clave de caché para un dato derivado, atada a la versión del libro."""
+    return ':'.join(['finper', name, *map(str, parts), f'v{ledger_version()}'])
+
+
+def ledger_cached(name, parts, compute, timeout=LEDGER_CACHE_TIMEOUT):
+    """ Devuelve el valor cacheado bajo (name, parts, versión del libro), o lo
+        calcula con compute() y lo guarda."""
+    key = ledger_cache_key(name, *parts)
+    value = cache.get(key)
+    if value is None:
+        CACHE_REQUESTS.inc(cache=name, result='miss')
+        value = compute()
+        cache.set(key, value, timeout)
+    else:
+        CACHE_REQUESTS.inc(cache=name, result='hit')
+    return value
@@ -0,0 +1,138 @@
+""" Feed de cambios del libro, para clientes que mantienen una copia.
+
+    Cada alta, modificación o baja de una cuenta o un movimiento registra un
+    Change (ver finper/models.py): las escrituras de a una con las señales
+    post_save y post_delete, y las que actualizan en bloque (LedgerBatch)
+    con Change.record(). El pk de Change es una secuencia creciente; el
+    cliente guarda el último número que recibió y pide sólo lo posterior:
+
+        changes_since(since) -> {
+            'since': since,
+            'next': último cambio incluido (el since de la próxima consulta),
+            'more': True si quedan cambios después de next,
+            'movements': [filas de los movimientos cambiados],
+            'accounts': [filas de las cuentas cambiadas y de las cuentas de
+                         esos movimientos, con su saldo actual],
+            'deleted': {'movements': [ids], 'accounts': [ids]},
+        }
+
+    Las filas son el estado actual, no el de cada cambio: si un objeto
+    cambió varias veces se manda una vez. Los saldos materializados de los
+    movimientos (balance_after_in/out) no van en el feed: un cambio en una
+    fecha anterior los corre en todos los movimientos posteriores, que no
+    registran un cambio cada uno; el cliente los recalcula o los lee de la
+    API.
+
+    Con SQLite las escrituras van de a una, así que la secuencia sigue el
+    orden de confirmación de las transacciones. Con motores con escrituras
+    concurrentes, una transacción larga puede confirmar un cambio con un
+    número menor que otro ya leído.
+
+    compact_changes() descarta los cambios superados por uno posterior del
+    mismo objeto, que no aportan nada, y las marcas de baja viejas. Quien
+    pida cambios desde antes de la última baja descartada recibe
+    ChangesExpired y tiene que volver a descargar todo (since=0).
+"""
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Max
+from django.utils import timezone
+
+from .models import Account, Change, ChangeCompaction, Movement
+from .serializers import ACCOUNT_FIELDS, MOVEMENT_FIELDS, serialize_row, values
+
+CHANGES_DEFAULTS = {
+    # Cambios por página del feed, por defecto y como máximo
+    'PAGE_SIZE': 500,
+    'MAX_PAGE_SIZE': 1000,
+    # Antigüedad a partir de la cual compact_changes descarta las bajas
+    'TOMBSTONE_DAYS': 90,
+}
+
+CHANGE_MOVEMENT_FIELDS = {name: lookup for name, lookup in MOVEMENT_FIELDS.items()
+                          if not name.startswith('balance_after')}
+
+
+class ChangesExpired(Exception):
+    """ Los cambios pedidos ya no están completos en el registro."""
+
+    def __init__(self, horizon):
+        super().__init__(f'Los cambios anteriores a {horizon} fueron compactados')
+        self.horizon = horizon
+
+
+def changes_settings():
+    return {**CHANGES_DEFAULTS, **getattr(settings, 'FINPER_CHANGES', {})}
+
+
+def changes_horizon():
+    """ Mayor cambio de baja descartado por una compactación (0 si ninguno)."""
+    return ChangeCompaction.objects.aggregate(seq=Max('seq'))['seq'] or 0
+
+
+def changes_since(since, limit=None):
+    """ Cambios posteriores a since (ver el docstring del módulo), de a
+        limit cambios."""
+    config = changes_settings()
+    limit = min(limit or config['PAGE_SIZE'], config['MAX_PAGE_SIZE'])
+    horizon = changes_horizon()
+    # Una copia nueva (since=0) no necesita las bajas descartadas
+    if 0 < since < horizon:
+        raise ChangesExpired(horizon)
+
+    page = list(Change.objects.filter(pk__gt=since).order_by('pk')
+                .values_list('pk', 'model', 'object_id', 'deleted')[:limit + 1])
+    more = len(page) > limit
+    page = page[:limit]
+    latest = {}
+    for seq, model, object_id, deleted in page:
+        latest[model, object_id] = deleted
+
+    def ids(model, deleted):
+        return sorted(object_id for (name, object_id), gone in latest.items()
+                      if name == model and gone == deleted)
+
+    movements = [serialize_row(row, CHANGE_MOVEMENT_FIELDS) for row in values(
+        Movement.objects.filter(pk__in=ids(Change.MOVEMENT, False)).order_by('pk'),
+        CHANGE_MOVEMENT_FIELDS)]
+    accountids = set(ids(Change.ACCOUNT, False))
+    for row in movements:
+        accountids.update(pk for pk in (row['account_in'], row['account_out'])
+                          if pk is not None)
+    accounts = [serialize_row(row, ACCOUNT_FIELDS) for row in values(
+        Account.objects.filter(pk__in=accountids).order_by('pk'), ACCOUNT_FIELDS)]
+    return {
+        'since': since,
+        'next': page[-1][0] if page else since,
+        'more': more,
+        'movements': movements,
+        'accounts': accounts,
+        'deleted': {'movements': ids(Change.MOVEMENT, True),
+                    'accounts': ids(Change.ACCOUNT, True)},
+    }
+
+
+@transaction.atomic
+def compact_changes(days=None):
+    """ Descarta los cambios superados y las bajas de más de days días.
+        Devuelve (superados, bajas) descartados."""
+    if days is None:
+        days = changes_settings()['TOMBSTONE_DAYS']
+    latest = Change.objects.values('model', 'object_id')\
+        .annotate(last=Max('pk')).values('last')
+    superseded, _ = Change.objects.exclude(pk__in=latest).delete()
+
+    # El último cambio se conserva siempre: SQLite reusa el mayor pk si se
+    # borra, y el cambio siguiente repetiría un número ya entregado
+    newest = Change.objects.aggregate(seq=Max('pk'))['seq']
+    tombstones = Change.objects.filter(
+        deleted=True, created__lt=timezone.now() - timedelta(days=days))\
+        .exclude(pk=newest)
+    horizon = tombstones.aggregate(seq=Max('pk'))['seq']
+    removed = 0
+    if horizon is not None:
+        removed, _ = tombstones.delete()
+        ChangeCompaction.objects.create(seq=horizon, removed=removed)
+    return superseded, removed
@@ -0,0 +1,147 @@
+""" Series de saldos para gráficos.
+
+    Las series salen de los saldos materializados de los movimientos (saldo de
+    una cuenta) o de una suma acumulada de los montos agrupados por fecha
+    (patrimonio neto), y se reducen del lado del servidor a la cantidad de
+    puntos que puede dibujar el gráfico.
+"""
+import heapq
+from datetime import timedelta
+from itertools import accumulate
+
+from django.db.models import Sum
+
+from .models import Account, Movement
+
+
+def account_balance_series(account, date_from=None, date_to=None):
+    """ Devuelve una lista de tuplas (fecha, saldo) con el saldo de la cuenta
+        al final de cada día con movimientos entre date_from y date_to.
+        Si se indica date_from, el primer punto es el saldo de apertura (al
+        final del día anterior).
+        Recorre dos rangos de índice (account_in, date) y (account_out, date)
+        y los intercala en el orden de la planilla, sin agregaciones."""
+    movs_in = account.movements_in.all()
+    movs_out = account.movements_out.exclude(account_in=account)
+    if date_from is not None:
+        movs_in = movs_in.filter(date__gte=date_from)
+        movs_out = movs_out.filter(date__gte=date_from)
+    if date_to is not None:
+        movs_in = movs_in.filter(date__lte=date_to)
+        movs_out = movs_out.filter(date__lte=date_to)
+    movs_in = movs_in.order_by('date', 'pk')\
+        .values_list('date', 'pk', 'balance_after_in')
+    movs_out = movs_out.order_by('date', 'pk')\
+        .values_list('date', 'pk', 'balance_after_out')
+
+    points = []
+    if date_from is not None:
+        points.append((date_from - timedelta(days=1),
+                       account.balance_before(date_from)))
+    for date, pk, balance in heapq.merge(movs_in.iterator(),
+                                         movs_out.iterator(),
+                                         key=lambda row: row[:2]):
+        if points and points[-1][0] == date:
+            points[-1] = (date, balance)
+        else:
+            points.append((date, balance))
+    return points
+
+
+def net_worth_series(date_from=None, date_to=None):
+    """ Devuelve una lista de tuplas (fecha, saldo) con la suma de los saldos
+        de todas las cuentas al final de cada día con movimientos.
+        Los traspasos entre cuentas no cambian el total, así que alcanza con
+        agrupar por fecha las entradas y salidas puras y acumularlas."""
+    start = Account.objects.aggregate(total=Sum('balance_start'))['total'] or 0
+    movements = Movement.objects.order_by()
+    if date_to is not None:
+        movements = movements.filter(date__lte=date_to)
+    deltas = {}
+    for date, total in movements.filter(account_out=None)\
+            .values_list('date').annotate(Sum('amount')):
+        deltas[date] = deltas.get(date, 0) + total
+    for date, total in movements.filter(account_in=None)\
+            .values_list('date').annotate(Sum('amount')):
+        deltas[date] = deltas.get(date, 0) - total
+
+    dates = sorted(deltas)
+    balances = accumulate((deltas[date] for date in dates), initial=start)
+    opening = next(balances)
+    points = []
+    for date, balance in zip(dates, balances):
+        if date_from is not None and date < date_from:
+            opening = balance
+            continue
+        points.append((date, balance))
+    if date_from is not None:
+        points.insert(0, (date_from - timedelta(days=1), opening))
+    return points
+
+
+def lttb(points, threshold):
+    """ Reduce la serie a threshold puntos con el algoritmo
+        Largest-Triangle-Three-Buckets, que conserva la forma visual
+        (picos y valles) de la serie."""
+    if threshold >= len(points) or threshold < 3:
+        return list(points)
+    xs = [date.toordinal() for date, balance in points]
+    ys = [float(balance) for date, balance in points]
+    sampled = [points[0]]
+    bucket_size = (len(points) - 2) / (threshold - 2)
+    previous = 0
+    for bucket in range(threshold - 2):
+        start = int(bucket * bucket_size) + 1
+        end = int((bucket + 1) * bucket_size) + 1
+        # Promedio del bucket siguiente
+        next_start = end
+        next_end = min(int((bucket + 2) * bucket_size) + 1, len(points))
+        count = next_end - next_start
+        avg_x = sum(xs[next_start:next_end]) / count
+        avg_y = sum(ys[next_start:next_end]) / count
+        # Punto del bucket que forma el triángulo más grande con el punto
+        # elegido anterior y el promedio del siguiente
+        best, best_area = start, -1
+        for index in range(start, end):
+            area = abs((xs[previous] - avg_x) * (ys[index] - ys[previous])
+                       - (xs[previous] - xs[index]) * (avg_y - ys[previous]))
+            if area > best_area:
+                best, best_area = index, area
+        sampled.append(points[best])
+        previous = best
+    sampled.append(points[-1])
+    return sampled
+
+
+def minmax(points, threshold):
+    """ Reduce la serie a (a lo sumo) threshold puntos conservando el mínimo y
+        el máximo de cada bucket, en orden cronológico."""
+    if threshold >= len(points) or threshold < 4:
+        return list(points)
+    buckets = threshold // 2
+    bucket_size = len(points) / buckets
+    sampled = []
+    for bucket in range(buckets):
+        chunk = range(int(bucket * bucket_size), int((bucket + 1) * bucket_size))
+        low = min(chunk, key=lambda index: points[index][1])
+        high = max(chunk, key=lambda index: points[index][1])
+        for index in sorted({low, high}):
+            sampled.append(points[index])
+    return sampled
+
+
+DOWNSAMPLERS = {
+    'lttb': lttb,
+    'minmax': minmax,
+}
+
+
+def balance_history(account=None, date_from=None, date_to=None,
+                    points=500, method='lttb'):
+    """ Serie de saldos de una cuenta (o del patrimonio neto si account es
+        None), reducida a points puntos con el método indicado."""
+    if account is None:
+        series = net_worth_series(date_from, date_to)
+    else:
+        series = account_balance_series(account, date_from, date_to)
+    return DOWNSAMPLERS[method](series, points)
@@ -0,0 +1,200 @@
+""" Eventos en vivo de movimientos, para la planilla (Server-Sent Events).
+
+    Cada alta, modificación o baja de un movimiento publica, después de que
+    se confirma la transacción, un evento compacto:
+
+        {"action": "created" | "updated" | "deleted",
+         "id": 12,
+         "movement": {...fila como en la API..., o null si se borró},
+         "balances": {"3": "1520.00", "5": "-40.00"}}
+
+    con los saldos actuales de las cuentas afectadas. La fila y los saldos se
+    leen al publicar, no al guardar: si la transacción se deshace no se
+    publica nada, y si un movimiento cambió varias veces en la misma
+    transacción cada evento trae el estado final. Los movimientos guardados
+    dentro de un LedgerBatch se publican juntos al aplicar el lote (dos
+    consultas por lote en lugar de dos por movimiento).
+
+    El flujo de eventos sólo se sirve bajo ASGI (o con
+    FINPER_EVENTS['STREAM'] = True): bajo WSGI, Django consume el generador
+    asincrónico entero antes de responder, así que la conexión nunca
+    terminaría. Si no se sirve, la vista responde 204 y la planilla no se
+    conecta.
+
+    El broadcaster reparte los eventos entre los suscriptores (las
+    conexiones abiertas a async/events/, ver finper/async_views.py). Se elige
+    con FINPER_EVENTS['BROADCASTER']: LocalBroadcaster reparte dentro del
+    proceso, así que con varios procesos cada uno ve sólo sus escrituras;
+    para repartir entre procesos hace falta un broadcaster compartido
+    (Redis pub/sub, LISTEN/NOTIFY de PostgreSQL) con la misma interfaz:
+    publish(event) y subscribe(), que devuelve un objeto con
+    'async get(timeout)' y close().
+"""
+import asyncio
+import threading
+from functools import lru_cache
+
+from django.conf import settings
+from django.core.handlers.asgi import ASGIRequest
+from django.db import DEFAULT_DB_ALIAS, transaction
+from django.utils.module_loading import import_string
+
+from .metrics import EVENT_SUBSCRIBERS, EVENTS_PUBLISHED
+from .models import Account, Movement
+from .serializers import MOVEMENT_FIELDS, _decimal, serialize_row, values
+
+EVENTS_DEFAULTS = {
+    'BROADCASTER': 'finper.events.LocalBroadcaster',
+    # Eventos que puede acumular una conexión lenta antes de que se la
+    # descarte (recibe 'resync' y tiene que recargar)
+    'QUEUE_SIZE': 100,
+    # Comentario periódico para que los proxies no corten la conexión
+    'KEEPALIVE_SECONDS': 15,
+    # Servir el flujo de eventos. None: sólo bajo ASGI (bajo WSGI cada
+    # conexión abierta ocuparía un hilo del servidor para siempre)
+    'STREAM': None,
+}
+
+RESYNC = {'action': 'resync'}
+
+
+def events_settings():
+    return {**EVENTS_DEFAULTS, **getattr(settings, 'FINPER_EVENTS', {})}
+
+
+def streaming_enabled(request):
+    """ Indica si se sirve el flujo de eventos en vivo para request."""
+    stream = events_settings()['STREAM']
+    if stream is None:
+        return isinstance(request, ASGIRequest)
+    return stream
+
+
+class Subscription:
+    """ Cola de eventos de una conexión. Se crea y se lee desde el event loop
+        de la conexión; publish() puede llamarse desde cualquier hilo."""
+
+    def __init__(self, broadcaster, size):
+        self.broadcaster = broadcaster
+        self.loop = asyncio.get_running_loop()
+        self.queue = asyncio.Queue(size)
+        self.overflowed = False
+
+    def put(self, event):
+        """ Corre en el event loop de la conexión."""
+        if self.overflowed:
+            return
+        if self.queue.full():
+            # La conexión no da abasto: los eventos pendientes ya no sirven,
+            # se le pide que recargue
+            self.overflowed = True
+            while not self.queue.empty():
+                self.queue.get_nowait()
+            event = RESYNC
+        self.queue.put_nowait(event)
+
+    async def get(self, timeout=None):
+        """ Espera el próximo evento; None si pasan timeout segundos."""
+        try:
+            return await asyncio.wait_for(self.queue.get(), timeout)
+        except asyncio.TimeoutError:
+            return None
+
+    def close(self):
+        self.broadcaster.unsubscribe(self)
+
+
+class LocalBroadcaster:
+    """ Reparte los eventos entre los suscriptores del mismo proceso."""
+
+    def __init__(self, queue_size=None):
+        self.queue_size = queue_size or events_settings()['QUEUE_SIZE']
+        self.subscriptions = set()
+        self.lock = threading.Lock()
+
+    def subscribe(self):
+        subscription = Subscription(self, self.queue_size)
+        with self.lock:
+            self.subscriptions.add(subscription)
+            EVENT_SUBSCRIBERS.set(len(self.subscriptions))
+        return subscription
+
+    def unsubscribe(self, subscription):
+        with self.lock:
+            self.subscriptions.discard(subscription)
+            EVENT_SUBSCRIBERS.set(len(self.subscriptions))
+
+    def publish(self, event):
+        with self.lock:
+            subscriptions = list(self.subscriptions)
+        for subscription in subscriptions:
+            try:
+                subscription.loop.call_soon_threadsafe(subscription.put, event)
+            except RuntimeError:
+                # El event loop de la conexión ya terminó
+                self.unsubscribe(subscription)
+
+
+@lru_cache(maxsize=None)
+def get_broadcaster():
+    """ El broadcaster configurado en FINPER_EVENTS['BROADCASTER']."""
+    return import_string(events_settings()['BROADCASTER'])()
+
+
+def publish_movements(changes, using=DEFAULT_DB_ALIAS):
+    """ Publica los eventos de changes, una lista de (acción, id del
+        movimiento, ids de sus cuentas), con las filas y los saldos leídos
+        ahora (dos consultas en total)."""
+    rows = {row['id']: serialize_row(row, MOVEMENT_FIELDS) for row in values(
+        Movement.objects.using(using).filter(
+            pk__in={pk for action, pk, accounts in changes if action != 'deleted'}),
+        MOVEMENT_FIELDS)}
+    affected = {}
+    for action, pk, accounts in changes:
+        row = rows.get(pk) if action != 'deleted' else None
+        if action != 'deleted' and row is None:
+            # Se borró antes de publicar: llega su propio evento de baja
+            continue
+        if row is not None:
+            accounts = (*accounts, row['account_in'], row['account_out'])
+        affected[action, pk] = (row, {account for account in accounts if account is not None})
+    balances = dict(Account.objects.using(using).filter(
+        pk__in={account for row, accounts in affected.values() for account in accounts})
+        .values_list('pk', 'balance'))
+
+    broadcaster = get_broadcaster()
+    for (action, pk), (row, accounts) in affected.items():
+        broadcaster.publish({
+            'action': action,
+            'id': pk,
+            'movement': row,
+            'balances': {str(account): _decimal(balances[account])
+                         for account in sorted(accounts) if account in balances},
+        })
+        EVENTS_PUBLISHED.inc()
+
+
+def movement_changed(action, movement, using=DEFAULT_DB_ALIAS):
+    """ Anota el evento de movement para publicarlo al confirmar la
+        transacción (o al aplicar el LedgerBatch en curso). Las cuentas
+        anteriores del movimiento también cambiaron de saldo."""
+    from .ledger import current_batch
+    accounts = {movement.account_in_id, movement.account_out_id}
+    if action == 'updated':
+        accounts |= {movement.tracker.previous('account_in_id'),
+                     movement.tracker.previous('account_out_id')}
+    change = (action, movement.pk, tuple(pk for pk in accounts if pk is not None))
+    batch = current_batch()
+    if batch is not None:
+        batch.events.append(change)
+    else:
+        transaction.on_commit(lambda: publish_movements([change], using), using,
+                              robust=True)
+
+
+def post_save(sender, instance, created, using, **kwargs):
+    movement_changed('created' if created else 'updated', instance, using)
+
+
+def post_delete(sender, instance, using, **kwargs):
+    movement_changed('deleted', instance, using)
@@ -1,23 +1,106 @@
+from datetime import timedelta
+
 from django import forms
+from django.db.models import Q
 from django.utils import timezone
 
+from .cache import ledger_cached
+from .errors import AccountError
+from .ledger import (LedgerBatch, internal_transfers, merge_accounts, reassign_account,
+                     recategorize)
 from .models import Movement, Account, Category
 
 
+class SharedChoiceIterator(forms.models.ModelChoiceIterator):
+    """ Recorre los objetos ya leídos del campo en lugar de consultar el
+        queryset (ver SharedModelChoiceField)."""
+
+    def __iter__(self):
+        if self.field.empty_label is not None:
+            yield ('', self.field.empty_label)
+        for obj in self.field.objects:
+            yield self.choice(obj)
+
+    def __len__(self):
+        return len(self.field.objects) + (self.field.empty_label is not None)
+
+
+class SharedModelChoiceField(forms.ModelChoiceField):
+    """ ModelChoiceField que, después de share(objects), usa esa lista de
+        objetos ya leídos para dibujar las opciones y para validar, sin
+        consultar la base. Varios campos y formularios pueden compartir la
+        misma lista. Sin share() se comporta como un ModelChoiceField común."""
+
+    objects = None
+
+    def share(self, objects):
+        self.objects = objects
+        self.by_key = {str(self.prepare_value(obj)): obj for obj in objects}
+        self.iterator = SharedChoiceIterator
+        # Al cambiar el iterador hay que regenerar el widget
+        self.widget.choices = self.choices
+
+    def to_python(self, value):
+        if self.objects is None:
+            return super().to_python(value)
+        if value in self.empty_values:
+            return None
+        try:
+            return self.by_key[str(self.prepare_value(value))]
+        except KeyError:
+            raise forms.ValidationError(self.error_messages['invalid_choice'],
+                                        code='invalid_choice',
+                                        params={'value': value})
+
+
+def movement_choices():
+    """ Cuentas y categorías para los campos de elección de los movimientos,
+        cacheadas bajo la versión del libro: con el caché caliente dibujar y
+        validar un formulario no consulta la base. Las altas, cambios y bajas
+        de cuentas y categorías incrementan la versión."""
+    return ledger_cached('movement_choices', [], lambda: {
+        'accounts': list(Account.objects.order_by('name')),
+        'categories': list(Category.objects.all()),
+    })
+
+
+class SharedChoicesMixin:
+    """ Toma las opciones de las cuentas y la categoría de movement_choices(),
+        o de shared_choices si se las pasa (un formset las lee una vez para
+        todas las filas). Los dos campos de cuenta comparten la lista."""
+    shared_fields = {'account_in': 'accounts', 'account_out': 'accounts',
+                     'category': 'categories'}
+
+    def __init__(self, *args, shared_choices=None, **kwargs):
+        super().__init__(*args, **kwargs)
+        choices = shared_choices or movement_choices()
+        for name, key in self.shared_fields.items():
+            self.fields[name].share(choices[key])
+
+
 # Añadir movimiento nuevo
 # ModelForm
 # View: add_movement
 # Template: finper/add_movement.html
 # url: add_movement_model
-class MovementModelForm(forms.ModelForm):
+class MovementModelForm(SharedChoicesMixin, forms.ModelForm):
 
-    detail = forms.CharField(required=False)
-    account_in = forms.ModelChoiceField(queryset=Account.objects.all(), required=False)
-    account_out = forms.ModelChoiceField(queryset=Account.objects.all(), required=False)
+    detail = forms.CharField(label='Detalle', required=False)
+    account_in = SharedModelChoiceField(queryset=Account.objects.all(), required=False,
+                                        label='Cta. de entrada')
+    account_out = SharedModelChoiceField(queryset=Account.objects.all(), required=False,
+                                         label='Cta. de salida')
 
     class Meta:
         model = Movement
         fields = '__all__'
+        field_classes = {'category': SharedModelChoiceField}
+
+    def _get_validation_exclusions(self):
+        # Las cuentas y la categoría ya se validaron contra las opciones
+        # compartidas: la validación del modelo volvería a consultar si
+        # existen, una vez por campo
+        return super()._get_validation_exclusions() | set(self.shared_fields)
 
 
 # Añadir movimiento nuevo
@@ -25,21 +108,21 @@ class MovementModelForm(forms.ModelForm):
 # View: add_movement
 # Template: finper/add_movement.html
 # url: add_movement
-class MovementForm(forms.Form):
+class MovementForm(SharedChoicesMixin, forms.Form):
     date = forms.DateField(label='Fecha', initial=timezone.now)
     title = forms.CharField(label='Concepto', max_length=20)
     detail = forms.CharField(label='Detalle', max_length=30, required=False)
     amount = forms.DecimalField(label='Monto')
     currency = forms.CharField(label='Moneda', max_length=3)
-    account_in = forms.ModelChoiceField(
+    account_in = SharedModelChoiceField(
         queryset=Account.objects.all(),
         required=False,
         label='Cta. de entrada')
-    account_out = forms.ModelChoiceField(
+    account_out = SharedModelChoiceField(
         queryset=Account.objects.all(),
         required=False,
         label='Cta. de salida')
-    category = forms.ModelChoiceField(queryset=Category.objects.all(), label='Categoría')
+    category = SharedModelChoiceField(queryset=Category.objects.all(), label='Categoría')
 
 
 # Añadir cuenta nueva
@@ -65,3 +148,229 @@ class AccountModModelForm(forms.ModelForm):
     class Meta():
         model = Account
         fields = ['codename', 'name']
+
+
+# Fusionar una cuenta en otra
+# Form (no ModelForm)
+# View: AccountMerge
+# Template: finper/account_merge.html
+# url: merge_acc
+class AccountMergeForm(forms.Form):
+    target = SharedModelChoiceField(queryset=Account.objects.all(), label='Fusionar en')
+    delete_transfers = forms.BooleanField(
+        required=False, label='Borrar los traspasos entre las dos cuentas')
+
+    def __init__(self, *args, source, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.source = source
+        self.transfers = []
+        self.fields['target'].share([account for account in movement_choices()['accounts']
+                                     if account.pk != source.pk])
+
+    def clean(self):
+        """ Si hay traspasos entre las dos cuentas, los deja en transfers para
+            mostrarlos y pide confirmar que se borran."""
+        cleaned_data = super().clean()
+        target = cleaned_data.get('target')
+        if target is not None:
+            self.transfers = list(internal_transfers(self.source, target)
+                                  .select_related('account_in', 'account_out')
+                                  .order_by('date', 'pk'))
+            if self.transfers and not cleaned_data.get('delete_transfers'):
+                self.add_error('delete_transfers',
+                               f'Hay {len(self.transfers)} traspasos entre las dos '
+                               f'cuentas, que al fusionar se borran.')
+        return cleaned_data
+
+    def merge(self):
+        """ Fusiona la cuenta en la elegida (ver ledger.merge_accounts)."""
+        return merge_accounts(self.source, self.cleaned_data['target'],
+                              delete_transfers=self.cleaned_data['delete_transfers'])
+
+
+# Filtrar movimientos
+# Form (no ModelForm), con datos de la query string
+# View: movlist, mov_sheet
+# Template: finper/movement_filter.html
+class MovementFilterForm(forms.Form):
+    DIRECTION_CHOICES = [
+        ('', 'Entrada o salida'),
+        ('in', 'Entrada'),
+        ('out', 'Salida'),
+    ]
+
+    date_from = forms.DateField(label='Desde', required=False)
+    date_to = forms.DateField(label='Hasta', required=False)
+    account = forms.ModelChoiceField(
+        queryset=Account.objects.all(),
+        required=False,
+        label='Cuenta')
+    direction = forms.ChoiceField(
+        choices=DIRECTION_CHOICES,
+        required=False,
+        label='Sentido')
+    category = forms.ModelChoiceField(
+        queryset=Category.objects.all(),
+        required=False,
+        label='Categoría')
+    currency = forms.CharField(label='Moneda', max_length=3, required=False)
+    amount_min = forms.DecimalField(label='Monto mínimo', required=False)
+    amount_max = forms.DecimalField(label='Monto máximo', required=False)
+
+    def filter(self, queryset):
+        """ Aplica al queryset de movimientos los filtros válidos.
+            Todos se resuelven en SQL: fechas, cuenta, categoría y moneda
+            sobre los índices compuestos (cuenta, fecha), (categoría, fecha)
+            y (moneda, fecha); el rango de montos, sobre las filas que dejan
+            los demás filtros."""
+        if not self.is_valid():
+            return queryset
+        data = self.cleaned_data
+        if data['date_from']:
+            queryset = queryset.filter(date__gte=data['date_from'])
+        if data['date_to']:
+            queryset = queryset.filter(date__lte=data['date_to'])
+        if data['account']:
+            if data['direction'] == 'in':
+                queryset = queryset.filter(account_in=data['account'])
+            elif data['direction'] == 'out':
+                queryset = queryset.filter(account_out=data['account'])
+            else:
+                queryset = queryset.filter(Q(account_in=data['account']) |
+                                           Q(account_out=data['account']))
+        if data['category']:
+            queryset = queryset.filter(category=data['category'])
+        if data['currency']:
+            queryset = queryset.filter(currency=data['currency'])
+        if data['amount_min'] is not None:
+            queryset = queryset.filter(amount__gte=data['amount_min'])
+        if data['amount_max'] is not None:
+            queryset = queryset.filter(amount__lte=data['amount_max'])
+        return queryset
+
+    def is_filtered(self):
+        """ Indica si hay algún filtro aplicado."""
+        return self.is_valid() and any(
+            value not in (None, '') for value in self.cleaned_data.values())
+
+    def window(self):
+        """ Devuelve las fechas (desde, hasta) del filtro. Cualquiera de las
+            dos puede ser None."""
+        if not self.is_valid():
+            return None, None
+        return self.cleaned_data['date_from'], self.cleaned_data['date_to']
+
+    def opening_balance(self, account):
+        """ Saldo de la cuenta al comienzo de la ventana de fechas."""
+        date_from, date_to = self.window()
+        if date_from is None:
+            return account.balance_start
+        return account.balance_before(date_from)
+
+    def closing_balance(self, account):
+        """ Saldo de la cuenta al final de la ventana de fechas."""
+        date_from, date_to = self.window()
+        if date_to is None:
+            return account.balance
+        return account.balance_before(date_to + timedelta(days=1))
+
+
+# Carga masiva de movimientos, como en una planilla
+# ModelForm y ModelFormSet
+# View: MovBulkCreate
+# Template: finper/mov_bulk.html
+# url: bulk_movements
+class MovementBulkForm(MovementModelForm):
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.saved = False
+
+
+class BaseMovementBulkFormSet(forms.BaseModelFormSet):
+    """ Formset de movimientos nuevos. Toma las cuentas y las categorías una
+        sola vez y las comparte entre todas las filas; save_valid() guarda
+        las filas válidas en un LedgerBatch."""
+
+    def __init__(self, *args, **kwargs):
+        kwargs.setdefault('queryset', Movement.objects.none())
+        super().__init__(*args, **kwargs)
+        self.shared_choices = movement_choices()
+
+    def get_form_kwargs(self, index):
+        kwargs = super().get_form_kwargs(index)
+        kwargs['shared_choices'] = self.shared_choices
+        return kwargs
+
+    def save_valid(self):
+        """ Guarda, en una sola transacción y con una actualización de saldo
+            por cuenta, las filas completas y válidas. Las filas sin cuentas
+            reciben el error. Devuelve la cantidad de movimientos guardados."""
+        saved = []
+        with LedgerBatch():
+            for form in self.forms:
+                if not form.has_changed() or not form.is_valid():
+                    continue
+                try:
+                    form.save()
+                except AccountError as error:
+                    form.add_error(None, str(error))
+                else:
+                    saved.append(form)
+        for form in saved:
+            form.saved = True
+        return len(saved)
+
+    def pending_forms(self):
+        """ Filas con datos que no se guardaron (con errores)."""
+        return [form for form in self.forms if form.has_changed() and not form.saved]
+
+
+MovementBulkFormSet = forms.modelformset_factory(
+    Movement, form=MovementBulkForm, formset=BaseMovementBulkFormSet,
+    extra=10, max_num=200, validate_max=True)
+
+
+# Acciones sobre los movimientos seleccionados
+# Form (no ModelForm)
+# View: MovTableView (planilla) y MovementAdmin
+# Template: finper/mov_sheet.html, admin/finper/movement/bulk_action.html
+class MovementBulkActionForm(forms.Form):
+    RECATEGORIZE = 'recategorize'
+    ACCOUNT_IN = 'account_in'
+    ACCOUNT_OUT = 'account_out'
+    ACTIONS = [
+        (RECATEGORIZE, 'Cambiar la categoría'),
+        (ACCOUNT_IN, 'Cambiar la cuenta de entrada'),
+        (ACCOUNT_OUT, 'Cambiar la cuenta de salida'),
+    ]
+
+    action = forms.ChoiceField(label='Acción', choices=ACTIONS)
+    category = SharedModelChoiceField(queryset=Category.objects.all(), required=False,
+                                      label='Categoría')
+    account = SharedModelChoiceField(queryset=Account.objects.all(), required=False,
+                                     label='Cuenta')
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        choices = movement_choices()
+        self.fields['category'].share(choices['categories'])
+        self.fields['account'].share(choices['accounts'])
+
+    def clean(self):
+        cleaned_data = super().clean()
+        action = cleaned_data.get('action')
+        if action == self.RECATEGORIZE and cleaned_data.get('category') is None:
+            self.add_error('category', 'Elija la categoría nueva.')
+        if action in (self.ACCOUNT_IN, self.ACCOUNT_OUT) and cleaned_data.get('account') is None:
+            self.add_error('account', 'Elija la cuenta nueva.')
+        return cleaned_data
+
+    def apply(self, movements):
+        """ Aplica la acción a los movimientos de movements (un queryset).
+            Devuelve la cantidad de movimientos cambiados."""
+        action = self.cleaned_data['action']
+        if action == self.RECATEGORIZE:
+            return recategorize(movements, self.cleaned_data['category'])
+        side = 'in' if action == self.ACCOUNT_IN else 'out'
+        return reassign_account(movements, side, self.cleaned_data['account'])
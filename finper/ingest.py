@@ -0,0 +1,131 @@
+""" Ingesta de movimientos en NDJSON (un objeto JSON por línea).
+
+    ingest() lee las líneas de a una, sin cargar todo el cuerpo en memoria,
+    y valida cada una con MovementModelForm. Las líneas válidas se juntan y
+    se guardan de a lotes en un LedgerBatch (una actualización de saldo por
+    cuenta por lote). Un lote se guarda cuando llega a BATCH_SIZE líneas o
+    cuando pasaron BATCH_SECONDS desde la primera línea del lote; la lectura
+    se hace fuera de la transacción, así que un emisor lento no la deja
+    abierta. La memoria depende del tamaño del lote, no del de la entrada.
+
+    Por cada línea se devuelve un resultado, en orden, después de guardar el
+    lote que la contiene:
+        {"line": 3, "status": 201, "id": 42}
+        {"line": 4, "status": 400, "error": {...}}
+    Si el lote falla en la base de datos se deshace entero y sus líneas
+    válidas se informan con status 409 y "rolled_back": true. Al final se
+    devuelve un resumen: {"summary": {"lines": ..., "saved": ..., "errors": ...}}.
+"""
+import gc
+import json
+import time
+
+from django.conf import settings
+from django.db import DatabaseError
+
+from .errors import AccountError
+from .forms import MovementModelForm
+from .ledger import LedgerBatch
+
+INGEST_DEFAULTS = {
+    'BATCH_SIZE': 500,
+    'BATCH_SECONDS': 2.0,
+    # Las líneas más largas se rechazan sin leerlas enteras en memoria
+    'MAX_LINE_BYTES': 64 * 1024,
+}
+
+
+def ingest_settings():
+    return {**INGEST_DEFAULTS, **getattr(settings, 'FINPER_INGEST', {})}
+
+
+def read_lines(stream, max_bytes):
+    """ Lee stream (con readline(size)) y genera (número, línea). Las líneas
+        de más de max_bytes se descartan a medida que se leen y se generan
+        como (número, None). Las líneas en blanco se saltean."""
+    number = 0
+    while True:
+        line = stream.readline(max_bytes + 1)
+        if not line:
+            return
+        number += 1
+        if len(line) > max_bytes and not line.endswith(b'\n'):
+            while line and not line.endswith(b'\n'):
+                line = stream.readline(max_bytes + 1)
+            yield number, None
+        elif line.strip():
+            yield number, line
+
+
+def _validate(line):
+    """ Devuelve el movimiento de la línea, validado y sin guardar, o el
+        error. El lote guarda el movimiento y no el formulario, que ocupa
+        bastante más."""
+    if line is None:
+        return None, 'Línea demasiado larga'
+    try:
+        data = json.loads(line)
+    except ValueError as error:
+        return None, f'JSON inválido: {error}'
+    if not isinstance(data, dict):
+        return None, 'Se esperaba un objeto JSON'
+    form = MovementModelForm(data)
+    if not form.is_valid():
+        return None, form.errors
+    return form.instance, None
+
+
+def _save_batch(pending):
+    """ Guarda los movimientos válidos de pending en un LedgerBatch y
+        devuelve los resultados de todas las líneas, en orden."""
+    results = []
+    try:
+        with LedgerBatch():
+            for number, movement, error in pending:
+                if movement is None:
+                    results.append({'line': number, 'status': 400, 'error': error})
+                    continue
+                try:
+                    # Sin cuentas, AccountError sale antes de escribir nada
+                    movement.save()
+                except AccountError as error:
+                    results.append({'line': number, 'status': 400, 'error': str(error)})
+                else:
+                    results.append({'line': number, 'status': 201, 'id': movement.pk})
+    except DatabaseError as failure:
+        return [{'line': number, 'status': 400, 'error': error}
+                if movement is None else
+                {'line': number, 'status': 409, 'error': str(failure), 'rolled_back': True}
+                for number, movement, error in pending]
+    return results
+
+
+def ingest(stream, config=None):
+    """ Genera los resultados de cada línea de stream y, al final, el
+        resumen (ver el docstring del módulo)."""
+    config = config or ingest_settings()
+    summary = {'lines': 0, 'saved': 0, 'errors': 0}
+    pending = []
+    started = None
+
+    def flush():
+        for result in _save_batch(pending):
+            summary['saved' if result['status'] == 201 else 'errors'] += 1
+            yield result
+        pending.clear()
+        # Los movimientos y formularios tienen referencias circulares
+        # (FieldTracker, BoundField): se liberan al terminar cada lote, sin
+        # esperar a que el recolector llegue a las generaciones viejas
+        gc.collect()
+
+    for number, line in read_lines(stream, config['MAX_LINE_BYTES']):
+        summary['lines'] += 1
+        if not pending:
+            started = time.monotonic()
+        pending.append((number, *_validate(line)))
+        if (len(pending) >= config['BATCH_SIZE']
+                or time.monotonic() - started >= config['BATCH_SECONDS']):
+            yield from flush()
+    if pending:
+        yield from flush()
+    yield {'summary': summary}
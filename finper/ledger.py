@@ -0,0 +1,225 @@
+""" Operaciones en lote sobre el libro de movimientos.
+
+    Dentro de un LedgerBatch, Movement.save() y Movement.delete() no tocan los
+    saldos de las cuentas ni los saldos materializados: sólo anotan en el
+    lote el efecto de cada operación. Al salir del bloque se aplica todo
+    junto, en la misma transacción que las operaciones:
+    - una sola actualización por cuenta (UPDATE ... SET balance = balance + x);
+    - los saldos materializados de cada cuenta: si el lote sólo borró
+      movimientos o les cambió el monto, se corren con UPDATE por rangos a
+      partir de la primera posición tocada; si agregó movimientos o los
+      cambió de lugar (de fecha o de cuenta), se recalculan a partir de la
+      fecha más temprana que tocó el lote;
+    - un solo incremento de la versión del libro;
+    - un solo INSERT en el registro de cambios para las cuentas;
+    - los eventos en vivo de todos los movimientos juntos, al confirmar la
+      transacción (ver finper/events.py).
+    Si el bloque termina con una excepción, se deshace todo.
+
+    Los objetos Account que estén en memoria no se actualizan: hay que
+    releerlos después del lote.
+
+    recategorize(), reassign_account() y merge_accounts() cambian muchos
+    movimientos con un solo UPDATE, sin pasar por Movement.save().
+"""
+from contextvars import ContextVar
+
+from django.db import DEFAULT_DB_ALIAS, transaction
+from django.db.models import F, Min, Q, Sum
+
+from .cache import bump_ledger_version
+from .errors import AccountError
+from .models import (Account, Change, Movement, _lock_accounts,
+                     running_balances_enabled)
+
+_current_batch = ContextVar('finper_ledger_batch', default=None)
+
+
+def current_batch():
+    """ Devuelve el LedgerBatch en curso, o None."""
+    return _current_batch.get()
+
+
+class LedgerBatch:
+    """ Context manager que agrupa escrituras de movimientos (ver el
+        docstring del módulo). Un lote dentro de otro se suma al exterior."""
+
+    def __init__(self, using=DEFAULT_DB_ALIAS):
+        self.using = using
+        self.deltas = {}
+        self.since = {}
+        self.shifts = {}
+        self.rebuild = set()
+        self.events = []
+        self.outer = None
+
+    def __enter__(self):
+        self.outer = current_batch()
+        if self.outer is not None:
+            return self.outer
+        self.atomic = transaction.atomic(using=self.using)
+        self.atomic.__enter__()
+        self.token = _current_batch.set(self)
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if self.outer is not None:
+            return False
+        _current_batch.reset(self.token)
+        if exc_type is None:
+            try:
+                self.apply()
+            except BaseException as error:
+                self.atomic.__exit__(type(error), error, error.__traceback__)
+                raise
+        return self.atomic.__exit__(exc_type, exc_value, traceback)
+
+    def add(self, deltas, date, pk=None):
+        """ Anota el efecto de una operación: deltas es {id de cuenta: cambio
+            de saldo} y date la fecha del movimiento. pk es el movimiento si
+            la operación no lo cambia de lugar en la planilla (una baja o un
+            cambio de monto): basta con correr los saldos materializados
+            desde su posición. Si pk es None, los saldos de las cuentas se
+            recalculan desde date."""
+        date = Movement._meta.get_field('date').to_python(date)
+        for accountid, delta in deltas.items():
+            self.deltas[accountid] = self.deltas.get(accountid, 0) + delta
+            if accountid not in self.since or date < self.since[accountid]:
+                self.since[accountid] = date
+            if pk is None:
+                self.rebuild.add(accountid)
+            else:
+                self.shifts.setdefault(accountid, []).append((date, pk, delta))
+
+    def apply(self):
+        """ Aplica a las cuentas el efecto acumulado del lote."""
+        accounts = Account.objects.using(self.using)
+        changed = [accountid for accountid in sorted(self.deltas) if self.deltas[accountid]]
+        for accountid in changed:
+            accounts.filter(pk=accountid).update(
+                balance_previous=F('balance'),
+                balance=F('balance') + self.deltas[accountid])
+        Change.record(Change.ACCOUNT, changed, using=self.using)
+        if running_balances_enabled():
+            for account in accounts.filter(pk__in=self.since).order_by('pk'):
+                if account.pk in self.rebuild:
+                    account.rebuild_running_balances(since=self.since[account.pk])
+                else:
+                    account.shift_running_balances_from(self.shifts[account.pk])
+        if self.since:
+            bump_ledger_version()
+        if self.events:
+            from .events import publish_movements
+            events, using = self.events, self.using
+            transaction.on_commit(lambda: publish_movements(events, using), using,
+                                  robust=True)
+
+
+def _movement_updates(rows, using):
+    """ Registra el cambio de los movimientos de rows, pares (id, cuentas
+        anteriores), y anota sus eventos en vivo para cuando se confirme la
+        transacción."""
+    from .events import publish_movements
+    Change.record(Change.MOVEMENT, [pk for pk, accounts in rows], using=using)
+    events = [('updated', pk, tuple(account for account in accounts if account is not None))
+              for pk, accounts in rows]
+    batch = current_batch()
+    if batch is not None:
+        batch.events.extend(events)
+    else:
+        transaction.on_commit(lambda: publish_movements(events, using), using,
+                              robust=True)
+
+
+def recategorize(movements, category, using=DEFAULT_DB_ALIAS):
+    """ Cambia la categoría de los movimientos de movements (un queryset) con
+        un solo UPDATE. No cambia ningún saldo. Devuelve la cantidad de
+        movimientos cambiados."""
+    with transaction.atomic(using=using):
+        rows = [(pk, (account_in, account_out)) for pk, account_in, account_out
+                in movements.using(using).values_list('pk', 'account_in', 'account_out')]
+        updated = Movement.objects.using(using).filter(pk__in=[pk for pk, accounts in rows])\
+            .update(category=category)
+        _movement_updates(rows, using)
+        # Los informes por categoría se cachean bajo la versión del libro
+        bump_ledger_version()
+    return updated
+
+
+def reassign_account(movements, side, account, using=DEFAULT_DB_ALIAS):
+    """ Pasa a account la cuenta de entrada (side='in') o de salida
+        (side='out') de los movimientos de movements (un queryset). El efecto
+        en los saldos se calcula con una sola consulta agrupada por cuenta
+        anterior y se aplica en un LedgerBatch, en la misma transacción que
+        el UPDATE de los movimientos. Devuelve la cantidad de movimientos
+        cambiados."""
+    field = {'in': 'account_in', 'out': 'account_out'}[side]
+    sign = 1 if side == 'in' else -1
+    with LedgerBatch(using) as batch:
+        rows = [(pk, (previous,)) for pk, previous in movements.using(using)
+                .exclude(**{field: account}).values_list('pk', field)]
+        pks = [pk for pk, accounts in rows]
+        # Efecto neto por cuenta: la cuenta anterior pierde los montos de sus
+        # movimientos y la nueva los gana
+        groups = Movement.objects.using(using).filter(pk__in=pks).order_by()\
+            .values_list(field).annotate(total=Sum('amount'), since=Min('date'))
+        for previous, total, since in groups:
+            if previous is not None:
+                batch.add({previous: -sign * total}, since)
+            batch.add({account.pk: sign * total}, since)
+        updated = Movement.objects.using(using).filter(pk__in=pks).update(**{field: account})
+        _movement_updates(rows, using)
+    return updated
+
+
+def internal_transfers(source, target, using=DEFAULT_DB_ALIAS):
+    """ Traspasos entre las cuentas source y target (y de source a sí misma):
+        al fusionarlas quedarían con target de los dos lados."""
+    return Movement.objects.using(using).filter(
+        Q(account_in=source, account_out__in=[source, target])
+        | Q(account_out=source, account_in=target))
+
+
+def merge_accounts(source, target, delete_transfers=False, using=DEFAULT_DB_ALIAS):
+    """ Fusiona la cuenta source en target, en una sola transacción: los
+        movimientos de source pasan a target (dos UPDATE), los saldos de
+        source se suman a los de target y source se borra.
+        Los traspasos entre las dos cuentas (ver internal_transfers()) se
+        borran sólo con delete_transfers; si no, y hay alguno, no se fusiona
+        nada. Las bajas quedan en el registro de cambios.
+        Devuelve (movimientos pasados, traspasos borrados)."""
+    if source.pk == target.pk:
+        raise AccountError('No se puede fusionar una cuenta consigo misma.')
+    movements = Movement.objects.using(using)
+    accounts = Account.objects.using(using)
+    with transaction.atomic(using=using):
+        _lock_accounts([source.pk, target.pk], using)
+        internal = internal_transfers(source, target, using)
+        if not delete_transfers:
+            count = internal.count()
+            if count:
+                raise AccountError(
+                    f'Hay {count} traspasos entre {source.name} y {target.name}, '
+                    f'que al fusionar se borran: hay que confirmarlo.')
+        # Un traspaso entre las dos cuentas suma cero al saldo combinado.
+        # El borrado manda post_delete por cada traspaso: quedan como bajas
+        # en el registro de cambios y en los eventos en vivo
+        removed, _ = internal.delete()
+        moved = movements.filter(Q(account_in=source) | Q(account_out=source))
+        rows = [(pk, (account_in, account_out)) for pk, account_in, account_out
+                in moved.values_list('pk', 'account_in', 'account_out')]
+        movements.filter(account_in=source).update(account_in=target)
+        movements.filter(account_out=source).update(account_out=target)
+        source = accounts.get(pk=source.pk)
+        accounts.filter(pk=target.pk).update(
+            balance_start=F('balance_start') + source.balance_start,
+            balance_previous=F('balance'),
+            balance=F('balance') + source.balance)
+        Change.record(Change.ACCOUNT, [target.pk], using=using)
+        _movement_updates(rows, using)
+        source.delete()
+        if running_balances_enabled():
+            # El saldo inicial de target cambió: se corren todos sus saldos
+            accounts.get(pk=target.pk).rebuild_running_balances()
+        bump_ledger_version()
+    return len(rows), removed
@@ -0,0 +1,48 @@
+import asyncio
+import time
+
+from django.core.management.base import BaseCommand
+from django.test import AsyncClient
+from django.urls import reverse
+
+ENDPOINTS = ('movements_json', 'accounts_json', 'report_json')
+
+
+class Command(BaseCommand):
+    help = 'Compara las vistas JSON sincrónicas con las asincrónicas bajo carga ' \
+           'concurrente, a través del handler ASGI de Django (como un worker ASGI).'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--concurrency', type=int, default=50,
+                            help='Requests simultáneos')
+        parser.add_argument('--requests', type=int, default=500,
+                            help='Requests por vista')
+
+    def handle(self, *args, **options):
+        for endpoint in ENDPOINTS:
+            for prefix in ('', 'async_'):
+                url = reverse(f'finper:{prefix}{endpoint}')
+                elapsed, errors = asyncio.run(
+                    self.load(url, options['concurrency'], options['requests']))
+                self.stdout.write(
+                    f'{url:28} {options["requests"] / elapsed:8.1f} requests/s '
+                    f'({elapsed:.2f} s, {errors} errores)')
+
+    @staticmethod
+    async def load(url, concurrency, requests):
+        """ Hace requests pedidos a url, de a concurrency simultáneos.
+            Devuelve (duración, cantidad de respuestas con error)."""
+        client = AsyncClient()
+        semaphore = asyncio.Semaphore(concurrency)
+        errors = 0
+
+        async def one():
+            nonlocal errors
+            async with semaphore:
+                response = await client.get(url)
+                if response.status_code != 200:
+                    errors += 1
+
+        start = time.perf_counter()
+        await asyncio.gather(*(one() for _ in range(requests)))
+        return time.perf_counter() - start, errors
@@ -0,0 +1,123 @@
+import os
+import shutil
+import tempfile
+import threading
+import time
+from contextlib import contextmanager
+from decimal import Decimal
+
+from django.core.management import call_command
+from django.core.management.base import BaseCommand, CommandError
+from django.db import OperationalError, connection, connections
+from django.test.utils import override_settings
+from django.utils import timezone
+
+from finper.models import Account, Category, Movement
+from finper.sqlite import sqlite_settings
+
+
+class Command(BaseCommand):
+    help = 'Compara el rendimiento de SQLite con y sin el perfil de FINPER_SQLITE: ' \
+           'varios hilos cargan movimientos mientras otros leen saldos, sobre una ' \
+           'base temporal.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--writers', type=int, default=4,
+                            help='Hilos que cargan movimientos')
+        parser.add_argument('--readers', type=int, default=2,
+                            help='Hilos que leen saldos y movimientos')
+        parser.add_argument('--movements', type=int, default=200,
+                            help='Movimientos que carga cada hilo')
+
+    def handle(self, *args, **options):
+        if connection.vendor != 'sqlite':
+            raise CommandError('La base de datos configurada no es SQLite')
+
+        results = {}
+        profile = sqlite_settings()
+        # Sin perfil: ni PRAGMA ni reintentos
+        for name, config in (('sin perfil', {**profile, 'ENABLED': False, 'RETRIES': 0}),
+                             ('con perfil', {**profile, 'ENABLED': True})):
+            with override_settings(FINPER_SQLITE=config), self.temporary_database():
+                results[name] = self.run(options)
+
+        for name, (writes, reads, errors, elapsed) in results.items():
+            self.stdout.write(
+                f'{name}: {writes / elapsed:8.1f} escrituras/s, '
+                f'{reads / elapsed:8.1f} lecturas/s, {errors} errores '
+                f'({elapsed:.2f} s)')
+
+    @contextmanager
+    def temporary_database(self):
+        """ Cambia la base por defecto por una base temporal migrada."""
+        directory = tempfile.mkdtemp()
+        original = connection.settings_dict['NAME']
+        self.switch_database(os.path.join(directory, 'benchmark.sqlite3'))
+        try:
+            call_command('migrate', verbosity=0)
+            yield
+        finally:
+            self.switch_database(original)
+            shutil.rmtree(directory, ignore_errors=True)
+
+    @staticmethod
+    def switch_database(name):
+        connections.close_all()
+        connections.settings['default']['NAME'] = name
+        connection.settings_dict['NAME'] = name
+
+    def run(self, options):
+        accounts = [Account.objects.create(codename=f'bench{i}', name=f'Cuenta {i}',
+                                           balance_start=Decimal(1000))
+                    for i in range(2 * options['writers'])]
+        category = Category.objects.create(name='Benchmark', description='Benchmark')
+        connections.close_all()
+
+        counts = {'writes': 0, 'reads': 0, 'errors': 0}
+        lock = threading.Lock()
+        done = threading.Event()
+
+        def count(key):
+            with lock:
+                counts[key] += 1
+
+        def writer(index):
+            account_in, account_out = accounts[2 * index], accounts[2 * index + 1]
+            try:
+                for number in range(options['movements']):
+                    try:
+                        Movement.objects.create(
+                            date=timezone.now(), title=f'Benchmark {index}-{number}',
+                            amount=Decimal(1), account_in=account_in,
+                            account_out=account_out, category=category)
+                        count('writes')
+                    except OperationalError:
+                        count('errors')
+            finally:
+                connections.close_all()
+
+        def reader():
+            try:
+                while not done.is_set():
+                    try:
+                        for account in Account.objects.all():
+                            account.history(limit=20)
+                        count('reads')
+                    except OperationalError:
+                        count('errors')
+            finally:
+                connections.close_all()
+
+        writers = [threading.Thread(target=writer, args=(index,))
+                   for index in range(options['writers'])]
+        readers = [threading.Thread(target=reader) for _ in range(options['readers'])]
+        start = time.perf_counter()
+        for thread in writers + readers:
+            thread.start()
+        for thread in writers:
+            thread.join()
+        elapsed = time.perf_counter() - start
+        done.set()
+        for thread in readers:
+            thread.join()
+        return counts['writes'], counts['reads'], counts['errors'], elapsed
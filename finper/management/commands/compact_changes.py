@@ -0,0 +1,18 @@
+from django.core.management.base import BaseCommand
+
+from finper.changes import changes_settings, compact_changes
+
+
+class Command(BaseCommand):
+    help = 'Compacta el registro de cambios: descarta los cambios superados ' \
+           'por otro posterior del mismo objeto y las bajas viejas.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--days', type=int,
+                            default=changes_settings()['TOMBSTONE_DAYS'],
+                            help='Descartar las bajas de más de estos días '
+                                 '(por defecto FINPER_CHANGES["TOMBSTONE_DAYS"])')
+
+    def handle(self, *args, **options):
+        superseded, removed = compact_changes(options['days'])
+        self.stdout.write(f'{superseded} cambios superados y {removed} bajas descartados')
@@ -0,0 +1,34 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from finper.errors import AccountError
+from finper.ledger import merge_accounts
+from finper.models import Account
+
+
+class Command(BaseCommand):
+    help = 'Fusiona una cuenta en otra: le pasa todos sus movimientos y sus ' \
+           'saldos, y la borra. Si hay traspasos entre las dos cuentas, hay ' \
+           'que confirmar que se borran con --delete-transfers.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('source', help='Código de la cuenta que se borra')
+        parser.add_argument('target', help='Código de la cuenta que queda')
+        parser.add_argument('--delete-transfers', action='store_true',
+                            help='Borrar los traspasos entre las dos cuentas')
+
+    def account(self, codename):
+        try:
+            return Account.objects.get(codename=codename)
+        except Account.DoesNotExist:
+            raise CommandError(f'No existe la cuenta {codename}')
+
+    def handle(self, *args, **options):
+        source = self.account(options['source'])
+        target = self.account(options['target'])
+        try:
+            moved, removed = merge_accounts(source, target,
+                                            delete_transfers=options['delete_transfers'])
+        except AccountError as error:
+            raise CommandError(error)
+        self.stdout.write(f'{source.name} fusionada en {target.name}: {moved} movimientos '
+                          f'pasados, {removed} traspasos entre las dos borrados')
@@ -0,0 +1,45 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from finper.memory import MemoryTrackingMixin
+from finper.models import Account, reconcile
+
+
+class Command(MemoryTrackingMixin, BaseCommand):
+    help = 'Verifica y recalcula los saldos materializados de los movimientos ' \
+           '(balance_after_in, balance_after_out).'
+
+    def add_arguments(self, parser):
+        parser.add_argument('codenames', nargs='*',
+                            help='Cuentas a procesar (por defecto, todas)')
+        parser.add_argument('--check', action='store_true',
+                            help='Solamente verificar, sin corregir')
+        parser.add_argument('--since',
+                            help='Recalcular a partir de esta fecha (AAAA-MM-DD)')
+
+    def handle(self, *args, **options):
+        accounts = Account.objects.order_by('pk')
+        if options['codenames']:
+            accounts = accounts.filter(codename__in=options['codenames'])
+
+        errors = 0
+        for account in accounts:
+            if options['check']:
+                wrong = account.check_running_balances()
+                for mov, stored, balance in wrong:
+                    self.stdout.write(
+                        f'{account.codename}: movimiento {mov.pk} ({mov.date}) '
+                        f'tiene saldo {stored}, debería ser {balance}')
+                errors += len(wrong)
+            else:
+                fixed = account.rebuild_running_balances(since=options['since'])
+                self.stdout.write(f'{account.codename}: {fixed} movimientos corregidos')
+
+        if options['check']:
+            for account in reconcile():
+                self.stdout.write(
+                    f'{account.codename}: el saldo {account.balance} no coincide '
+                    f'con el saldo inicial más los movimientos')
+                errors += 1
+
+        if errors:
+            raise CommandError(f'{errors} saldos incorrectos')
@@ -0,0 +1,22 @@
+from django.core.management.base import BaseCommand, CommandError
+from django.db import DEFAULT_DB_ALIAS, connections
+
+from finper.routers import replica_alias
+
+
+class Command(BaseCommand):
+    help = 'Copia la base principal SQLite sobre la réplica (FINPER_REPLICA_DB), ' \
+           'para probar localmente las lecturas desde la réplica.'
+
+    def handle(self, *args, **options):
+        alias = replica_alias()
+        if alias is None:
+            raise CommandError('No hay réplica configurada (FINPER_REPLICA_DB)')
+        primary, replica = connections[DEFAULT_DB_ALIAS], connections[alias]
+        if primary.vendor != 'sqlite' or replica.vendor != 'sqlite':
+            raise CommandError('sync_replica sólo copia bases SQLite; con otros '
+                               'motores se usa la replicación del servidor')
+        primary.ensure_connection()
+        replica.ensure_connection()
+        primary.connection.backup(replica.connection)
+        self.stdout.write(f'Réplica {replica.settings_dict["NAME"]} actualizada')
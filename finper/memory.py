@@ -0,0 +1,198 @@
+""" Medición de memoria con tracemalloc.
+
+    track_memory() mide el pico de memoria de un bloque y los lugares del
+    código que más memoria asignaron. Lo usan:
+    - MemoryMiddleware, para cada request, si FINPER_MEMORY['ENABLED'];
+    - los comandos que heredan de MemoryTrackingMixin, con --track-memory;
+    - las pruebas, con memory_budget(), para comprobar que un proceso no
+      supera un presupuesto de memoria.
+    tracemalloc hace más lento todo lo que mide: es sólo para diagnóstico.
+"""
+import json
+import logging
+import threading
+import tracemalloc
+from contextlib import contextmanager
+
+from django.conf import settings
+
+from .middleware import HybridMiddleware
+
+logger = logging.getLogger('finper.memory')
+
+MEMORY_DEFAULTS = {
+    'ENABLED': False,
+    # Cantidad de lugares de asignación que se informan
+    'TOP': 10,
+    # Cantidad de cuadros de la pila que guarda tracemalloc por asignación
+    'FRAMES': 1,
+}
+
+
+def memory_settings():
+    return {**MEMORY_DEFAULTS, **getattr(settings, 'FINPER_MEMORY', {})}
+
+
+class MemoryReport:
+    """ Resultado de track_memory(): pico de memoria (bytes por encima de la
+        memoria al empezar), memoria que quedó asignada al terminar y lugares
+        de asignación con mayor crecimiento."""
+
+    def __init__(self, label):
+        self.label = label
+        self.peak = 0
+        self.allocated = 0
+        self.top = []
+
+    def as_dict(self):
+        return {
+            'label': self.label,
+            'peak_kb': round(self.peak / 1024, 1),
+            'allocated_kb': round(self.allocated / 1024, 1),
+            'top': [{'site': site, 'kb': round(size / 1024, 1), 'count': count}
+                    for site, size, count in self.top],
+        }
+
+    def __str__(self):
+        lines = [f'{self.label}: pico {self.peak / 1024:.1f} KiB, '
+                 f'quedan {self.allocated / 1024:.1f} KiB']
+        lines += [f'  {size / 1024:10.1f} KiB {count:8d}  {site}'
+                  for site, size, count in self.top]
+        return '\n'.join(lines)
+
+
+# tracemalloc es global al proceso: las mediciones en curso (de varios
+# hilos, o anidadas) lo comparten. Lo arranca la primera y lo detiene la
+# última, si no estaba ya activo.
+_lock = threading.Lock()
+_users = 0
+_owner = False
+# [informe, memoria al empezar] de las mediciones en curso
+_active = []
+
+
+def _start_tracing(frames):
+    global _users, _owner
+    with _lock:
+        if _users == 0 and not tracemalloc.is_tracing():
+            tracemalloc.start(frames)
+            _owner = True
+        _users += 1
+
+
+def _stop_tracing():
+    global _users, _owner
+    with _lock:
+        _users -= 1
+        if _users == 0 and _owner:
+            tracemalloc.stop()
+            _owner = False
+
+
+def _begin(report):
+    """ Empieza a medir el pico de report. tracemalloc tiene un solo pico:
+        antes de reiniciarlo, cada medición en curso se guarda el suyo."""
+    with _lock:
+        current, peak = tracemalloc.get_traced_memory()
+        for other, baseline in _active:
+            other.peak = max(other.peak, peak - baseline)
+        tracemalloc.reset_peak()
+        _active.append([report, current])
+
+
+def _finish(report):
+    with _lock:
+        current, peak = tracemalloc.get_traced_memory()
+        entry = next(entry for entry in _active if entry[0] is report)
+        _active.remove(entry)
+        baseline = entry[1]
+        report.peak = max(report.peak, peak - baseline, 0)
+        report.allocated = current - baseline
+
+
+@contextmanager
+def track_memory(label, top=None, snapshots=True):
+    """ Mide la memoria asignada dentro del bloque.
+        Devuelve un MemoryReport que se completa al salir del bloque.
+        Con snapshots=False sólo se mide el pico (mucho más barato).
+        Se puede anidar y usar desde varios hilos a la vez; el pico de cada
+        bloque incluye lo que asignan los demás mientras tanto."""
+    config = memory_settings()
+    top = config['TOP'] if top is None else top
+    _start_tracing(config['FRAMES'])
+    try:
+        report = MemoryReport(label)
+        before = tracemalloc.take_snapshot() if snapshots else None
+        _begin(report)
+        try:
+            yield report
+        finally:
+            _finish(report)
+            if snapshots:
+                after = tracemalloc.take_snapshot().filter_traces([
+                    tracemalloc.Filter(False, tracemalloc.__file__),
+                ])
+                for stat in after.compare_to(before, 'lineno')[:top]:
+                    frame = stat.traceback[0]
+                    report.top.append((f'{frame.filename}:{frame.lineno}',
+                                       stat.size_diff, stat.count_diff))
+    finally:
+        _stop_tracing()
+
+
+@contextmanager
+def memory_budget(max_bytes, label='bloque'):
+    """ Para pruebas: falla con AssertionError si el pico de memoria del
+        bloque supera max_bytes."""
+    with track_memory(label, snapshots=False) as report:
+        yield report
+    if report.peak > max_bytes:
+        raise AssertionError(
+            f'{label}: pico de memoria de {report.peak / 1024:.1f} KiB, '
+            f'el presupuesto es {max_bytes / 1024:.1f} KiB')
+
+
+class MemoryMiddleware(HybridMiddleware):
+    """ Mide la memoria de cada request cuando FINPER_MEMORY['ENABLED'].
+        Agrega el header X-Memory-Peak (en KiB) y registra el informe en el
+        logger 'finper.memory'. Con requests concurrentes la medición incluye
+        lo que asignan los demás."""
+
+    def call(self, request):
+        if not memory_settings()['ENABLED']:
+            return self.get_response(request)
+        with track_memory(f'{request.method} {request.path}') as report:
+            response = self.get_response(request)
+        return self.report(response, report)
+
+    async def acall(self, request):
+        if not memory_settings()['ENABLED']:
+            return await self.get_response(request)
+        with track_memory(f'{request.method} {request.path}') as report:
+            response = await self.get_response(request)
+        return self.report(response, report)
+
+    @staticmethod
+    def report(response, report):
+        response['X-Memory-Peak'] = f'{report.peak / 1024:.1f}'
+        logger.info(json.dumps(report.as_dict()))
+        return response
+
+
+class MemoryTrackingMixin:
+    """ Agrega a un comando de administración la opción --track-memory, que
+        informa el pico de memoria y los principales lugares de asignación."""
+
+    def create_parser(self, prog_name, subcommand, **kwargs):
+        parser = super().create_parser(prog_name, subcommand, **kwargs)
+        parser.add_argument('--track-memory', action='store_true',
+                            help='Informar el uso de memoria (tracemalloc)')
+        return parser
+
+    def execute(self, *args, **options):
+        if not options.get('track_memory'):
+            return super().execute(*args, **options)
+        with track_memory(self.__class__.__module__.rsplit('.', 1)[-1]) as report:
+            output = super().execute(*args, **options)
+        self.stderr.write(str(report))
+        return output
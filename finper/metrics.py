@@ -0,0 +1,302 @@
+""" Métricas de operación del libro de movimientos.
+
+    Registro de métricas en memoria (contadores, gauges e histogramas) con
+    exposición en el formato de texto de Prometheus (vista /metrics).
+
+    Con varios procesos (por ejemplo workers de gunicorn creados con fork),
+    cada proceso vuelca periódicamente sus valores a un archivo propio en
+    FINPER_METRICS['DIR'], y la exposición suma los archivos de todos. Un
+    proceso hijo detecta que cambió su pid y empieza de cero, para no contar
+    dos veces lo que heredó del padre.
+"""
+import atexit
+import glob
+import json
+import math
+import os
+import threading
+import time
+from contextlib import contextmanager
+
+from django.conf import settings
+
+METRICS_DEFAULTS = {
+    # Directorio para agregar las métricas de varios procesos (None: sólo
+    # las del proceso que atiende /metrics)
+    'DIR': None,
+    # Cada cuántos segundos, como máximo, un proceso vuelca sus métricas
+    'FLUSH_INTERVAL': 1.0,
+}
+
+DEFAULT_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5,
+                   1.0, 2.5, 5.0, 10.0, math.inf)
+
+
+def metrics_settings():
+    return {**METRICS_DEFAULTS, **getattr(settings, 'FINPER_METRICS', {})}
+
+
+def _format_value(value):
+    if value == math.inf:
+        return '+Inf'
+    if float(value).is_integer():
+        return str(int(value))
+    return repr(float(value))
+
+
+def _format_labels(labels):
+    if not labels:
+        return ''
+    pairs = (f'{name}="{value}"' for name, value in labels)
+    return '{' + ','.join(pairs) + '}'
+
+
+class Metric:
+    type = None
+
+    def __init__(self, name, documentation, labelnames=(), registry=None):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self.values = {}
+        self.lock = threading.Lock()
+        (registry or REGISTRY).register(self)
+
+    def _key(self, labels):
+        if set(labels) != set(self.labelnames):
+            raise ValueError(f'{self.name}: se esperaban las etiquetas {self.labelnames}')
+        return json.dumps([str(labels[name]) for name in self.labelnames])
+
+    def _labels(self, key):
+        return list(zip(self.labelnames, json.loads(key)))
+
+    def reset(self):
+        with self.lock:
+            self.values = {}
+
+    def snapshot(self):
+        with self.lock:
+            return json.loads(json.dumps(self.values))
+
+
+class Counter(Metric):
+    type = 'counter'
+
+    def inc(self, amount=1, **labels):
+        REGISTRY.check_fork()
+        key = self._key(labels)
+        with self.lock:
+            self.values[key] = self.values.get(key, 0) + amount
+        REGISTRY.maybe_flush()
+
+    @staticmethod
+    def merge(total, value):
+        return (total or 0) + value
+
+    def samples(self, values):
+        for key, value in sorted(values.items()):
+            yield self.name, self._labels(key), value
+
+
+class Gauge(Metric):
+    """ Gauge: con varios procesos, vale el último valor fijado o, con
+        multiprocess='sum', la suma de los valores de cada proceso (para
+        valores propios de cada proceso, como sus conexiones abiertas)."""
+    type = 'gauge'
+
+    def __init__(self, name, documentation, labelnames=(), multiprocess='last',
+                 registry=None):
+        if multiprocess not in ('last', 'sum'):
+            raise ValueError(f'{name}: multiprocess debe ser "last" o "sum"')
+        self.multiprocess = multiprocess
+        super().__init__(name, documentation, labelnames, registry)
+
+    def set(self, value, **labels):
+        REGISTRY.check_fork()
+        key = self._key(labels)
+        with self.lock:
+            self.values[key] = [value, time.time()]
+        REGISTRY.maybe_flush()
+
+    def merge(self, total, value):
+        if total is None:
+            return value
+        if self.multiprocess == 'sum':
+            return [total[0] + value[0], max(total[1], value[1])]
+        if value[1] >= total[1]:
+            return value
+        return total
+
+    def samples(self, values):
+        for key, (value, timestamp) in sorted(values.items()):
+            yield self.name, self._labels(key), value
+
+
+class Histogram(Metric):
+    type = 'histogram'
+
+    def __init__(self, name, documentation, labelnames=(), buckets=DEFAULT_BUCKETS,
+                 registry=None):
+        self.buckets = tuple(buckets)
+        if self.buckets[-1] != math.inf:
+            self.buckets += (math.inf,)
+        super().__init__(name, documentation, labelnames, registry)
+
+    def observe(self, value, **labels):
+        REGISTRY.check_fork()
+        key = self._key(labels)
+        with self.lock:
+            counts, total = self.values.get(key, [[0] * len(self.buckets), 0])
+            for index, bound in enumerate(self.buckets):
+                if value <= bound:
+                    counts[index] += 1
+                    break
+            self.values[key] = [counts, total + value]
+        REGISTRY.maybe_flush()
+
+    @contextmanager
+    def time(self, **labels):
+        """ Mide la duración del bloque (en segundos) y la registra."""
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - start, **labels)
+
+    @staticmethod
+    def merge(total, value):
+        if total is None:
+            return value
+        return [[a + b for a, b in zip(total[0], value[0])], total[1] + value[1]]
+
+    def samples(self, values):
+        for key, (counts, total) in sorted(values.items()):
+            labels = self._labels(key)
+            cumulative = 0
+            for bound, count in zip(self.buckets, counts):
+                cumulative += count
+                yield f'{self.name}_bucket', labels + [('le', _format_value(bound))], \
+                    cumulative
+            yield f'{self.name}_sum', labels, total
+            yield f'{self.name}_count', labels, cumulative
+
+
+class Registry:
+
+    def __init__(self):
+        self.metrics = {}
+        self.pid = os.getpid()
+        self.last_flush = 0.0
+        self.lock = threading.Lock()
+
+    def register(self, metric):
+        self.metrics[metric.name] = metric
+
+    def check_fork(self):
+        """ En un proceso hijo recién creado, descarta los valores heredados."""
+        if os.getpid() != self.pid:
+            with self.lock:
+                if os.getpid() != self.pid:
+                    for metric in self.metrics.values():
+                        metric.reset()
+                    self.pid = os.getpid()
+                    self.last_flush = 0.0
+
+    def snapshot(self):
+        return {name: metric.snapshot() for name, metric in self.metrics.items()}
+
+    def _path(self, directory, pid=None):
+        return os.path.join(directory, f'metrics-{pid or os.getpid()}.json')
+
+    def flush(self):
+        """ Vuelca las métricas del proceso a su archivo, si hay directorio."""
+        directory = metrics_settings()['DIR']
+        if not directory:
+            return
+        os.makedirs(directory, exist_ok=True)
+        path = self._path(directory)
+        temporary = f'{path}.tmp'
+        with open(temporary, 'w') as file:
+            json.dump(self.snapshot(), file)
+        os.replace(temporary, path)
+        self.last_flush = time.monotonic()
+
+    def maybe_flush(self):
+        config = metrics_settings()
+        if config['DIR'] and \
+                time.monotonic() - self.last_flush >= config['FLUSH_INTERVAL']:
+            self.flush()
+
+    def collect(self):
+        """ Devuelve {nombre: valores} sumando los de todos los procesos."""
+        snapshots = [self.snapshot()]
+        directory = metrics_settings()['DIR']
+        if directory:
+            own = self._path(directory)
+            for path in glob.glob(os.path.join(directory, 'metrics-*.json')):
+                if path == own:
+                    continue
+                try:
+                    with open(path) as file:
+                        snapshots.append(json.load(file))
+                except (OSError, ValueError):
+                    continue
+        merged = {}
+        for name, metric in self.metrics.items():
+            values = {}
+            for snapshot in snapshots:
+                for key, value in snapshot.get(name, {}).items():
+                    values[key] = metric.merge(values.get(key), value)
+            merged[name] = values
+        return merged
+
+    def exposition(self):
+        """ Métricas en el formato de texto de Prometheus."""
+        lines = []
+        for name, values in self.collect().items():
+            metric = self.metrics[name]
+            lines.append(f'# HELP {name} {metric.documentation}')
+            lines.append(f'# TYPE {name} {metric.type}')
+            for sample, labels, value in metric.samples(values):
+                lines.append(f'{sample}{_format_labels(labels)} {_format_value(value)}')
+        return '\n'.join(lines) + '\n'
+
+
+REGISTRY = Registry()
+atexit.register(REGISTRY.flush)
+
+
+# Métricas del libro de movimientos
+
+MOVEMENT_SAVE_SECONDS = Histogram(
+    'finper_movement_save_seconds',
+    'Duración de Movement.save(), por tipo de operación',
+    labelnames=['kind'])
+MOVEMENT_DELETE_SECONDS = Histogram(
+    'finper_movement_delete_seconds',
+    'Duración de Movement.delete()')
+MULTIPLE_DELETE_BATCH_SIZE = Histogram(
+    'finper_multiple_delete_batch_size',
+    'Cantidad de movimientos borrados juntos desde la planilla',
+    buckets=(1, 2, 5, 10, 25, 50, 100, 250, 500, 1000))
+RECONCILIATION_SECONDS = Histogram(
+    'finper_reconciliation_seconds',
+    'Duración de la verificación de saldos de todas las cuentas')
+DRIFTING_ACCOUNTS = Gauge(
+    'finper_drifting_accounts',
+    'Cuentas cuyo saldo no coincide con el saldo inicial más sus movimientos '
+    '(última verificación)')
+CACHE_REQUESTS = Counter(
+    'finper_cache_requests_total',
+    'Consultas al caché de datos derivados del libro, por resultado',
+    labelnames=['cache', 'result'])
+BUSY_RETRIES = Counter(
+    'finper_busy_retries_total',
+    'Escrituras del libro reintentadas porque la base estaba ocupada')
+EVENTS_PUBLISHED = Counter(
+    'finper_events_published_total',
+    'Eventos de movimientos publicados a la planilla en vivo')
+EVENT_SUBSCRIBERS = Gauge(
+    'finper_event_subscribers',
+    'Conexiones abiertas a los eventos en vivo de la planilla',
+    multiprocess='sum')
@@ -0,0 +1,247 @@
+""" Middleware de finper.
+
+    ProfilingMiddleware mide, para cada request, la cantidad de consultas SQL,
+    el tiempo total de SQL, el de la vista y el del render de la plantilla.
+    Lo devuelve en los headers Server-Timing y X-Query-Count y lo registra en
+    el logger 'finper.profiling' como una línea JSON. Por omisión sólo mide
+    con DEBUG. Los requests que superan
+    FINPER_PROFILING['SLOW_REQUEST_MS'] se registran como warning junto con
+    sus consultas SQL.
+
+    CProfileMiddleware ejecuta bajo cProfile los requests de usuarios staff
+    que lo piden (ver finper/profiling.py). Perfila alrededor de
+    get_response, así que el perfil incluye los middleware que estén después
+    en MIDDLEWARE.
+
+    Todos los middleware de finper derivan de HybridMiddleware y funcionan
+    tanto bajo WSGI como bajo ASGI: en una cadena asincrónica no obligan a
+    Django a atender el request en un hilo.
+"""
+import cProfile
+import json
+import logging
+import time
+from contextlib import ExitStack
+from contextvars import ContextVar
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from django.conf import settings
+from django.db import connections
+
+from .profiling import cprofile_settings, save_profile
+
+logger = logging.getLogger('finper.profiling')
+
+# Nombre de la vista que está atendiendo el request en curso (lo usan, por
+# ejemplo, los registros de consultas lentas)
+current_view = ContextVar('finper_current_view', default=None)
+
+PROFILING_DEFAULTS = {
+    # None: sólo con DEBUG (la medición guarda en memoria todo el SQL del
+    # request)
+    'ENABLED': None,
+    # Requests más lentos que esto (en milisegundos) se registran con su SQL
+    'SLOW_REQUEST_MS': 500,
+    # Agregar los headers Server-Timing y X-Query-Count a la respuesta.
+    # None: sólo con DEBUG (exponen detalles internos a cualquier cliente)
+    'HEADERS': None,
+}
+
+
+def profiling_settings():
+    config = {**PROFILING_DEFAULTS, **getattr(settings, 'FINPER_PROFILING', {})}
+    for key in ('ENABLED', 'HEADERS'):
+        if config[key] is None:
+            config[key] = settings.DEBUG
+    return config
+
+
+class QueryRecorder:
+    """ Execute wrapper que cuenta las consultas y acumula su duración."""
+
+    def __init__(self):
+        self.count = 0
+        self.duration = 0.0
+        self.queries = []
+
+    def __call__(self, execute, sql, params, many, context):
+        start = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            elapsed = time.perf_counter() - start
+            self.count += 1
+            self.duration += elapsed
+            self.queries.append((sql, elapsed))
+
+
+class HybridMiddleware:
+    """ Base para middleware que funcionan en una cadena sincrónica o
+        asincrónica. Las subclases redefinen call() y, si hace falta, acall();
+        __call__ elige según el modo de la cadena."""
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        self.async_mode = iscoroutinefunction(get_response)
+        if self.async_mode:
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if self.async_mode:
+            return self.acall(request)
+        return self.call(request)
+
+    def call(self, request):
+        return self.get_response(request)
+
+    async def acall(self, request):
+        return await self.get_response(request)
+
+
+class ProfilingMiddleware(HybridMiddleware):
+    """ En una cadena asincrónica sólo se miden los tiempos: las consultas
+        del ORM asincrónico corren en otro hilo, con otra conexión, y no se
+        pueden contar desde acá."""
+
+    def call(self, request):
+        token = current_view.set(None)
+        try:
+            return self.profile(request)
+        finally:
+            current_view.reset(token)
+
+    async def acall(self, request):
+        token = current_view.set(None)
+        try:
+            config = profiling_settings()
+            if not config['ENABLED']:
+                return await self.get_response(request)
+            request._finper_timings = {'view': None, 'render': 0.0}
+            start = time.perf_counter()
+            response = await self.get_response(request)
+            return self.report(request, response, config, None, start)
+        finally:
+            current_view.reset(token)
+
+    def profile(self, request):
+        config = profiling_settings()
+        if not config['ENABLED']:
+            return self.get_response(request)
+
+        recorder = QueryRecorder()
+        request._finper_timings = {'view': None, 'render': 0.0}
+        start = time.perf_counter()
+        with ExitStack() as stack:
+            for alias in connections:
+                stack.enter_context(connections[alias].execute_wrapper(recorder))
+            response = self.get_response(request)
+        return self.report(request, response, config, recorder, start)
+
+    @staticmethod
+    def report(request, response, config, recorder, start):
+        """ Agrega los headers y registra el request. recorder es None si no
+            se contaron las consultas."""
+        timings = request._finper_timings
+        end = time.perf_counter()
+        total = end - start
+
+        if timings['view'] is None:
+            # La vista no devolvió un TemplateResponse
+            timings['view'] = end - timings.get('view_start', start)
+
+        durations = {
+            'view': timings['view'] * 1000,
+            'render': timings['render'] * 1000,
+            'total': total * 1000,
+        }
+        if recorder is not None:
+            durations = {'sql': recorder.duration * 1000, **durations}
+        if config['HEADERS']:
+            response['Server-Timing'] = ', '.join(
+                f'{name};dur={duration:.1f}' +
+                (f';desc="{recorder.count} queries"' if name == 'sql' else '')
+                for name, duration in durations.items())
+            if recorder is not None:
+                response['X-Query-Count'] = str(recorder.count)
+
+        record = {
+            'method': request.method,
+            'path': request.path,
+            'view': timings.get('view_name'),
+            'status': response.status_code,
+            'queries': recorder.count if recorder is not None else None,
+            **{f'{name}_ms': round(duration, 1)
+               for name, duration in durations.items()},
+        }
+        if durations['total'] >= config['SLOW_REQUEST_MS']:
+            if recorder is not None:
+                record['sql'] = [{'sql': sql, 'ms': round(elapsed * 1000, 1)}
+                                 for sql, elapsed in recorder.queries]
+            logger.warning(json.dumps(record))
+        else:
+            logger.info(json.dumps(record))
+        return response
+
+    def process_view(self, request, view_func, view_args, view_kwargs):
+        view_name = request.resolver_match.view_name \
+            if request.resolver_match else view_func.__name__
+        current_view.set(view_name)
+        timings = getattr(request, '_finper_timings', None)
+        if timings is not None:
+            timings['view_start'] = time.perf_counter()
+            timings['view_name'] = view_name
+        return None
+
+    def process_template_response(self, request, response):
+        """ La vista devolvió un TemplateResponse: termina el tiempo de la
+            vista y se mide por separado el render, que Django hace después."""
+        timings = getattr(request, '_finper_timings', None)
+        if timings is None or 'view_start' not in timings:
+            return response
+        timings['view'] = time.perf_counter() - timings['view_start']
+        render = response.render
+
+        def timed_render():
+            start = time.perf_counter()
+            try:
+                return render()
+            finally:
+                timings['render'] += time.perf_counter() - start
+
+        response.render = timed_render
+        return response
+
+
+class CProfileMiddleware(HybridMiddleware):
+    """ Ejecuta el resto de la cadena (la vista y el render de su plantilla)
+        bajo cProfile cuando un usuario staff agrega _profile=1 a la query
+        string o envía el header X-Finper-Profile: 1. El nombre del perfil
+        guardado vuelve en el header X-Finper-Profile. Tiene que ir después
+        de AuthenticationMiddleware. En una cadena asincrónica no se perfila:
+        cProfile mediría también los demás requests del event loop."""
+
+    @staticmethod
+    def wants_profile(request):
+        if not cprofile_settings()['ENABLED']:
+            return False
+        user = getattr(request, 'user', None)
+        if user is None or not user.is_staff:
+            return False
+        return request.GET.get('_profile') == '1' or \
+            request.headers.get('X-Finper-Profile') == '1'
+
+    def call(self, request):
+        if not self.wants_profile(request):
+            return self.get_response(request)
+        profiler = cProfile.Profile()
+        response = profiler.runcall(self.get_response, request)
+        view_name = request.resolver_match.view_name \
+            if getattr(request, 'resolver_match', None) else request.path
+        response['X-Finper-Profile'] = save_profile(
+            profiler,
+            label=view_name,
+            description=f'{request.method} {request.get_full_path()} '
+                        f'({view_name}) -> {response.status_code}')
+        return response
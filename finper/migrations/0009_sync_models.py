@@ -0,0 +1,126 @@
+# Generated by Django 4.2.30 on 2026-10-19 05:47
+
+from django.db import migrations, models
+import django.db.models.deletion
+import django.utils.timezone
+
+
+def fill_codenames(apps, schema_editor):
+    """ Asigna a cada cuenta existente un código distinto, formado por las
+        primeras letras de su nombre (y un número si ya está usado)."""
+    Account = apps.get_model('finper', 'Account')
+    used = set()
+    for account in Account.objects.order_by('pk'):
+        base = ''.join(char for char in account.name.upper() if char.isalnum())[:4] or 'CTA'
+        codename, number = base, 1
+        while codename in used:
+            suffix = str(number)
+            codename = base[:4 - len(suffix)] + suffix
+            number += 1
+        used.add(codename)
+        account.codename = codename
+        account.save(update_fields=['codename'])
+
+
+def fill_directions(apps, schema_editor):
+    """ Al volver atrás, deduce la dirección de cada movimiento de sus
+        cuentas de entrada y de salida."""
+    Movement = apps.get_model('finper', 'Movement')
+    Movement.objects.filter(account_out__isnull=True).update(direction='+')
+    Movement.objects.filter(account_in__isnull=True).update(direction='-')
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('finper', '0008_auto_20200307_1234'),
+    ]
+
+    operations = [
+        migrations.RenameField(
+            model_name='movement',
+            old_name='concept',
+            new_name='title',
+        ),
+        # Con un valor por omisión, al volver atrás se puede agregar la
+        # columna en una tabla con datos; fill_directions la completa
+        migrations.AlterField(
+            model_name='movement',
+            name='direction',
+            field=models.CharField(choices=[('+', 'Entrada'), ('-', 'Salida'), ('=', 'Traspaso')], default='=', max_length=1),
+        ),
+        migrations.RunPython(migrations.RunPython.noop, fill_directions),
+        migrations.RemoveField(
+            model_name='movement',
+            name='direction',
+        ),
+        migrations.AddField(
+            model_name='account',
+            name='balance_previous',
+            field=models.DecimalField(decimal_places=2, default=0.0, max_digits=15),
+        ),
+        migrations.AddField(
+            model_name='account',
+            name='balance_start',
+            field=models.DecimalField(decimal_places=2, default=0.0, max_digits=15),
+        ),
+        # El código se agrega sin unique, se completa con uno distinto para
+        # cada cuenta existente y recién entonces se lo hace único
+        migrations.AddField(
+            model_name='account',
+            name='codename',
+            field=models.CharField(default='', max_length=4),
+            preserve_default=False,
+        ),
+        migrations.RunPython(fill_codenames, migrations.RunPython.noop),
+        migrations.AlterField(
+            model_name='account',
+            name='codename',
+            field=models.CharField(max_length=4, unique=True),
+        ),
+        migrations.AlterField(
+            model_name='movement',
+            name='title',
+            field=models.CharField(default='Movimiento', max_length=20, verbose_name='Concepto'),
+        ),
+        migrations.AlterField(
+            model_name='account',
+            name='balance',
+            field=models.DecimalField(decimal_places=2, default=0.0, max_digits=15),
+        ),
+        migrations.AlterField(
+            model_name='movement',
+            name='account_in',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.PROTECT, related_name='movements_in', to='finper.account', verbose_name='cuenta_de_entrada'),
+        ),
+        migrations.AlterField(
+            model_name='movement',
+            name='account_out',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.PROTECT, related_name='movements_out', to='finper.account', verbose_name='cuenta_de_salida'),
+        ),
+        migrations.AlterField(
+            model_name='movement',
+            name='amount',
+            field=models.DecimalField(decimal_places=2, default=0.0, max_digits=15, verbose_name='Monto'),
+        ),
+        migrations.AlterField(
+            model_name='movement',
+            name='category',
+            field=models.ForeignKey(on_delete=django.db.models.deletion.PROTECT, to='finper.category', verbose_name='categoría'),
+        ),
+        migrations.AlterField(
+            model_name='movement',
+            name='currency',
+            field=models.CharField(default='$', max_length=3, verbose_name='Moneda'),
+        ),
+        migrations.AlterField(
+            model_name='movement',
+            name='date',
+            field=models.DateField(default=django.utils.timezone.now, verbose_name='Fecha'),
+        ),
+        migrations.AlterField(
+            model_name='movement',
+            name='detail',
+            field=models.CharField(blank=True, max_length=30, null=True, verbose_name='Detalle'),
+        ),
+    ]
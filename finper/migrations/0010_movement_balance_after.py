@@ -0,0 +1,57 @@
+# Generated by Django 4.2.30 on 2026-10-19 05:47
+
+from django.db import migrations, models
+
+
+def fill_balance_after(apps, schema_editor):
+    """ Calcula los saldos materializados de los movimientos existentes,
+        recorriéndolos en el orden de la planilla."""
+    Account = apps.get_model('finper', 'Account')
+    Movement = apps.get_model('finper', 'Movement')
+    balances = dict(Account.objects.values_list('pk', 'balance_start'))
+    changed = []
+    for mov in Movement.objects.order_by('date', 'pk').iterator():
+        if mov.account_in_id is not None:
+            balances[mov.account_in_id] += mov.amount
+        if mov.account_out_id is not None:
+            balances[mov.account_out_id] -= mov.amount
+        mov.balance_after_in = balances.get(mov.account_in_id)
+        mov.balance_after_out = balances.get(mov.account_out_id)
+        changed.append(mov)
+        if len(changed) >= 500:
+            Movement.objects.bulk_update(changed, ['balance_after_in', 'balance_after_out'])
+            changed = []
+    Movement.objects.bulk_update(changed, ['balance_after_in', 'balance_after_out'])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('finper', '0009_sync_models'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='movement',
+            name='balance_after_in',
+            field=models.DecimalField(blank=True, decimal_places=2, editable=False, max_digits=15, null=True, verbose_name='Saldo posterior (entrada)'),
+        ),
+        migrations.AddField(
+            model_name='movement',
+            name='balance_after_out',
+            field=models.DecimalField(blank=True, decimal_places=2, editable=False, max_digits=15, null=True, verbose_name='Saldo posterior (salida)'),
+        ),
+        migrations.AddIndex(
+            model_name='movement',
+            index=models.Index(fields=['account_in', 'date'], name='finper_move_account_3b6cc8_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='movement',
+            index=models.Index(fields=['account_out', 'date'], name='finper_move_account_fa54ca_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='movement',
+            index=models.Index(fields=['date'], name='finper_move_date_32ec07_idx'),
+        ),
+        migrations.RunPython(fill_balance_after, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,21 @@
+# Generated by Django 4.2.30 on 2026-10-19 05:48
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('finper', '0010_movement_balance_after'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='movement',
+            index=models.Index(fields=['category', 'date'], name='finper_move_categor_880083_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='movement',
+            index=models.Index(fields=['currency', 'date'], name='finper_move_currenc_9d56d8_idx'),
+        ),
+    ]
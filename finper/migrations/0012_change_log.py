@@ -0,0 +1,52 @@
+# Generated by Django 4.2.30 on 2026-10-19 06:24
+
+from django.db import migrations, models
+
+
+def record_existing(apps, schema_editor):
+    """ Registra un cambio por cada cuenta y cada movimiento existentes, para
+        que el feed de cambios desde 0 traiga el libro completo."""
+    Change = apps.get_model('finper', 'Change')
+    for name, model in (('account', 'Account'), ('movement', 'Movement')):
+        pks = apps.get_model('finper', model).objects.order_by('pk')\
+            .values_list('pk', flat=True)
+        Change.objects.bulk_create(
+            (Change(model=name, object_id=pk) for pk in pks.iterator()),
+            batch_size=500)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('finper', '0011_movement_filter_indexes'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ChangeCompaction',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('seq', models.IntegerField()),
+                ('removed', models.IntegerField()),
+                ('created', models.DateTimeField(auto_now_add=True)),
+            ],
+            options={
+                'ordering': ['pk'],
+            },
+        ),
+        migrations.CreateModel(
+            name='Change',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('model', models.CharField(choices=[('account', 'Cuenta'), ('movement', 'Movimiento')], max_length=10)),
+                ('object_id', models.IntegerField()),
+                ('deleted', models.BooleanField(default=False)),
+                ('created', models.DateTimeField(auto_now_add=True)),
+            ],
+            options={
+                'ordering': ['pk'],
+                'indexes': [models.Index(fields=['model', 'object_id'], name='finper_chan_model_fe3eaf_idx')],
+            },
+        ),
+        migrations.RunPython(record_existing, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,66 @@
+from django.db import DatabaseError, migrations
+
+FTS_TABLE = 'finper_movement_fts'
+
+TRIGGERS = [
+    f"""
+    CREATE TRIGGER IF NOT EXISTS {FTS_TABLE}_ai
+    AFTER INSERT ON finper_movement BEGIN
+        INSERT INTO {FTS_TABLE}(rowid, title, detail)
+        VALUES (new.id, new.title, new.detail);
+    END""",
+    f"""
+    CREATE TRIGGER IF NOT EXISTS {FTS_TABLE}_ad
+    AFTER DELETE ON finper_movement BEGIN
+        INSERT INTO {FTS_TABLE}({FTS_TABLE}, rowid, title, detail)
+        VALUES ('delete', old.id, old.title, old.detail);
+    END""",
+    f"""
+    CREATE TRIGGER IF NOT EXISTS {FTS_TABLE}_au
+    AFTER UPDATE OF title, detail ON finper_movement BEGIN
+        INSERT INTO {FTS_TABLE}({FTS_TABLE}, rowid, title, detail)
+        VALUES ('delete', old.id, old.title, old.detail);
+        INSERT INTO {FTS_TABLE}(rowid, title, detail)
+        VALUES (new.id, new.title, new.detail);
+    END""",
+]
+
+
+def create_fts(apps, schema_editor):
+    """ Crea la tabla FTS5 de movimientos y sus triggers, y la llena con los
+        movimientos existentes. Sólo en SQLite, y si tiene FTS5."""
+    if schema_editor.connection.vendor != 'sqlite':
+        return
+    with schema_editor.connection.cursor() as cursor:
+        try:
+            cursor.execute(
+                f"CREATE VIRTUAL TABLE IF NOT EXISTS {FTS_TABLE} USING fts5("
+                f"title, detail, "
+                f"content='finper_movement', content_rowid='id', "
+                f"prefix='2 3', tokenize='unicode61 remove_diacritics 2')")
+        except DatabaseError:
+            # SQLite compilado sin FTS5: se busca con icontains
+            return
+        for sql in TRIGGERS:
+            cursor.execute(sql)
+        cursor.execute(f"INSERT INTO {FTS_TABLE}({FTS_TABLE}) VALUES ('rebuild')")
+
+
+def drop_fts(apps, schema_editor):
+    if schema_editor.connection.vendor != 'sqlite':
+        return
+    with schema_editor.connection.cursor() as cursor:
+        for suffix in ('ai', 'ad', 'au'):
+            cursor.execute(f"DROP TRIGGER IF EXISTS {FTS_TABLE}_{suffix}")
+        cursor.execute(f"DROP TABLE IF EXISTS {FTS_TABLE}")
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('finper', '0012_change_log'),
+    ]
+
+    operations = [
+        migrations.RunPython(create_fts, drop_fts),
+    ]
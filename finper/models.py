@@ -1,10 +1,24 @@
-from django.db import models
-from django.db.models import Sum
-from django.db.models.signals import post_save
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import connections, models, router
+from django.db.models import (Case, Count, F, Max, OuterRef, Q, Subquery, Sum, Value,
+                              When)
+from django.db.models.functions import Coalesce, Greatest
+from django.db.models.signals import post_delete, post_save
 from django.utils import timezone
 from model_utils import FieldTracker
 
+from .cache import bump_ledger_version
 from .errors import AccountError
+from .metrics import (DRIFTING_ACCOUNTS, MOVEMENT_DELETE_SECONDS,
+                      MOVEMENT_SAVE_SECONDS, RECONCILIATION_SECONDS)
+from .sqlite import retry_on_busy
+
+# Cantidad de movimientos que se corrigen juntos al recalcular saldos
+REBUILD_BATCH_SIZE = 500
+# Cantidad de posiciones que corre cada UPDATE de shift_running_balances_from()
+SHIFT_BATCH_SIZE = 100
 
 
 def valueorzero(param):
@@ -14,6 +28,48 @@ def valueorzero(param):
         return param
 
 
+def running_balances_enabled():
+    """ Indica si Movement.save() y Movement.delete() deben mantener al día
+        los saldos materializados (balance_after_in, balance_after_out).
+        Con FINPER_RUNNING_BALANCES = 'off' se suspende el mantenimiento (por
+        ejemplo durante una carga masiva) y luego se recalcula todo con
+        'manage.py rebuild_balances'."""
+    return getattr(settings, 'FINPER_RUNNING_BALANCES', 'incremental') != 'off'
+
+
+def _positionbefore(date, pk=None):
+    """ Q que selecciona los movimientos anteriores a la posición (date, pk)
+        en el orden de la planilla. Si pk es None, los anteriores a la fecha."""
+    if pk is None:
+        return Q(date__lt=date)
+    return Q(date__lt=date) | Q(date=date, pk__lt=pk)
+
+
+def _positionafter(date, pk=None):
+    """ Q que selecciona los movimientos posteriores a la posición (date, pk)
+        en el orden de la planilla. Si pk es None, los posteriores a la fecha."""
+    if pk is None:
+        return Q(date__gt=date)
+    return Q(date__gt=date) | Q(date=date, pk__gt=pk)
+
+
+def _positionfrom(date, pk):
+    """ Q que selecciona el movimiento en la posición (date, pk) de la
+        planilla y los posteriores."""
+    return Q(date__gt=date) | Q(date=date, pk__gte=pk)
+
+
+def _accountdeltas(accountinid, accountoutid, amount):
+    """ Devuelve un dict {id de cuenta: efecto del movimiento en su saldo}.
+        Si la cuenta de entrada y la de salida son la misma, el efecto es 0."""
+    deltas = {}
+    if accountinid is not None:
+        deltas[accountinid] = deltas.get(accountinid, 0) + amount
+    if accountoutid is not None:
+        deltas[accountoutid] = deltas.get(accountoutid, 0) - amount
+    return deltas
+
+
 class Account(models.Model):
     codename = models.CharField(max_length=4, unique=True)
     name = models.CharField(max_length=20, default='Cuenta')
@@ -29,6 +85,11 @@ class Account(models.Model):
 
     objects = models.Manager()
 
+    # Campos que escriben los movimientos al actualizar el saldo: el resto
+    # de la instancia puede estar viejo (por ejemplo, si viene del caché de
+    # opciones de los formularios) y no debe pisar la base
+    BALANCE_FIELDS = ['balance', 'balance_previous']
+
     def __str__(self):
         return f'{self.name}: {self.balance}'
 
@@ -65,10 +126,266 @@ class Account(models.Model):
         return {'saldoOk': self.balance == balok,
                 'movsum': movsum}
 
+    def movements(self):
+        """ Movimientos de entrada y de salida de la cuenta."""
+        return Movement.objects.filter(Q(account_in=self) | Q(account_out=self))
+
+    def balance_before(self, date, pk=None, exclude=None):
+        """ Saldo de la cuenta inmediatamente antes de la posición (date, pk)
+            de la planilla, leído del saldo materializado del último movimiento
+            anterior (dos búsquedas por índice, sin agregaciones), sin contar
+            el movimiento exclude.
+            Si no hay movimientos anteriores, devuelve el saldo inicial."""
+        previous = _positionbefore(date, pk)
+        if exclude is not None:
+            previous &= ~Q(pk=exclude)
+        lastin = self.movements_in.filter(previous)\
+            .order_by('-date', '-pk')\
+            .values_list('date', 'pk', 'balance_after_in')\
+            .first()
+        lastout = self.movements_out.filter(previous)\
+            .order_by('-date', '-pk')\
+            .values_list('date', 'pk', 'balance_after_out')\
+            .first()
+        candidates = [last for last in (lastin, lastout) if last is not None]
+        if not candidates:
+            return self.balance_start
+        return max(candidates, key=lambda last: last[:2])[2]
+
+    def running_balance(self):
+        """ Saldo de la cuenta según el saldo materializado de su último
+            movimiento."""
+        lastin = self.movements_in.order_by('-date', '-pk')\
+            .values_list('date', 'pk', 'balance_after_in').first()
+        lastout = self.movements_out.order_by('-date', '-pk')\
+            .values_list('date', 'pk', 'balance_after_out').first()
+        candidates = [last for last in (lastin, lastout) if last is not None]
+        if not candidates:
+            return self.balance_start
+        return max(candidates, key=lambda last: last[:2])[2]
+
+    def history(self, before=None, limit=50, using='default'):
+        """ Devuelve los movimientos de entrada y de salida de la cuenta, del
+            más nuevo al más viejo, con su monto con signo (signed_amount) y el
+            saldo de la cuenta después de cada uno (running_balance), leído
+            de los saldos materializados.
+            Paginación por clave: before es la posición (date, pk) del último
+            movimiento de la página anterior.
+            Es una sola consulta: cada rama del UNION ALL recorre hacia atrás
+            su índice (account_in, date) o (account_out, date) y se detiene en
+            limit filas, así que el costo no depende de la cantidad de
+            movimientos de la cuenta."""
+        connection = connections[using]
+        table = connection.ops.quote_name(Movement._meta.db_table)
+        columns = ', '.join(
+            connection.ops.quote_name(field.column)
+            for field in Movement._meta.concrete_fields)
+        keyset = ''
+        keyset_params = []
+        if before is not None:
+            date = connection.ops.adapt_datefield_value(before[0])
+            keyset = 'AND date <= %s AND (date < %s OR id < %s)'
+            keyset_params = [date, date, before[1]]
+
+        sql = f"""
+            SELECT * FROM (
+                SELECT {columns} FROM {table}
+                WHERE account_in_id = %s {keyset}
+                ORDER BY date DESC, id DESC
+                LIMIT %s
+            ) AS movs_in
+            UNION ALL
+            SELECT * FROM (
+                SELECT {columns} FROM {table}
+                WHERE account_out_id = %s
+                  AND (account_in_id IS NULL OR account_in_id <> %s) {keyset}
+                ORDER BY date DESC, id DESC
+                LIMIT %s
+            ) AS movs_out
+            ORDER BY date DESC, id DESC
+            LIMIT %s"""
+        params = [self.pk, *keyset_params, limit,
+                  self.pk, self.pk, *keyset_params, limit,
+                  limit]
+        movements = list(Movement.objects.using(using).raw(sql, params)
+                         .prefetch_related('category'))
+        for mov in movements:
+            mov.signed_amount = _accountdeltas(mov.account_in_id,
+                                               mov.account_out_id,
+                                               mov.amount)[self.pk]
+            mov.running_balance = mov.balance_after_in \
+                if mov.account_in_id == self.pk else mov.balance_after_out
+        return movements
+
+    def shift_running_balances(self, delta, date=None, pk=None):
+        """ Suma delta al saldo materializado de todos los movimientos de la
+            cuenta posteriores a la posición (date, pk), con un solo UPDATE.
+            Si date es None, corre los saldos de todos los movimientos."""
+        if not delta:
+            return 0
+        movements = self.movements()
+        if date is not None:
+            movements = movements.filter(_positionafter(date, pk))
+        output = models.DecimalField(max_digits=15, decimal_places=2)
+        return movements.update(
+            balance_after_in=Case(
+                When(account_in=self, then=F('balance_after_in') + delta),
+                default=F('balance_after_in'),
+                output_field=output),
+            balance_after_out=Case(
+                When(account_out=self, then=F('balance_after_out') + delta),
+                default=F('balance_after_out'),
+                output_field=output),
+        )
+
+    def shift_running_balances_from(self, shifts):
+        """ Aplica varios corrimientos de los saldos materializados de la
+            cuenta: shifts es una lista de tuplas (date, pk, delta), y cada
+            movimiento en la posición (date, pk) o posterior suma delta.
+            Cada movimiento recibe la suma de los corrimientos de las
+            posiciones que no están después de la suya, con un UPDATE por
+            cada SHIFT_BATCH_SIZE posiciones (sólo se tocan los movimientos
+            a partir de la primera). Devuelve la cantidad de movimientos
+            actualizados."""
+        output = models.DecimalField(max_digits=15, decimal_places=2)
+        positions = []
+        total = 0
+        for date, pk, delta in sorted(shifts, key=lambda shift: shift[:2]):
+            total += delta
+            positions.append((date, pk, total))
+        updated = 0
+        for start in range(0, len(positions), SHIFT_BATCH_SIZE):
+            chunk = positions[start:start + SHIFT_BATCH_SIZE]
+            movements = self.movements().filter(_positionfrom(*chunk[0][:2]))
+            if start + SHIFT_BATCH_SIZE < len(positions):
+                movements = movements.exclude(
+                    _positionfrom(*positions[start + SHIFT_BATCH_SIZE][:2]))
+            # El primer When que coincide es el de la última posición que no
+            # está después del movimiento
+            whens_in = [When(_positionfrom(date, pk) & Q(account_in=self),
+                             then=F('balance_after_in') + total)
+                        for date, pk, total in reversed(chunk)]
+            whens_out = [When(_positionfrom(date, pk) & Q(account_out=self),
+                              then=F('balance_after_out') + total)
+                         for date, pk, total in reversed(chunk)]
+            updated += movements.update(
+                balance_after_in=Case(*whens_in, default=F('balance_after_in'),
+                                      output_field=output),
+                balance_after_out=Case(*whens_out, default=F('balance_after_out'),
+                                       output_field=output),
+            )
+        return updated
+
+    def _iter_running_balances(self, since=None):
+        """ Recorre los movimientos de la cuenta en el orden de la planilla
+            (a partir de la fecha since, si se indica) y devuelve tuplas
+            (movimiento, saldo correcto después del movimiento)."""
+        movements = self.movements()
+        if since is None:
+            balance = self.balance_start
+        else:
+            balance = self.balance_before(since)
+            movements = movements.filter(date__gte=since)
+        movements = movements.order_by('date', 'pk').only(
+            'date', 'amount', 'account_in', 'account_out',
+            'balance_after_in', 'balance_after_out')
+        for mov in movements.iterator(chunk_size=2000):
+            balance += _accountdeltas(mov.account_in_id,
+                                      mov.account_out_id,
+                                      mov.amount)[self.pk]
+            yield mov, balance
+
+    def check_running_balances(self):
+        """ Verifica los saldos materializados de los movimientos de la cuenta.
+            Devuelve una lista de tuplas (movimiento, saldo guardado, saldo
+            correcto) con los movimientos cuyo saldo no coincide."""
+        errors = []
+        for mov, balance in self._iter_running_balances():
+            stored = mov.balance_after_in if mov.account_in_id == self.pk \
+                else mov.balance_after_out
+            if stored != balance:
+                errors.append((mov, stored, balance))
+        return errors
+
+    def rebuild_running_balances(self, since=None):
+        """ Recalcula los saldos materializados de los movimientos de la cuenta
+            (todos, o a partir de la fecha since). Guarda las correcciones de
+            a REBUILD_BATCH_SIZE, para no acumular en memoria todo el libro.
+            Devuelve la cantidad de movimientos corregidos."""
+        changed = []
+        fixed = 0
+        for mov, balance in self._iter_running_balances(since):
+            stale = False
+            if mov.account_in_id == self.pk and mov.balance_after_in != balance:
+                mov.balance_after_in = balance
+                stale = True
+            if mov.account_out_id == self.pk and mov.balance_after_out != balance:
+                mov.balance_after_out = balance
+                stale = True
+            if stale:
+                changed.append(mov)
+            if len(changed) >= REBUILD_BATCH_SIZE:
+                fixed += self._save_running_balances(changed)
+                changed = []
+        return fixed + self._save_running_balances(changed)
+
+    @staticmethod
+    def _save_running_balances(movements):
+        Movement.objects.bulk_update(
+            movements, ['balance_after_in', 'balance_after_out'],
+            batch_size=REBUILD_BATCH_SIZE)
+        return len(movements)
+
 
 post_save.connect(Account.post_create, sender=Account)
 
 
+def _movement_stats(field):
+    """ Subconsultas correlacionadas con la cantidad, la suma y la última
+        fecha de los movimientos de cada cuenta del lado field ('account_in'
+        o 'account_out'). Cada una usa el índice (field, date)."""
+    movements = Movement.objects.filter(**{field: OuterRef('pk')}).order_by().values(field)
+    return (Subquery(movements.annotate(count=Count('pk')).values('count')),
+            Subquery(movements.annotate(total=Sum('amount')).values('total')),
+            Subquery(movements.annotate(last=Max('date')).values('last')))
+
+
+def account_stats(accounts=None):
+    """ Cuentas de accounts (por defecto todas) con la cantidad y la suma de
+        sus movimientos de entrada y de salida, la fecha de su último
+        movimiento y si el saldo coincide con el saldo inicial más los
+        movimientos (reconciled), en una sola consulta."""
+    if accounts is None:
+        accounts = Account.objects.order_by('name')
+    count_in, inflow, last_in = _movement_stats('account_in')
+    count_out, outflow, last_out = _movement_stats('account_out')
+    zero = Value(0, output_field=models.DecimalField(max_digits=15, decimal_places=2))
+    accounts = list(accounts.annotate(
+        movements_in_count=Coalesce(count_in, 0),
+        movements_out_count=Coalesce(count_out, 0),
+        inflow=Coalesce(inflow, zero),
+        outflow=Coalesce(outflow, zero),
+        # Greatest devuelve NULL si alguno es NULL en SQLite
+        last_movement=Greatest(Coalesce(last_in, last_out), Coalesce(last_out, last_in)),
+    ))
+    for account in accounts:
+        # En Python y no en SQL: SQLite suma los decimales como float
+        account.reconciled = \
+            account.balance == account.balance_start + account.inflow - account.outflow
+    return accounts
+
+
+def reconcile():
+    """ Verifica el saldo de todas las cuentas (ver account_stats()).
+        Devuelve la lista de cuentas cuyo saldo no coincide con el saldo
+        inicial más sus movimientos."""
+    with RECONCILIATION_SECONDS.time():
+        drifting = [account for account in account_stats(Account.objects.order_by('pk'))
+                    if not account.reconciled]
+    DRIFTING_ACCOUNTS.set(len(drifting))
+    return drifting
+
+
 class Category(models.Model):
     name = models.CharField(max_length=30, default='Varios')
     description = models.CharField(max_length=100)
@@ -88,6 +405,22 @@ def _pkornone(account):
     return account.pk
 
 
+def _lock_accounts(pks, using):
+    """ Lee el saldo de las cuentas dentro de la transacción en curso y
+        devuelve {pk: (balance, balance_previous)}.
+        En los motores con bloqueo de filas (PostgreSQL, MySQL) las filas
+        quedan bloqueadas con SELECT ... FOR UPDATE hasta el final de la
+        transacción. Se bloquean siempre en orden de pk, para que dos
+        movimientos entre las mismas cuentas no se esperen mutuamente. SQLite
+        bloquea la base entera al escribir: ahí sólo se leen."""
+    pks = sorted({pk for pk in pks if pk is not None})
+    accounts = Account.objects.using(using).filter(pk__in=pks).order_by('pk')
+    if connections[using].features.has_select_for_update:
+        accounts = accounts.select_for_update()
+    return {pk: (balance, previous) for pk, balance, previous
+            in accounts.values_list('pk', 'balance', 'balance_previous')}
+
+
 class Movement(models.Model):
     """ Movimiento de dinero (entrada, salida o traspaso)"""
     date = models.DateField('Fecha', default=timezone.now)
@@ -114,13 +447,35 @@ class Movement(models.Model):
                                  on_delete=models.PROTECT,
                                  verbose_name='categoría',
                                  )
+    # Saldo de account_in y de account_out inmediatamente después de este
+    # movimiento, en el orden de la planilla (date, pk).
+    # Los mantiene Movement.save() / Movement.delete().
+    balance_after_in = models.DecimalField('Saldo posterior (entrada)',
+                                           max_digits=15,
+                                           decimal_places=2,
+                                           null=True,
+                                           blank=True,
+                                           editable=False)
+    balance_after_out = models.DecimalField('Saldo posterior (salida)',
+                                            max_digits=15,
+                                            decimal_places=2,
+                                            null=True,
+                                            blank=True,
+                                            editable=False)
 
     objects = models.Manager()
 
-    tracker = FieldTracker(fields=['amount', 'account_in_id', 'account_out_id'])
+    tracker = FieldTracker(fields=['date', 'amount', 'account_in_id', 'account_out_id'])
 
     class Meta:
         ordering = ['date']
+        indexes = [
+            models.Index(fields=['account_in', 'date']),
+            models.Index(fields=['account_out', 'date']),
+            models.Index(fields=['date']),
+            models.Index(fields=['category', 'date']),
+            models.Index(fields=['currency', 'date']),
+        ]
 
     def __str__(self):
         movstr = f'{self.date} - {self.title} - '
@@ -135,10 +490,68 @@ class Movement(models.Model):
             return None
         return Account.objects.get(id=self.tracker.previous(accountid))
 
+    def _remove_running_balances(self, accountinid, accountoutid, amount, date):
+        """ Descuenta el efecto del movimiento de los saldos materializados de
+            los movimientos posteriores de sus cuentas."""
+        for accountid, delta in _accountdeltas(accountinid, accountoutid, amount).items():
+            Account(pk=accountid).shift_running_balances(-delta, date, self.pk)
+
+    def _insert_running_balances(self):
+        """ Calcula los saldos materializados del movimiento a partir del
+            último movimiento anterior de cada cuenta, y suma su efecto a los
+            movimientos posteriores."""
+        date = self._meta.get_field('date').to_python(self.date)
+        accounts = {account.pk: account
+                    for account in (self.account_in, self.account_out)
+                    if account is not None}
+        balances = {}
+        for accountid, delta in _accountdeltas(self.account_in_id,
+                                               self.account_out_id,
+                                               self.amount).items():
+            account = accounts[accountid]
+            if self.pk is None:
+                # Un movimiento nuevo va a recibir el mayor pk, así que queda
+                # último entre los de su misma fecha.
+                before = account.balance_before(date + timedelta(days=1))
+            else:
+                # La fila del movimiento todavía tiene la fecha anterior: si
+                # queda antes de la nueva, no es un movimiento previo
+                before = account.balance_before(date, self.pk, exclude=self.pk)
+            balances[accountid] = before + delta
+            account.shift_running_balances(delta, date, self.pk)
+        self.balance_after_in = balances.get(self.account_in_id)
+        self.balance_after_out = balances.get(self.account_out_id)
+
+    def _savekind(self):
+        """ Tipo de operación de save(), para las métricas: alta de un
+            movimiento nuevo, cambio de cuentas o modificación."""
+        if self.pk is None:
+            return 'create'
+        if self.tracker.has_changed('account_in_id') or \
+                self.tracker.has_changed('account_out_id'):
+            return 'account_swap'
+        return 'edit'
+
+    @retry_on_busy
     def save(self, *args, **kwargs):
         """ Al salvar un movimiento nuevo, se modifica el saldo de las cuentas
             referidas en account_in y account_out, si existen (Debe existir
             por lo menos una)."""
+        with MOVEMENT_SAVE_SECONDS.time(kind=self._savekind()):
+            self._save(*args, **kwargs)
+
+    def _save(self, *args, **kwargs):
+        from .ledger import current_batch
+        batch = current_batch()
+        if batch is not None:
+            return self._save_in_batch(batch, *args, **kwargs)
+
+        if self.pk is None:
+            self._lock_accounts(self.account_in_id, self.account_out_id)
+        else:
+            self._lock_accounts(self.account_in_id, self.account_out_id,
+                                self.tracker.previous('account_in_id'),
+                                self.tracker.previous('account_out_id'))
 
         # Si es un movimiento nuevo
         if self.pk is None:
@@ -149,12 +562,12 @@ class Movement(models.Model):
                 # Si es movimiento de entrada, sumar al saldo de account_in
                 self.account_in.balance_previous = self.account_in.balance
                 self.account_in.balance += self.amount
-                self.account_in.save()
+                self.account_in.save(update_fields=Account.BALANCE_FIELDS)
             if self.account_out is not None:
                 # Si es movimiento de salida, restar del saldo de account_out
                 self.account_out.balance_previous = self.account_out.balance
                 self.account_out.balance -= self.amount
-                self.account_out.save()
+                self.account_out.save(update_fields=Account.BALANCE_FIELDS)
 
         # Si se está modificando un movimiento ya cargado
         else:
@@ -179,7 +592,7 @@ class Movement(models.Model):
             if oldaccountin is not None:
                 oldaccountin.balance -= oldamount
                 if accountinchanged:
-                    oldaccountin.save()
+                    oldaccountin.save(update_fields=Account.BALANCE_FIELDS)
                     '''
                     Acá se arma un brete cuando la vieja cuenta de entrada es la 
                     nueva cuenta de salida. 
@@ -197,7 +610,7 @@ class Movement(models.Model):
 
             if self.account_in is not None:
                 self.account_in.balance += self.amount
-                self.account_in.save()
+                self.account_in.save(update_fields=Account.BALANCE_FIELDS)
 
                 if self.account_in.pk == _pkornone(oldaccountout):
                     oldaccountout = self.account_in.reconnect()
@@ -205,26 +618,183 @@ class Movement(models.Model):
             if oldaccountout is not None:
                 oldaccountout.balance += oldamount
                 if accountoutchanged:
-                    oldaccountout.save()
+                    oldaccountout.save(update_fields=Account.BALANCE_FIELDS)
                     if oldaccountout.pk == _pkornone(self.account_in):
                         self.account_in = oldaccountout.reconnect()
 
             if self.account_out is not None:
                 self.account_out.balance -= self.amount
-                self.account_out.save()
+                self.account_out.save(update_fields=Account.BALANCE_FIELDS)
 
                 if self.account_out.pk == _pkornone(oldaccountin):
                     oldaccountin = self.account_out.reconnect()
 
+        # Saldos materializados: se retira el efecto anterior del movimiento
+        # (si cambió algo que lo afecte) y se aplica el nuevo.
+        if running_balances_enabled():
+            if self.pk is None:
+                self._insert_running_balances()
+            elif any(self.tracker.has_changed(field) for field in self.tracker.fields):
+                self._remove_running_balances(self.tracker.previous('account_in_id'),
+                                              self.tracker.previous('account_out_id'),
+                                              self.tracker.previous('amount'),
+                                              self.tracker.previous('date'))
+                self._insert_running_balances()
+            elif 'update_fields' not in kwargs:
+                # Los saldos materializados de esta instancia pueden haber
+                # quedado viejos (los corren los cambios en otros movimientos):
+                # no se los escribe.
+                kwargs['update_fields'] = [
+                    field.name for field in self._meta.concrete_fields
+                    if not field.primary_key
+                    and field.name not in ('balance_after_in', 'balance_after_out')]
+
+        super(Movement, self).save(*args, **kwargs)
+
+    def _save_in_batch(self, batch, *args, **kwargs):
+        """ save() dentro de un LedgerBatch: anota el efecto en los saldos y
+            guarda sólo el movimiento (ver finper/ledger.py)."""
+        if self.pk is None:
+            if self.account_in_id is None and self.account_out_id is None:
+                raise AccountError('El movimiento no tiene cuenta de entrada ni de salida.')
+            batch.add(_accountdeltas(self.account_in_id, self.account_out_id,
+                                     self.amount), self.date)
+        else:
+            if any(self.tracker.has_changed(field) for field in self.tracker.fields):
+                # Si sólo cambió el monto, el movimiento no cambia de lugar
+                moved = any(self.tracker.has_changed(field) for field in
+                            ('date', 'account_in_id', 'account_out_id'))
+                pk = None if moved else self.pk
+                batch.add(_accountdeltas(self.tracker.previous('account_in_id'),
+                                         self.tracker.previous('account_out_id'),
+                                         -self.tracker.previous('amount')),
+                          self.tracker.previous('date'), pk)
+                batch.add(_accountdeltas(self.account_in_id, self.account_out_id,
+                                         self.amount), self.date, pk)
+            if 'update_fields' not in kwargs:
+                # Los saldos materializados los recalcula el lote al final
+                kwargs['update_fields'] = [
+                    field.name for field in self._meta.concrete_fields
+                    if not field.primary_key
+                    and field.name not in ('balance_after_in', 'balance_after_out')]
         super(Movement, self).save(*args, **kwargs)
 
+    @retry_on_busy
     def delete(self, *args, **kwargs):
+        with MOVEMENT_DELETE_SECONDS.time():
+            return self._delete(*args, **kwargs)
+
+    def _lock_accounts(self, *pks):
+        """ Bloquea las cuentas que toca el movimiento (ver _lock_accounts())
+            y actualiza los saldos de las cuentas en memoria, que pueden haber
+            cambiado desde que se leyeron (otro movimiento guardado en el
+            medio): sin esto, save() pisaría esos cambios."""
+        locked = _lock_accounts(pks, router.db_for_write(Movement, instance=self))
+        for account in (self.account_in, self.account_out):
+            if account is not None and account.pk in locked:
+                account.balance, account.balance_previous = locked[account.pk]
+
+    def _discard_unsaved(self):
+        """ Después de un intento fallido de save() o delete() (ver
+            retry_on_busy), descarta los saldos que el intento modificó en
+            las cuentas en memoria."""
+        for account in (self.account_in, self.account_out):
+            if account is not None and account.pk is not None:
+                account.refresh_from_db(fields=['balance', 'balance_previous'])
+
+    def _delete(self, *args, **kwargs):
+        from .ledger import current_batch
+        batch = current_batch()
+        if batch is not None:
+            batch.add(_accountdeltas(self.account_in_id, self.account_out_id,
+                                     -self.amount), self.date, self.pk)
+            return super(Movement, self).delete(*args, **kwargs)
+
+        self._lock_accounts(self.account_in_id, self.account_out_id)
         if self.account_in is not None:
             self.account_in.balance_previous = self.account_in.balance
             self.account_in.balance -= self.amount
-            self.account_in.save()
+            self.account_in.save(update_fields=Account.BALANCE_FIELDS)
         if self.account_out is not None:
             self.account_out.balance_previous = self.account_out.balance
             self.account_out.balance += self.amount
-            self.account_out.save()
-        super(Movement, self).delete(*args, **kwargs)
+            self.account_out.save(update_fields=Account.BALANCE_FIELDS)
+        if running_balances_enabled():
+            self._remove_running_balances(self.account_in_id,
+                                          self.account_out_id,
+                                          self.amount,
+                                          self.date)
+        return super(Movement, self).delete(*args, **kwargs)
+
+
+# Cualquier escritura en el libro invalida los datos derivados cacheados
+post_save.connect(bump_ledger_version, sender=Account)
+post_delete.connect(bump_ledger_version, sender=Account)
+post_save.connect(bump_ledger_version, sender=Movement)
+post_delete.connect(bump_ledger_version, sender=Movement)
+# Las categorías también: las listas de opciones de los formularios se
+# cachean bajo la versión del libro
+post_save.connect(bump_ledger_version, sender=Category)
+post_delete.connect(bump_ledger_version, sender=Category)
+
+
+class Change(models.Model):
+    """ Registro de cambios del libro: una fila por cada alta, modificación o
+        baja de una cuenta o un movimiento. El pk es la secuencia del cambio,
+        siempre creciente; las bajas quedan como marcas (deleted). Lo lee el
+        feed de cambios (ver finper/changes.py)."""
+    ACCOUNT = 'account'
+    MOVEMENT = 'movement'
+    MODEL_CHOICES = [(ACCOUNT, 'Cuenta'), (MOVEMENT, 'Movimiento')]
+
+    model = models.CharField(max_length=10, choices=MODEL_CHOICES)
+    object_id = models.IntegerField()
+    deleted = models.BooleanField(default=False)
+    created = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        ordering = ['pk']
+        indexes = [
+            models.Index(fields=['model', 'object_id']),
+        ]
+
+    def __str__(self):
+        action = 'baja' if self.deleted else 'cambio'
+        return f'{self.pk}: {action} de {self.model} {self.object_id}'
+
+    @classmethod
+    def record(cls, model, pks, deleted=False, using=None):
+        """ Registra un cambio por cada pk de pks (en un solo INSERT)."""
+        cls.objects.using(using).bulk_create(
+            cls(model=model, object_id=pk, deleted=deleted) for pk in pks)
+
+    @classmethod
+    def post_save(cls, sender, instance, using, **kwargs):
+        cls.record(cls._modelname(sender), [instance.pk], using=using)
+
+    @classmethod
+    def post_delete(cls, sender, instance, using, **kwargs):
+        cls.record(cls._modelname(sender), [instance.pk], deleted=True, using=using)
+
+    @classmethod
+    def _modelname(cls, sender):
+        return cls.ACCOUNT if issubclass(sender, Account) else cls.MOVEMENT
+
+
+class ChangeCompaction(models.Model):
+    """ Compactación del registro de cambios (manage.py compact_changes).
+        seq es el mayor cambio de baja descartado: quien sincronizó antes de
+        ese cambio pudo perder bajas y tiene que volver a descargar todo."""
+    seq = models.IntegerField()
+    removed = models.IntegerField()
+    created = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        ordering = ['pk']
+
+
+# Cualquier escritura en el libro queda en el registro de cambios
+post_save.connect(Change.post_save, sender=Account)
+post_delete.connect(Change.post_delete, sender=Account)
+post_save.connect(Change.post_save, sender=Movement)
+post_delete.connect(Change.post_delete, sender=Movement)
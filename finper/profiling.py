@@ -0,0 +1,87 @@
+""" Perfiles cProfile a pedido.
+
+    Un usuario staff puede pedir que un request se ejecute bajo cProfile
+    agregando el parámetro _profile=1 o el header X-Finper-Profile: 1 (ver
+    finper.middleware.CProfileMiddleware). El perfil se guarda en
+    FINPER_CPROFILE['DIR'] como un archivo .prof (para snakeviz, pstats, etc.)
+    y un resumen de texto .txt con las funciones de mayor tiempo acumulado.
+"""
+import io
+import os
+import pstats
+import re
+from datetime import datetime
+
+from django.conf import settings
+
+CPROFILE_DEFAULTS = {
+    'ENABLED': True,
+    'DIR': os.path.join(settings.BASE_DIR, 'profiles'),
+    # Cantidad de funciones del resumen de texto
+    'TOP': 30,
+    # Cantidad de perfiles que se conservan (se borran los más viejos)
+    'KEEP': 50,
+}
+
+_NAME_RE = re.compile(r'^[\w.-]+$')
+
+
+def cprofile_settings():
+    return {**CPROFILE_DEFAULTS, **getattr(settings, 'FINPER_CPROFILE', {})}
+
+
+def save_profile(profiler, label, description=''):
+    """ Guarda el perfil como <fecha>-<label>.prof y su resumen .txt.
+        Devuelve el nombre base de los archivos."""
+    config = cprofile_settings()
+    os.makedirs(config['DIR'], exist_ok=True)
+    label = re.sub(r'[^\w.-]+', '_', label)[:60]
+    name = f'{datetime.now().strftime("%Y%m%d-%H%M%S-%f")}-{label}'
+    path = os.path.join(config['DIR'], name)
+
+    profiler.dump_stats(f'{path}.prof')
+    summary = io.StringIO()
+    summary.write(f'{description}\n\n')
+    stats = pstats.Stats(profiler, stream=summary)
+    stats.sort_stats('cumulative').print_stats(config['TOP'])
+    with open(f'{path}.txt', 'w', encoding='utf-8') as file:
+        file.write(summary.getvalue())
+
+    _discard_old_profiles(config)
+    return name
+
+
+def _discard_old_profiles(config):
+    for name in list_profiles()[config['KEEP']:]:
+        for extension in ('.prof', '.txt'):
+            try:
+                os.remove(os.path.join(config['DIR'], name + extension))
+            except FileNotFoundError:
+                pass
+
+
+def list_profiles():
+    """ Nombres base de los perfiles guardados, del más nuevo al más viejo."""
+    directory = cprofile_settings()['DIR']
+    if not os.path.isdir(directory):
+        return []
+    return sorted((filename[:-len('.prof')] for filename in os.listdir(directory)
+                   if filename.endswith('.prof')),
+                  reverse=True)
+
+
+def profile_path(name, extension):
+    """ Ruta del archivo de un perfil guardado, o None si el nombre no es
+        válido o no existe."""
+    if not _NAME_RE.match(name) or extension not in ('.prof', '.txt'):
+        return None
+    path = os.path.join(cprofile_settings()['DIR'], name + extension)
+    return path if os.path.isfile(path) else None
+
+
+def read_summary(name):
+    path = profile_path(name, '.txt')
+    if path is None:
+        return ''
+    with open(path, encoding='utf-8') as file:
+        return file.read()
@@ -0,0 +1,135 @@
+""" Lecturas desde una réplica de la base de datos.
+
+    ReplicaRouter manda las lecturas de los modelos de finper a la base
+    FINPER_REPLICA['ALIAS'] (si está configurada) sólo mientras se atiende un
+    request de lectura (GET o HEAD) o dentro de replica_reads(). Todo lo demás
+    va a la base principal:
+    - las escrituras, y las lecturas que les siguen en el mismo request;
+    - las lecturas dentro de un bloque transaction.atomic;
+    - los requests de una sesión que escribió hace menos de
+      FINPER_REPLICA['PIN_SECONDS'] (para que el usuario vea lo que acaba de
+      cargar aunque la réplica esté atrasada);
+    - los modelos de otras aplicaciones (sesiones, usuarios).
+
+    Para probarlo localmente con dos archivos SQLite, se define la variable
+    de entorno FINPER_REPLICA_DB con la ruta de la réplica y se la actualiza
+    con 'manage.py sync_replica'.
+"""
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.db import DEFAULT_DB_ALIAS, connections
+
+from .middleware import HybridMiddleware
+
+REPLICA_DEFAULTS = {
+    'ALIAS': 'replica',
+    'PIN_SECONDS': 10,
+}
+
+PIN_SESSION_KEY = 'finper_primary_until'
+
+
+class _Routing:
+    def __init__(self, replica):
+        self.replica = replica
+        self.wrote = False
+
+
+_routing = ContextVar('finper_routing', default=None)
+
+
+def replica_settings():
+    return {**REPLICA_DEFAULTS, **getattr(settings, 'FINPER_REPLICA', {})}
+
+
+def replica_alias():
+    """ Alias de la réplica, o None si no está configurada."""
+    alias = replica_settings()['ALIAS']
+    return alias if alias in settings.DATABASES else None
+
+
+@contextmanager
+def replica_reads(enabled=True):
+    """ Dentro del bloque, las lecturas de finper van a la réplica (hasta la
+        primera escritura)."""
+    token = _routing.set(_Routing(enabled))
+    try:
+        yield
+    finally:
+        _routing.reset(token)
+
+
+class ReplicaRouter:
+
+    def db_for_read(self, model, **hints):
+        routing = _routing.get()
+        if routing is None or not routing.replica or routing.wrote:
+            return None
+        if model._meta.app_label != 'finper':
+            return None
+        if connections[DEFAULT_DB_ALIAS].in_atomic_block:
+            return None
+        return replica_alias()
+
+    def db_for_write(self, model, **hints):
+        routing = _routing.get()
+        if routing is not None:
+            routing.wrote = True
+        return DEFAULT_DB_ALIAS
+
+    def allow_relation(self, obj1, obj2, **hints):
+        databases = {DEFAULT_DB_ALIAS, replica_alias()}
+        if obj1._state.db in databases and obj2._state.db in databases:
+            return True
+        return None
+
+    def allow_migrate(self, db, app_label, model_name=None, **hints):
+        # La réplica se copia de la base principal: no se migra
+        if db == replica_alias():
+            return False
+        return None
+
+
+class PrimaryPinningMiddleware(HybridMiddleware):
+    """ Activa las lecturas desde la réplica en los requests GET y HEAD, salvo
+        que la sesión haya escrito hace poco. Si el request escribe, fija la
+        sesión a la base principal por FINPER_REPLICA['PIN_SECONDS'].
+        Debe ir después de SessionMiddleware."""
+
+    def call(self, request):
+        routing = _Routing(self.reads_from_replica(request))
+        token = _routing.set(routing)
+        try:
+            response = self.get_response(request)
+        finally:
+            _routing.reset(token)
+        self.pin(request, routing)
+        return response
+
+    async def acall(self, request):
+        # La sesión se lee de la base: en un hilo
+        routing = _Routing(await sync_to_async(self.reads_from_replica)(request))
+        token = _routing.set(routing)
+        try:
+            response = await self.get_response(request)
+        finally:
+            _routing.reset(token)
+        await sync_to_async(self.pin)(request, routing)
+        return response
+
+    @staticmethod
+    def reads_from_replica(request):
+        if request.method not in ('GET', 'HEAD'):
+            return False
+        session = getattr(request, 'session', None)
+        return session is None or session.get(PIN_SESSION_KEY, 0) <= time.time()
+
+    @staticmethod
+    def pin(request, routing):
+        session = getattr(request, 'session', None)
+        if routing.wrote and session is not None:
+            session[PIN_SESSION_KEY] = time.time() + replica_settings()['PIN_SECONDS']
@@ -0,0 +1,123 @@
+""" Búsqueda de texto completo sobre el concepto (title) y el detalle (detail)
+    de los movimientos.
+
+    En SQLite se usa una tabla virtual FTS5 de contenido externo
+    (finper_movement_fts) que refleja las columnas title y detail de
+    finper_movement. La mantienen al día triggers de la base de datos, así que
+    también la actualizan los UPDATE masivos que no pasan por Movement.save().
+    La tabla y los triggers los crea la migración 0013_movement_fts; una
+    migración que reconstruya finper_movement tiene que volver a crearlos.
+    En otros motores, o si SQLite no tiene FTS5, se busca con icontains.
+"""
+import re
+
+from django.db import connections
+from django.db.models import Q
+
+from .models import Movement
+
+FTS_TABLE = 'finper_movement_fts'
+
+
+def fts_enabled(using='default'):
+    """ Indica si la base de datos tiene la tabla FTS5 de movimientos."""
+    connection = connections[using]
+    if connection.vendor != 'sqlite':
+        return False
+    with connection.cursor() as cursor:
+        cursor.execute("SELECT 1 FROM sqlite_master WHERE name = %s", [FTS_TABLE])
+        return cursor.fetchone() is not None
+
+
+def _match_expression(text, column=None):
+    """ Convierte el texto ingresado por el usuario en una expresión MATCH de
+        FTS5: cada palabra entre comillas (para que no se interprete la
+        sintaxis de FTS5) y la última como prefijo."""
+    words = re.findall(r'\w+', text)
+    if not words:
+        return None
+    expression = ' '.join(f'"{word}"' for word in words) + '*'
+    if column is not None:
+        expression = f'{column} : ({expression})'
+    return expression
+
+
+class MovementSearchResults:
+    """ Resultados de una búsqueda FTS5, ordenados por relevancia (bm25).
+        Se comporta como una secuencia perezosa: Paginator sólo pide count()
+        y la porción de la página, así que cada página cuesta dos consultas
+        al índice y una por los movimientos que se muestran."""
+
+    def __init__(self, match, using='default'):
+        self.match = match
+        self.using = using
+        self._count = None
+
+    def count(self):
+        if self._count is None:
+            with connections[self.using].cursor() as cursor:
+                cursor.execute(
+                    f"SELECT count(*) FROM {FTS_TABLE} WHERE {FTS_TABLE} MATCH %s",
+                    [self.match])
+                self._count = cursor.fetchone()[0]
+        return self._count
+
+    def __len__(self):
+        return self.count()
+
+    def __getitem__(self, key):
+        if not isinstance(key, slice):
+            return self[key:key + 1][0]
+        start = key.start or 0
+        limit = -1 if key.stop is None else max(key.stop - start, 0)
+        with connections[self.using].cursor() as cursor:
+            cursor.execute(
+                f"SELECT rowid FROM {FTS_TABLE} WHERE {FTS_TABLE} MATCH %s "
+                f"ORDER BY rank LIMIT %s OFFSET %s",
+                [self.match, limit, start])
+            ids = [row[0] for row in cursor.fetchall()]
+        movements = Movement.objects.using(self.using)\
+            .select_related('account_in', 'account_out', 'category')\
+            .in_bulk(ids)
+        return [movements[pk] for pk in ids if pk in movements]
+
+
+def search_movements(text, using='default'):
+    """ Busca movimientos cuyo concepto o detalle contenga las palabras de
+        text. Devuelve un objeto paginable (MovementSearchResults con FTS5, o
+        un queryset con icontains si no hay FTS5)."""
+    if fts_enabled(using):
+        match = _match_expression(text)
+        if match is None:
+            return Movement.objects.none()
+        return MovementSearchResults(match, using)
+    movements = Movement.objects.using(using)\
+        .select_related('account_in', 'account_out', 'category')
+    for word in text.split():
+        movements = movements.filter(Q(title__icontains=word) |
+                                     Q(detail__icontains=word))
+    return movements.order_by('-date', '-pk')
+
+
+def autocomplete_titles(prefix, limit=10, using='default'):
+    """ Devuelve hasta limit conceptos distintos de movimientos que empiecen
+        con las palabras de prefix, los más relevantes primero."""
+    if fts_enabled(using):
+        match = _match_expression(prefix, column='title')
+        if match is None:
+            return []
+        with connections[using].cursor() as cursor:
+            cursor.execute(
+                f"SELECT title FROM {FTS_TABLE} WHERE {FTS_TABLE} MATCH %s "
+                f"ORDER BY rank LIMIT %s",
+                [match, limit * 5])
+            titles = []
+            for (title,) in cursor.fetchall():
+                if title not in titles:
+                    titles.append(title)
+            return titles[:limit]
+    return list(Movement.objects.using(using)
+                .filter(title__istartswith=prefix.strip())
+                .order_by('title')
+                .values_list('title', flat=True)
+                .distinct()[:limit])
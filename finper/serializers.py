@@ -0,0 +1,161 @@
+""" Representación JSON de movimientos, cuentas e informes.
+
+    Lo comparten las vistas JSON sincrónicas (finper/views.py), las
+    asincrónicas (finper/async_views.py) y la API (finper/api.py): acá se
+    arman los querysets (con values(), sin instanciar modelos) y se convierte
+    cada fila a un dict serializable. Cada vista sólo decide cómo evaluar el
+    queryset.
+
+    MOVEMENT_FIELDS y ACCOUNT_FIELDS asocian cada campo de la representación
+    JSON con su expresión en values(); select_fields() elige un subconjunto
+    (parámetro fields= de la API). Los montos van como texto, para no perder
+    decimales.
+"""
+import datetime
+from decimal import Decimal
+
+from django.db.models import Count, Q, Sum
+
+from .models import Account
+
+MOVEMENT_FIELDS = {
+    'id': 'id',
+    'date': 'date',
+    'title': 'title',
+    'detail': 'detail',
+    'amount': 'amount',
+    'currency': 'currency',
+    'account_in': 'account_in_id',
+    'account_out': 'account_out_id',
+    'category': 'category_id',
+    'category_name': 'category__name',
+    'balance_after_in': 'balance_after_in',
+    'balance_after_out': 'balance_after_out',
+}
+ACCOUNT_FIELDS = {
+    'id': 'id',
+    'codename': 'codename',
+    'name': 'name',
+    'balance_start': 'balance_start',
+    'balance': 'balance',
+}
+
+# Tamaño de página por defecto y máximo de las listas de movimientos
+PAGE_SIZE = 100
+MAX_PAGE_SIZE = 1000
+
+CENTS = Decimal('0.01')
+
+
+def _decimal(value):
+    # Las sumas de SQLite no conservan la escala del campo
+    return None if value is None else str(Decimal(value).quantize(CENTS))
+
+
+def _jsonable(value):
+    if isinstance(value, Decimal):
+        return _decimal(value)
+    if isinstance(value, datetime.date):
+        return value.isoformat()
+    return value
+
+
+def select_fields(available, requested=None):
+    """ Subconjunto de available (MOVEMENT_FIELDS o ACCOUNT_FIELDS) con los
+        campos pedidos, separados por comas. Sin pedido, todos.
+        Si se pide un campo que no existe, ValueError."""
+    if not requested:
+        return available
+    names = [name.strip() for name in requested.split(',') if name.strip()]
+    unknown = [name for name in names if name not in available]
+    if unknown:
+        raise ValueError(f'Campos desconocidos: {", ".join(unknown)}')
+    return {name: available[name] for name in names}
+
+
+def values(queryset, fields, *required):
+    """ queryset.values() con las expresiones de fields y las de required
+        (las que hacen falta aunque no se muestren, como las del cursor)."""
+    lookups = list(dict.fromkeys([*required, *fields.values()]))
+    return queryset.values(*lookups)
+
+
+def serialize_row(row, fields):
+    return {name: _jsonable(row[lookup]) for name, lookup in fields.items()}
+
+
+def parse_cursor(value):
+    """ Convierte una posición 'AAAA-MM-DD_pk' de la planilla en (fecha, pk).
+        Devuelve None si no hay posición; si es inválida, ValueError."""
+    if not value:
+        return None
+    date, pk = value.split('_')
+    return datetime.date.fromisoformat(date), int(pk)
+
+
+def format_cursor(row):
+    return f'{row["date"].isoformat()}_{row["id"]}'
+
+
+def page_size(value):
+    """ Tamaño de página pedido (parámetro limit), entre 1 y MAX_PAGE_SIZE."""
+    if not value:
+        return PAGE_SIZE
+    return min(max(int(value), 1), MAX_PAGE_SIZE)
+
+
+def movement_rows(queryset, before=None, limit=PAGE_SIZE, fields=MOVEMENT_FIELDS):
+    """ Página de movimientos, del más nuevo al más viejo, anteriores a la
+        posición before (paginación por clave: no usa OFFSET). Se pide una
+        fila de más para saber si hay otra página."""
+    if before is not None:
+        date, pk = before
+        queryset = queryset.filter(Q(date__lt=date) | Q(date=date, pk__lt=pk))
+    return values(queryset.order_by('-date', '-pk'), fields, 'id', 'date')[:limit + 1]
+
+
+def serialize_movement(row, fields=MOVEMENT_FIELDS):
+    return serialize_row(row, fields)
+
+
+def movement_page(rows, limit, count, fields=MOVEMENT_FIELDS):
+    """ Arma la respuesta de una página a partir de las filas de
+        movement_rows() y la cantidad total de movimientos filtrados."""
+    results = [serialize_row(row, fields) for row in rows[:limit]]
+    return {
+        'count': count,
+        'next': format_cursor(rows[limit - 1]) if len(rows) > limit else None,
+        'results': results,
+    }
+
+
+def account_rows(fields=ACCOUNT_FIELDS):
+    return values(Account.objects.order_by('codename'), fields)
+
+
+def serialize_account(row, fields=ACCOUNT_FIELDS):
+    return serialize_row(row, fields)
+
+
+def category_report_rows(queryset):
+    """ Ingresos (movimientos sin cuenta de salida), egresos (sin cuenta de
+        entrada) y cantidad de movimientos por categoría. Los traspasos entre
+        cuentas no son ingresos ni egresos."""
+    return queryset.order_by().values('category_id', 'category__name').annotate(
+        income=Sum('amount', filter=Q(account_out__isnull=True)),
+        expense=Sum('amount', filter=Q(account_in__isnull=True)),
+        count=Count('id'),
+    ).order_by('category__name')
+
+
+def serialize_report_row(row):
+    income = row['income'] or 0
+    expense = row['expense'] or 0
+    return {
+        'category': row['category_id'],
+        'category_name': row['category__name'],
+        'income': _decimal(income),
+        'expense': _decimal(expense),
+        'net': _decimal(income - expense),
+        'count': row['count'],
+    }
@@ -0,0 +1,137 @@
+""" Registro de consultas SQL lentas.
+
+    SlowQueryRecorder es un execute wrapper que se instala en cada conexión
+    (señal connection_created). Cuando una consulta tarda más que
+    FINPER_SLOW_QUERIES['THRESHOLD_MS'], guarda en un archivo rotativo una
+    línea JSON con el SQL, sus parámetros, la vista que la originó, la función
+    de finper que la ejecutó (por ejemplo Account.check_balance o
+    Movement._prevaccount) y el plan de ejecución que devuelve el motor
+    (EXPLAIN QUERY PLAN en SQLite, EXPLAIN en los demás).
+"""
+import json
+import logging
+import os
+import sys
+import threading
+import time
+from logging.handlers import RotatingFileHandler
+
+from django.conf import settings
+
+from .middleware import current_view
+
+SLOW_QUERIES_DEFAULTS = {
+    'ENABLED': False,
+    'THRESHOLD_MS': 100,
+    'FILE': os.path.join(settings.BASE_DIR, 'slow_queries.log'),
+    'MAX_BYTES': 5 * 1024 * 1024,
+    'BACKUP_COUNT': 5,
+    'EXPLAIN': True,
+}
+
+# Módulos que no se informan como origen de la consulta
+_SKIPPED_MODULES = ('finper.slowqueries', 'finper.middleware')
+
+_local = threading.local()
+_loggers = {}
+
+
+def slow_queries_settings():
+    return {**SLOW_QUERIES_DEFAULTS, **getattr(settings, 'FINPER_SLOW_QUERIES', {})}
+
+
+def get_logger(path, max_bytes, backup_count):
+    """ Logger que escribe en el archivo rotativo path (uno por archivo)."""
+    if path not in _loggers:
+        logger = logging.getLogger(f'finper.slowqueries.{len(_loggers)}')
+        handler = RotatingFileHandler(path, maxBytes=max_bytes,
+                                      backupCount=backup_count,
+                                      encoding='utf-8')
+        handler.setFormatter(logging.Formatter('%(message)s'))
+        logger.addHandler(handler)
+        logger.setLevel(logging.INFO)
+        logger.propagate = False
+        _loggers[path] = logger
+    return _loggers[path]
+
+
+def calling_function():
+    """ Devuelve 'módulo.función:línea' de la función de finper más cercana
+        en la pila de llamadas, o None si la consulta no vino de finper."""
+    frame = sys._getframe(1)
+    while frame is not None:
+        module = frame.f_globals.get('__name__', '')
+        if module.startswith('finper.') and not module.startswith(_SKIPPED_MODULES):
+            code = frame.f_code
+            name = getattr(code, 'co_qualname', code.co_name)
+            return f'{module}.{name}:{frame.f_lineno}'
+        frame = frame.f_back
+    return None
+
+
+def explain(connection, sql, params):
+    """ Devuelve el plan de ejecución de una consulta SELECT, como lista de
+        líneas, o None si no corresponde."""
+    if not sql.lstrip().upper().startswith(('SELECT', 'WITH')):
+        return None
+    prefix = 'EXPLAIN QUERY PLAN ' if connection.vendor == 'sqlite' else 'EXPLAIN '
+    _local.explaining = True
+    try:
+        with connection.cursor() as cursor:
+            cursor.execute(prefix + sql, params)
+            return [' '.join(str(column) for column in row)
+                    for row in cursor.fetchall()]
+    except Exception as error:
+        return [f'EXPLAIN falló: {error}']
+    finally:
+        _local.explaining = False
+
+
+def _jsonable(params):
+    if params is None:
+        return None
+    return [param if isinstance(param, (int, float, str, bool, type(None)))
+            else str(param) for param in params]
+
+
+class SlowQueryRecorder:
+    """ Execute wrapper que registra las consultas más lentas que el umbral."""
+
+    def __call__(self, execute, sql, params, many, context):
+        if getattr(_local, 'explaining', False):
+            return execute(sql, params, many, context)
+        start = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            elapsed = (time.perf_counter() - start) * 1000
+            config = slow_queries_settings()
+            if config['ENABLED'] and elapsed >= config['THRESHOLD_MS']:
+                self.record(context['connection'], sql, params, many,
+                            elapsed, config)
+
+    @staticmethod
+    def record(connection, sql, params, many, elapsed, config):
+        sample = {
+            'time': time.strftime('%Y-%m-%dT%H:%M:%S'),
+            'ms': round(elapsed, 1),
+            'database': connection.alias,
+            'view': current_view.get(),
+            'function': calling_function(),
+            'sql': sql,
+            'params': None if many else _jsonable(params),
+        }
+        if config['EXPLAIN'] and not many:
+            sample['explain'] = explain(connection, sql, params)
+        get_logger(config['FILE'], config['MAX_BYTES'], config['BACKUP_COUNT'])\
+            .info(json.dumps(sample, ensure_ascii=False))
+
+
+recorder = SlowQueryRecorder()
+
+
+def install(connection, **kwargs):
+    """ Instala el registro de consultas lentas en la conexión.
+        Se conecta a la señal connection_created."""
+    if recorder not in connection.execute_wrappers:
+        connection.execute_wrappers.append(recorder)
@@ -0,0 +1,114 @@
+""" Perfil de rendimiento para SQLite.
+
+    apply_profile() se conecta a la señal connection_created y configura cada
+    conexión SQLite con los PRAGMA de FINPER_SQLITE:
+    - journal_mode=WAL: las lecturas no esperan a las escrituras (y viceversa);
+    - synchronous=NORMAL: con WAL es seguro ante caídas del proceso y evita
+      un fsync por transacción;
+    - cache_size, mmap_size, temp_store: más páginas en memoria;
+    - busy_timeout: cuánto espera una escritura a que se libere el lock antes
+      de fallar con "database is locked".
+
+    busy_timeout no alcanza en todos los casos: una transacción que empezó
+    leyendo y después quiere escribir falla enseguida si otra conexión
+    escribió en el medio. Para eso está retry_on_busy(), que reintenta la
+    escritura completa dentro de una transacción nueva.
+"""
+import functools
+import random
+import time
+
+from django.conf import settings
+from django.db import OperationalError, router, transaction
+
+from .metrics import BUSY_RETRIES
+
+SQLITE_DEFAULTS = {
+    'ENABLED': True,
+    'JOURNAL_MODE': 'WAL',
+    'SYNCHRONOUS': 'NORMAL',
+    # Negativo: en KiB (64 MiB); positivo: en páginas
+    'CACHE_SIZE': -64000,
+    'MMAP_SIZE': 256 * 1024 * 1024,
+    'TEMP_STORE': 'MEMORY',
+    # En milisegundos
+    'BUSY_TIMEOUT': 5000,
+    # Reintentos de retry_on_busy() y espera inicial (en segundos, se duplica
+    # en cada intento)
+    'RETRIES': 5,
+    'RETRY_DELAY': 0.05,
+}
+
+_BUSY_MESSAGES = ('database is locked', 'database table is locked',
+                  'database is busy')
+
+
+def sqlite_settings():
+    return {**SQLITE_DEFAULTS, **getattr(settings, 'FINPER_SQLITE', {})}
+
+
+def profile_pragmas(config=None):
+    """ Devuelve la lista de PRAGMA del perfil configurado."""
+    config = config or sqlite_settings()
+    return [
+        f"PRAGMA journal_mode={config['JOURNAL_MODE']}",
+        f"PRAGMA synchronous={config['SYNCHRONOUS']}",
+        f"PRAGMA cache_size={int(config['CACHE_SIZE'])}",
+        f"PRAGMA mmap_size={int(config['MMAP_SIZE'])}",
+        f"PRAGMA temp_store={config['TEMP_STORE']}",
+        f"PRAGMA busy_timeout={int(config['BUSY_TIMEOUT'])}",
+    ]
+
+
+def apply_profile(connection, **kwargs):
+    """ Aplica el perfil a una conexión SQLite recién creada.
+        Se conecta a la señal connection_created."""
+    if connection.vendor != 'sqlite':
+        return
+    config = sqlite_settings()
+    if not config['ENABLED']:
+        return
+    with connection.cursor() as cursor:
+        for pragma in profile_pragmas(config):
+            cursor.execute(pragma)
+
+
+def is_busy_error(error):
+    return isinstance(error, OperationalError) and \
+        any(message in str(error) for message in _BUSY_MESSAGES)
+
+
+def retry_on_busy(method):
+    """ Decorador para los métodos de un modelo que escriben en el libro.
+
+        Ejecuta el método dentro de una transacción. Si SQLite responde que la
+        base está ocupada, la transacción se deshace, se llama al método
+        _discard_unsaved() de la instancia (para descartar lo que el intento
+        fallido cambió en memoria) y se reintenta después de una espera.
+
+        Dentro de una transacción ya abierta no se reintenta: deshacer sólo
+        una parte dejaría la transacción exterior a medias, así que el error
+        se propaga para que la reintente quien la abrió."""
+
+    @functools.wraps(method)
+    def wrapper(self, *args, **kwargs):
+        using = kwargs.get('using') or router.db_for_write(type(self), instance=self)
+        config = sqlite_settings()
+        retries = 0 if transaction.get_connection(using).in_atomic_block \
+            else config['RETRIES']
+        delay = config['RETRY_DELAY']
+        for attempt in range(retries + 1):
+            try:
+                with transaction.atomic(using=using):
+                    return method(self, *args, **kwargs)
+            except OperationalError as error:
+                if attempt == retries or not is_busy_error(error):
+                    raise
+            BUSY_RETRIES.inc()
+            discard = getattr(self, '_discard_unsaved', None)
+            if discard is not None:
+                discard()
+            time.sleep(delay * (1 + random.random()))
+            delay *= 2
+
+    return wrapper
@@ -0,0 +1,63 @@
+import datetime
+
+from django.contrib.admin.sites import AdminSite
+from django.contrib.auth.models import User
+from django.contrib.messages.storage.cookie import CookieStorage
+from django.db import connection
+from django.test import RequestFactory, TestCase
+from django.test.utils import CaptureQueriesContext
+
+from finper.admin import AccountAdmin, CategoryAdmin, MovementAdmin
+from finper.models import Account, Category, Movement
+from finper.tests.test_models import create_account, create_movement
+
+
+class AdminTest(TestCase):
+    """ Pruebas para el admin de movimientos, cuentas y categorías"""
+
+    def setUp(self):
+        self.site = AdminSite()
+        self.cuenta_a = create_account('ca', 'Cuenta A', 100)
+        self.cuenta_b = create_account('cb', 'Cuenta B', 50)
+        for dia in range(1, 6):
+            create_movement(cuenta_in=self.cuenta_a, cuenta_out=self.cuenta_b, monto=dia,
+                            fecha=datetime.date(2020, 1, dia))
+        self.request = RequestFactory().get('/')
+        self.request.user = User.objects.create_superuser('admin', '', 'admin')
+        self.request._messages = CookieStorage(self.request)
+
+    def saldo(self, cuenta):
+        return Account.objects.get(pk=cuenta.pk).balance
+
+    def test_listado_sin_consultas_por_fila(self):
+        admin = MovementAdmin(Movement, self.site)
+        changelist = admin.get_changelist_instance(self.request)
+        with self.assertNumQueries(1):
+            [str(movement) for movement in changelist.result_list]
+
+    def test_borrar_seleccionados_corrige_saldos(self):
+        admin = MovementAdmin(Movement, self.site)
+        with CaptureQueriesContext(connection) as queries:
+            admin.delete_queryset(self.request, Movement.objects.filter(date__lte='2020-01-03'))
+        updates = [query['sql'] for query in queries.captured_queries
+                   if query['sql'].startswith('UPDATE "finper_account"')]
+        self.assertEqual(len(updates), 2)
+        self.assertEqual(self.saldo(self.cuenta_a), 109)
+        self.assertEqual(self.saldo(self.cuenta_b), 41)
+        self.assertEqual(self.cuenta_a.check_running_balances(), [])
+
+    def test_recalcular_saldos(self):
+        Account.objects.filter(pk=self.cuenta_a.pk).update(balance=0)
+        admin = AccountAdmin(Account, self.site)
+        admin.correct_balances(self.request, Account.objects.all())
+        self.assertEqual(self.saldo(self.cuenta_a), 115)
+        self.assertEqual(self.saldo(self.cuenta_b), 35)
+        self.assertEqual(admin.get_readonly_fields(self.request, self.cuenta_a),
+                         ['balance_start', 'balance_previous', 'balance'])
+
+    def test_categorias_con_cantidad_de_movimientos(self):
+        admin = CategoryAdmin(Category, self.site)
+        with self.assertNumQueries(1):
+            counts = [admin.movement_count(category)
+                      for category in admin.get_queryset(self.request)]
+        self.assertEqual(counts, [1] * 5)
@@ -0,0 +1,229 @@
+import datetime
+import json
+
+from django.test import RequestFactory, TestCase
+
+from finper import api
+from finper.changes import compact_changes
+from finper.models import Account, Movement
+from finper.tests.test_models import create_account, create_category, create_movement
+
+
+class ApiTestCase(TestCase):
+
+    def setUp(self):
+        self.factory = RequestFactory()
+        self.cuenta = create_account('ca', 'Cuenta', 100)
+        self.otra = create_account('co', 'Otra', 50)
+        self.categoria = create_category()
+
+    def llamar(self, vista, method='get', data=None, pk=None, content_type='application/json'):
+        if method == 'get':
+            request = self.factory.get('/api/', data or {})
+        else:
+            request = getattr(self.factory, method)(
+                '/api/', json.dumps(data or {}), content_type=content_type)
+        response = vista(request) if pk is None else vista(request, pk)
+        contenido = json.loads(response.content) if response.content else None
+        return response.status_code, contenido
+
+
+class MovementApiTest(ApiTestCase):
+    """ Pruebas para la API de movimientos"""
+
+    def datos(self, **cambios):
+        return {'date': '2020-03-01', 'title': 'Sueldo', 'amount': '25.50',
+                'currency': '$', 'account_in': self.cuenta.pk,
+                'category': self.categoria.pk, **cambios}
+
+    def test_alta_actualiza_saldos(self):
+        status, data = self.llamar(api.movements, 'post', self.datos())
+        self.assertEqual(status, 201)
+        self.assertEqual(data['amount'], '25.50')
+        self.assertEqual(data['balance_after_in'], '125.50')
+        self.assertEqual(Account.objects.get(pk=self.cuenta.pk).balance, 125.5)
+
+    def test_alta_sin_cuentas(self):
+        status, data = self.llamar(api.movements, 'post', self.datos(account_in=None))
+        self.assertEqual(status, 400)
+        self.assertEqual(Movement.objects.count(), 0)
+
+    def test_alta_invalida(self):
+        status, data = self.llamar(api.movements, 'post', self.datos(amount='mucho'))
+        self.assertEqual(status, 400)
+        self.assertIn('amount', data['error'])
+
+    def test_cuerpo_no_json(self):
+        status, data = self.llamar(api.movements, 'post', self.datos(),
+                                   content_type='application/x-www-form-urlencoded')
+        self.assertEqual(status, 415)
+
+    def test_lista_paginada_con_campos_y_filtros(self):
+        for dia in range(1, 4):
+            create_movement(cuenta_in=self.cuenta, monto=dia,
+                            fecha=datetime.date(2020, 1, dia))
+        create_movement(cuenta_out=self.otra, monto=9, fecha=datetime.date(2020, 1, 5))
+        status, data = self.llamar(api.movements, data={
+            'account': self.cuenta.pk, 'limit': 2, 'fields': 'amount,date'})
+        self.assertEqual(status, 200)
+        self.assertEqual(data['count'], 3)
+        self.assertEqual(data['results'], [{'amount': '3.00', 'date': '2020-01-03'},
+                                           {'amount': '2.00', 'date': '2020-01-02'}])
+        status, data = self.llamar(api.movements, data={
+            'account': self.cuenta.pk, 'limit': 2, 'fields': 'amount',
+            'before': data['next']})
+        self.assertEqual(data['results'], [{'amount': '1.00'}])
+        self.assertIsNone(data['next'])
+
+    def test_campo_desconocido(self):
+        status, data = self.llamar(api.movements, data={'fields': 'amount,saldo'})
+        self.assertEqual(status, 400)
+        self.assertIn('saldo', data['error'])
+
+    def test_lista_sin_instanciar_modelos(self):
+        create_movement(cuenta_in=self.cuenta, monto=1)
+        with self.assertNumQueries(2):
+            self.llamar(api.movements)
+
+    def test_patch_modifica_monto_y_saldos(self):
+        mov = create_movement(cuenta_in=self.cuenta, cuenta_out=self.otra, monto=10)
+        status, data = self.llamar(api.movement, 'patch', {'amount': '15'}, pk=mov.pk)
+        self.assertEqual(status, 200)
+        self.assertEqual(data['amount'], '15.00')
+        self.assertEqual(data['title'], 'Movimiento de prueba')
+        self.assertEqual(Account.objects.get(pk=self.cuenta.pk).balance, 115)
+        self.assertEqual(Account.objects.get(pk=self.otra.pk).balance, 35)
+
+    def test_put_requiere_todos_los_campos(self):
+        mov = create_movement(cuenta_in=self.cuenta, monto=10)
+        status, data = self.llamar(api.movement, 'put', {'amount': '15'}, pk=mov.pk)
+        self.assertEqual(status, 400)
+        status, data = self.llamar(api.movement, 'put', self.datos(), pk=mov.pk)
+        self.assertEqual(status, 200)
+        self.assertEqual(data['title'], 'Sueldo')
+
+    def test_baja(self):
+        mov = create_movement(cuenta_in=self.cuenta, monto=10)
+        status, data = self.llamar(api.movement, 'delete', pk=mov.pk)
+        self.assertEqual(status, 204)
+        self.assertEqual(Account.objects.get(pk=self.cuenta.pk).balance, 100)
+        status, data = self.llamar(api.movement, pk=mov.pk)
+        self.assertEqual(status, 404)
+
+    def test_metodo_no_permitido(self):
+        status, data = self.llamar(api.movements, 'delete')
+        self.assertEqual(status, 405)
+
+
+class AccountApiTest(ApiTestCase):
+    """ Pruebas para la API de cuentas"""
+
+    def test_alta_con_saldo_inicial(self):
+        status, data = self.llamar(api.accounts, 'post', {
+            'codename': 'cn', 'name': 'Nueva', 'balance_start': '10', 'balance': '99'})
+        self.assertEqual(status, 201)
+        self.assertEqual(data['balance'], '10.00')
+
+    def test_lista_paginada(self):
+        status, data = self.llamar(api.accounts, data={'limit': 1, 'fields': 'codename'})
+        self.assertEqual(data['results'], [{'codename': 'ca'}])
+        status, data = self.llamar(api.accounts, data={'limit': 1, 'after': data['next']})
+        self.assertEqual(data['results'][0]['codename'], 'co')
+        self.assertIsNone(data['next'])
+
+    def test_modificacion_no_cambia_saldos(self):
+        status, data = self.llamar(api.account, 'patch',
+                                   {'name': 'Renombrada', 'balance': '0'}, pk=self.cuenta.pk)
+        self.assertEqual(status, 200)
+        self.assertEqual(data['name'], 'Renombrada')
+        self.assertEqual(data['balance'], '100.00')
+
+    def test_baja_de_cuenta_con_movimientos(self):
+        create_movement(cuenta_in=self.cuenta, monto=1)
+        status, data = self.llamar(api.account, 'delete', pk=self.cuenta.pk)
+        self.assertEqual(status, 409)
+        status, data = self.llamar(api.account, 'delete', pk=self.otra.pk)
+        self.assertEqual(status, 204)
+
+
+class MovementBatchApiTest(ApiTestCase):
+    """ Pruebas para el lote de operaciones sobre movimientos"""
+
+    def test_lote_con_altas_modificaciones_y_bajas(self):
+        mov = create_movement(cuenta_in=self.cuenta, monto=10)
+        borrar = create_movement(cuenta_out=self.otra, monto=5)
+        status, data = self.llamar(api.movement_batch, 'post', {'operations': [
+            {'op': 'create', 'data': {'date': '2020-01-01', 'title': 'Uno',
+                                      'amount': '7', 'currency': '$',
+                                      'account_in': self.otra.pk,
+                                      'category': self.categoria.pk}},
+            {'op': 'update', 'id': mov.pk, 'data': {'amount': '12'}},
+            {'op': 'delete', 'id': borrar.pk},
+        ]})
+        self.assertEqual(status, 200)
+        self.assertEqual([r['status'] for r in data['results']], [201, 200, 204])
+        self.assertEqual(data['results'][0]['data']['balance_after_in'], '57.00')
+        self.assertEqual(data['results'][1]['data']['amount'], '12.00')
+        self.assertIsNone(data['results'][2]['data'])
+        self.assertEqual(Account.objects.get(pk=self.cuenta.pk).balance, 112)
+        self.assertEqual(Account.objects.get(pk=self.otra.pk).balance, 57)
+
+    def test_error_deshace_el_lote(self):
+        status, data = self.llamar(api.movement_batch, 'post', {'operations': [
+            {'op': 'create', 'data': {'date': '2020-01-01', 'title': 'Uno',
+                                      'amount': '7', 'currency': '$',
+                                      'account_in': self.otra.pk,
+                                      'category': self.categoria.pk}},
+            {'op': 'delete', 'id': 'x'},
+        ]})
+        self.assertEqual(status, 404)
+        self.assertEqual(data['error']['index'], 1)
+        self.assertTrue(data['error']['rolled_back'])
+        self.assertEqual(Movement.objects.count(), 0)
+        self.assertEqual(Account.objects.get(pk=self.otra.pk).balance, 50)
+
+    def test_operacion_desconocida(self):
+        status, data = self.llamar(api.movement_batch, 'post',
+                                   {'operations': [{'op': 'mover'}]})
+        self.assertEqual(status, 400)
+
+
+class MovementIngestApiTest(ApiTestCase):
+    """ Pruebas para la ingesta de movimientos en NDJSON"""
+
+    def test_respuesta_en_streaming(self):
+        lineas = [json.dumps({'date': '2020-01-01', 'title': 'Uno', 'amount': '7',
+                              'currency': '$', 'account_in': self.cuenta.pk,
+                              'category': self.categoria.pk}),
+                  json.dumps({'title': 'Dos'})]
+        request = self.factory.post('/api/', '\n'.join(lineas),
+                                    content_type='application/x-ndjson')
+        response = api.movement_ingest(request)
+        self.assertTrue(response.streaming)
+        resultados = [json.loads(linea) for linea in b''.join(response).splitlines()]
+        self.assertEqual([r.get('status') for r in resultados], [201, 400, None])
+        self.assertIn('date', resultados[1]['error'])
+        self.assertEqual(Account.objects.get(pk=self.cuenta.pk).balance, 107)
+
+    def test_requiere_ndjson(self):
+        status, data = self.llamar(api.movement_ingest, 'post', {})
+        self.assertEqual(status, 415)
+
+
+class ChangesApiTest(ApiTestCase):
+    """ Pruebas para el feed de cambios"""
+
+    def test_cambios_y_resincronizacion(self):
+        mov = create_movement(cuenta_in=self.cuenta, monto=10)
+        status, data = self.llamar(api.changes, data={'since': 0})
+        self.assertEqual(status, 200)
+        self.assertEqual([m['id'] for m in data['movements']], [mov.pk])
+        since = data['next']
+        mov.delete()
+        create_movement(cuenta_in=self.cuenta, monto=1)
+        compact_changes(days=0)
+        status, data = self.llamar(api.changes, data={'since': since})
+        self.assertEqual(status, 410)
+        self.assertTrue(data['error']['resync'])
+        status, data = self.llamar(api.changes, data={'since': 'x'})
+        self.assertEqual(status, 400)
@@ -0,0 +1,64 @@
+import datetime
+import json
+
+from django.http import Http404
+from django.test import AsyncRequestFactory, TestCase
+
+from finper import async_views
+from finper.tests.test_models import create_account, create_movement
+
+
+class AsyncViewsTest(TestCase):
+    """ Pruebas para las vistas JSON asincrónicas"""
+
+    def setUp(self):
+        self.cuenta = create_account('ca', 'Cuenta', 100)
+        self.otra = create_account('co', 'Otra', 50)
+        self.movs = [create_movement(cuenta_in=self.cuenta, monto=10,
+                                     fecha=datetime.date(2020, 1, dia))
+                     for dia in range(1, 6)]
+        create_movement(cuenta_out=self.otra, monto=7, fecha=datetime.date(2020, 2, 1))
+        self.factory = AsyncRequestFactory()
+
+    async def get(self, vista, **params):
+        response = await vista(self.factory.get('/prueba/', params))
+        return response.status_code, json.loads(response.content)
+
+    async def test_movimientos_paginados_por_clave(self):
+        status, data = await self.get(async_views.movements_json, limit=4,
+                                      account=self.cuenta.pk)
+        self.assertEqual(status, 200)
+        self.assertEqual(data['count'], 5)
+        self.assertEqual([mov['date'] for mov in data['results']],
+                         ['2020-01-05', '2020-01-04', '2020-01-03', '2020-01-02'])
+        self.assertEqual(data['results'][0]['amount'], '10.00')
+        status, data = await self.get(async_views.movements_json, limit=4,
+                                      account=self.cuenta.pk, before=data['next'])
+        self.assertEqual([mov['id'] for mov in data['results']], [self.movs[0].pk])
+        self.assertIsNone(data['next'])
+
+    async def test_filtro_invalido(self):
+        status, data = await self.get(async_views.movements_json, date_from='ayer')
+        self.assertEqual(status, 400)
+        self.assertIn('date_from', data['error'])
+        status, data = await self.get(async_views.movements_json, before='x')
+        self.assertEqual(status, 400)
+
+    async def test_cuentas(self):
+        status, data = await self.get(async_views.accounts_json)
+        self.assertEqual([cuenta['codename'] for cuenta in data['results']], ['ca', 'co'])
+        self.assertEqual(data['results'][0]['balance'], '150.00')
+        status, data = await self.get(async_views.accounts_json, account=self.otra.pk)
+        self.assertEqual(data['balance'], '43.00')
+        with self.assertRaises(Http404):
+            await self.get(async_views.accounts_json, account=0)
+
+    async def test_informe_por_categoria(self):
+        status, data = await self.get(async_views.report_json, date_to='2020-01-31')
+        # create_movement crea una categoría por movimiento
+        self.assertEqual(len(data['results']), 5)
+        self.assertEqual(data['results'][0]['income'], '10.00')
+        self.assertEqual(data['results'][0]['net'], '10.00')
+        status, data = await self.get(async_views.report_json, date_from='2020-02-01')
+        self.assertEqual(data['results'][0]['expense'], '7.00')
+        self.assertEqual(data['results'][0]['net'], '-7.00')
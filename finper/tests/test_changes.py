@@ -0,0 +1,104 @@
+import datetime
+from io import StringIO
+
+from django.core.management import call_command
+from django.test import TestCase, override_settings
+
+from finper.changes import ChangesExpired, changes_since, compact_changes
+from finper.ledger import LedgerBatch
+from finper.models import Change, ChangeCompaction
+from finper.tests.test_models import create_account, create_movement
+
+
+def last_seq():
+    return Change.objects.order_by('-pk').values_list('pk', flat=True).first() or 0
+
+
+class ChangesTest(TestCase):
+    """ Pruebas para el feed de cambios del libro"""
+
+    def setUp(self):
+        self.cuenta = create_account('ca', 'Cuenta', 100)
+        self.otra = create_account('co', 'Otra', 50)
+        self.mov = create_movement(cuenta_in=self.cuenta, monto=10)
+        self.seq = last_seq()
+
+    def test_solo_lo_posterior(self):
+        self.assertEqual(changes_since(self.seq)['movements'], [])
+        nuevo = create_movement(cuenta_out=self.otra, monto=5)
+        data = changes_since(self.seq)
+        self.assertEqual([mov['id'] for mov in data['movements']], [nuevo.pk])
+        self.assertNotIn('balance_after_out', data['movements'][0])
+        # La cuenta del movimiento, con su saldo nuevo
+        self.assertEqual(data['accounts'], [{'id': self.otra.pk, 'codename': 'co',
+                                             'name': 'Otra', 'balance_start': '50.00',
+                                             'balance': '45.00'}])
+        self.assertEqual(data['next'], last_seq())
+        self.assertFalse(data['more'])
+
+    def test_bajas(self):
+        pk = self.mov.pk
+        self.mov.delete()
+        data = changes_since(self.seq)
+        self.assertEqual(data['movements'], [])
+        self.assertEqual(data['deleted'], {'movements': [pk], 'accounts': []})
+        self.assertEqual(data['accounts'][0]['balance'], '100.00')
+
+    def test_paginas(self):
+        for dia in range(1, 6):
+            create_movement(cuenta_in=self.cuenta, monto=1, fecha=datetime.date(2020, 1, dia))
+        vistos, since, paginas = set(), self.seq, 0
+        while True:
+            data = changes_since(since, limit=3)
+            vistos.update(mov['id'] for mov in data['movements'])
+            since, paginas = data['next'], paginas + 1
+            if not data['more']:
+                break
+        self.assertEqual(len(vistos), 5)
+        self.assertGreater(paginas, 1)
+        self.assertEqual(since, last_seq())
+
+    def test_lote_registra_las_cuentas(self):
+        with LedgerBatch():
+            create_movement(cuenta_in=self.cuenta, cuenta_out=self.otra, monto=3)
+        cambios = Change.objects.filter(pk__gt=self.seq, model=Change.ACCOUNT)
+        self.assertEqual(sorted(cambios.values_list('object_id', flat=True)),
+                         [self.cuenta.pk, self.otra.pk])
+
+    def test_compactacion(self):
+        borrado = create_movement(cuenta_in=self.otra, monto=1)
+        seq = last_seq()
+        borrado.delete()
+        create_movement(cuenta_in=self.cuenta, monto=1)
+        antes = Change.objects.count()
+        superados, bajas = compact_changes(days=0)
+        self.assertGreater(superados, 0)
+        self.assertEqual(bajas, 1)
+        self.assertEqual(Change.objects.count(), antes - superados - bajas)
+        # Un cambio por objeto vivo
+        self.assertEqual(Change.objects.filter(model=Change.MOVEMENT).count(), 2)
+        with self.assertRaises(ChangesExpired):
+            changes_since(seq)
+        # Desde 0 se descarga todo lo vivo
+        data = changes_since(0)
+        self.assertEqual(len(data['movements']), 2)
+        self.assertEqual(data['deleted']['movements'], [])
+
+    def test_compactacion_conserva_el_ultimo_cambio(self):
+        self.mov.delete()
+        seq = last_seq()
+        compact_changes(days=0)
+        # La baja es el último cambio: no se descarta
+        self.assertEqual(last_seq(), seq)
+        self.assertTrue(Change.objects.get(pk=seq).deleted)
+        self.assertFalse(ChangeCompaction.objects.exists())
+
+    @override_settings(FINPER_CHANGES={'TOMBSTONE_DAYS': 30})
+    def test_comando(self):
+        self.mov.delete()
+        create_movement(cuenta_in=self.cuenta, monto=1)
+        out = StringIO()
+        call_command('compact_changes', stdout=out)
+        self.assertIn('0 bajas', out.getvalue())
+        call_command('compact_changes', '--days', '0', stdout=out)
+        self.assertIn('1 bajas', out.getvalue())
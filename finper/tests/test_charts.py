@@ -0,0 +1,79 @@
+import datetime
+import multiprocessing
+
+from django.core.cache import cache
+from django.test import TestCase
+
+from finper.cache import bump_ledger_version, ledger_cached, ledger_version
+from finper.charts import account_balance_series, lttb, minmax, net_worth_series
+from finper.tests.test_models import create_account, create_movement
+
+
+class BalanceSeriesTest(TestCase):
+    """ Pruebas para las series de saldos de los gráficos"""
+
+    def setUp(self):
+        cache.clear()
+        self.acc1 = create_account(cod='a1', nombre='Account1', saldo_inicial=1000)
+        self.acc2 = create_account(cod='a2', nombre='Account2', saldo_inicial=500)
+        self.dia1 = datetime.date(2020, 3, 1)
+        self.dia2 = datetime.date(2020, 3, 2)
+        self.dia3 = datetime.date(2020, 3, 3)
+        create_movement(cuenta_in=self.acc1, monto=100, fecha=self.dia1)
+        create_movement(cuenta_out=self.acc1, cuenta_in=self.acc2, monto=50,
+                        fecha=self.dia2)
+        create_movement(cuenta_out=self.acc1, monto=30, fecha=self.dia2)
+        create_movement(cuenta_in=self.acc2, monto=5, fecha=self.dia3)
+
+    def test_serie_de_cuenta_tiene_saldo_al_final_de_cada_dia(self):
+        self.assertEqual(account_balance_series(self.acc1),
+                         [(self.dia1, 1100), (self.dia2, 1020)])
+
+    def test_serie_de_cuenta_empieza_con_saldo_de_apertura(self):
+        self.assertEqual(account_balance_series(self.acc2, date_from=self.dia2),
+                         [(self.dia1, 500), (self.dia2, 550), (self.dia3, 555)])
+
+    def test_serie_de_patrimonio_ignora_traspasos(self):
+        self.assertEqual(net_worth_series(date_from=self.dia2),
+                         [(self.dia1, 1600), (self.dia2, 1570), (self.dia3, 1575)])
+
+    def test_la_version_del_libro_invalida_el_cache(self):
+        version = ledger_version()
+        self.assertEqual(ledger_cached('prueba', (1,), lambda: 'viejo'), 'viejo')
+        self.assertEqual(ledger_cached('prueba', (1,), lambda: 'nuevo'), 'viejo')
+        create_movement(cuenta_in=self.acc1, monto=1, fecha=self.dia3)
+        self.assertGreater(ledger_version(), version)
+        self.assertEqual(ledger_cached('prueba', (1,), lambda: 'nuevo'), 'nuevo')
+
+    def test_otro_proceso_ve_el_cambio_de_version(self):
+        self.assertEqual(ledger_cached('prueba', (2,), lambda: 'viejo'), 'viejo')
+        # Una escritura en otro worker
+        proceso = multiprocessing.get_context('fork').Process(target=bump_ledger_version)
+        proceso.start()
+        proceso.join()
+        self.assertEqual(proceso.exitcode, 0)
+        self.assertEqual(ledger_cached('prueba', (2,), lambda: 'nuevo'), 'nuevo')
+
+
+class DownsamplingTest(TestCase):
+    """ Pruebas para la reducción de series"""
+
+    def setUp(self):
+        inicio = datetime.date(2020, 1, 1)
+        self.serie = [(inicio + datetime.timedelta(days=x), (x * 37) % 101)
+                      for x in range(1000)]
+
+    def test_lttb_conserva_extremos_y_cantidad_de_puntos(self):
+        reducida = lttb(self.serie, 50)
+        self.assertEqual(len(reducida), 50)
+        self.assertEqual((reducida[0], reducida[-1]), (self.serie[0], self.serie[-1]))
+        self.assertEqual(reducida, sorted(reducida))
+
+    def test_minmax_conserva_minimo_y_maximo(self):
+        reducida = minmax(self.serie, 50)
+        self.assertLessEqual(len(reducida), 50)
+        saldos = [saldo for fecha, saldo in reducida]
+        self.assertEqual((min(saldos), max(saldos)), (0, 100))
+
+    def test_serie_corta_no_se_reduce(self):
+        self.assertEqual(lttb(self.serie[:10], 50), self.serie[:10])
@@ -0,0 +1,128 @@
+""" Pruebas de bloqueo de cuentas y escrituras concurrentes.
+
+    Las pruebas de ConcurrentWritesTest necesitan una base PostgreSQL (con
+    SQLite la base entera se bloquea en cada escritura, así que no hay nada
+    que probar); sin ella se saltean. Por ejemplo, con un contenedor local:
+
+        docker run -d -p 5432:5432 -e POSTGRES_PASSWORD=finper postgres
+        FINPER_POSTGRES_DB=postgres FINPER_POSTGRES_PASSWORD=finper \\
+            python manage.py test finper.tests.test_concurrency
+"""
+import random
+import threading
+import time
+import unittest
+from decimal import Decimal
+
+from django.db import connection, connections
+from django.test import TestCase, TransactionTestCase
+from django.test.utils import CaptureQueriesContext
+
+from finper.models import Account, Movement
+from finper.tests.test_models import create_account, create_category, create_movement
+
+
+class AccountLockingTest(TestCase):
+    """ Pruebas para el bloqueo de cuentas en Movement.save() y delete()"""
+
+    def setUp(self):
+        self.cuenta_a = create_account('ca', 'Cuenta A', 100)
+        self.cuenta_b = create_account('cb', 'Cuenta B', 100)
+
+    def test_instancia_vieja_no_pisa_el_saldo(self):
+        vieja = Account.objects.get(pk=self.cuenta_a.pk)
+        create_movement(cuenta_in=self.cuenta_a, monto=10)
+        # vieja todavía tiene saldo 100 en memoria
+        create_movement(cuenta_in=vieja, monto=5)
+        self.assertEqual(Account.objects.get(pk=self.cuenta_a.pk).balance, 115)
+        self.assertEqual(vieja.balance, 115)
+
+    def test_borrado_con_instancia_vieja(self):
+        mov = create_movement(cuenta_in=self.cuenta_a, cuenta_out=self.cuenta_b, monto=10)
+        mov = Movement.objects.get(pk=mov.pk)
+        create_movement(cuenta_in=self.cuenta_a, monto=5)
+        mov.delete()
+        self.assertEqual(Account.objects.get(pk=self.cuenta_a.pk).balance, 105)
+        self.assertEqual(Account.objects.get(pk=self.cuenta_b.pk).balance, 100)
+
+    def test_bloqueo_en_orden_de_pk(self):
+        with CaptureQueriesContext(connection) as queries:
+            create_movement(cuenta_in=self.cuenta_b, cuenta_out=self.cuenta_a, monto=1)
+        selects = [query['sql'] for query in queries.captured_queries
+                   if 'FROM "finper_account"' in query['sql']
+                   and '"finper_account"."balance_previous"' in query['sql']]
+        lock = selects[0]
+        self.assertIn('ORDER BY "finper_account"."id" ASC', lock)
+        if connection.features.has_select_for_update:
+            self.assertIn('FOR UPDATE', lock)
+        else:
+            self.assertNotIn('FOR UPDATE', lock)
+
+
+@unittest.skipUnless(connection.vendor == 'postgresql',
+                     'Las pruebas de concurrencia necesitan PostgreSQL')
+class ConcurrentWritesTest(TransactionTestCase):
+    """ Escrituras concurrentes sobre PostgreSQL"""
+
+    workers = 8
+    movements = 25
+
+    def setUp(self):
+        self.cuentas = [create_account(f'c{i}', f'Cuenta {i}', 1000)
+                        for i in range(2 * self.workers)]
+        self.categoria = create_category()
+
+    def cargar(self, pares, lock=None):
+        """ Un hilo por par de cuentas; cada uno carga self.movements
+            movimientos. Con lock, los hilos se turnan (escrituras en serie).
+            Devuelve la duración total."""
+        errores = []
+
+        def trabajo(cuenta_in, cuenta_out):
+            try:
+                for numero in range(self.movements):
+                    if lock is not None:
+                        lock.acquire()
+                    try:
+                        Movement.objects.create(
+                            date='2020-01-01', title=f'Concurrente {numero}',
+                            amount=Decimal(1), account_in=cuenta_in,
+                            account_out=cuenta_out, category=self.categoria)
+                    finally:
+                        if lock is not None:
+                            lock.release()
+            except Exception as error:
+                errores.append(error)
+            finally:
+                connections.close_all()
+
+        hilos = [threading.Thread(target=trabajo, args=par) for par in pares]
+        inicio = time.perf_counter()
+        for hilo in hilos:
+            hilo.start()
+        for hilo in hilos:
+            hilo.join()
+        self.assertEqual(errores, [])
+        return time.perf_counter() - inicio
+
+    def verificar_saldos(self):
+        for cuenta in Account.objects.all():
+            self.assertTrue(cuenta.check_balance()['saldoOk'], cuenta.codename)
+            self.assertEqual(cuenta.check_running_balances(), [], cuenta.codename)
+
+    def test_cuentas_compartidas_sin_deadlocks_ni_saldos_perdidos(self):
+        # Pares cruzados (a->b y b->a) sobre pocas cuentas: sin bloqueo en
+        # orden habría deadlocks, y sin bloqueo se perderían actualizaciones
+        random.seed(1)
+        pares = [tuple(random.sample(self.cuentas[:3], 2)) for _ in range(self.workers)]
+        self.cargar(pares)
+        self.assertEqual(Movement.objects.count(), self.workers * self.movements)
+        self.verificar_saldos()
+
+    def test_mas_rapido_que_en_serie(self):
+        pares = [(self.cuentas[2 * i], self.cuentas[2 * i + 1])
+                 for i in range(self.workers)]
+        en_serie = self.cargar(pares, lock=threading.Lock())
+        concurrente = self.cargar(pares)
+        self.assertLess(concurrente, en_serie)
+        self.verificar_saldos()
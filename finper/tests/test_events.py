@@ -0,0 +1,155 @@
+import asyncio
+import importlib.util
+import threading
+import unittest
+
+from django.db import transaction
+from django.test import (AsyncRequestFactory, RequestFactory, SimpleTestCase, TestCase,
+                         override_settings)
+
+from finper import async_views
+from finper.events import LocalBroadcaster, get_broadcaster, publish_movements
+from finper.ledger import LedgerBatch
+from finper.tests.test_models import create_account, create_movement
+
+
+class Recorder:
+    """ Broadcaster de prueba: guarda los eventos publicados."""
+    events = []
+
+    def publish(self, event):
+        self.events.append(event)
+
+
+@override_settings(FINPER_EVENTS={'BROADCASTER': 'finper.tests.test_events.Recorder'})
+class PublishTest(TestCase):
+    """ Pruebas para la publicación de eventos de movimientos"""
+
+    def setUp(self):
+        get_broadcaster.cache_clear()
+        self.addCleanup(get_broadcaster.cache_clear)
+        Recorder.events = []
+        self.cuenta = create_account('ca', 'Cuenta', 100)
+        self.otra = create_account('co', 'Otra', 50)
+
+    def test_alta_al_confirmar(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            mov = create_movement(cuenta_in=self.cuenta, monto=10)
+            self.assertEqual(Recorder.events, [])
+        [event] = Recorder.events
+        self.assertEqual(event['action'], 'created')
+        self.assertEqual(event['id'], mov.pk)
+        self.assertEqual(event['movement']['amount'], '10.00')
+        self.assertEqual(event['balances'], {str(self.cuenta.pk): '110.00'})
+
+    def test_cambio_de_cuenta_informa_las_dos(self):
+        mov = create_movement(cuenta_in=self.cuenta, monto=10)
+        with self.captureOnCommitCallbacks(execute=True):
+            mov.account_in = self.otra
+            mov.save()
+        self.assertEqual(Recorder.events[-1]['balances'],
+                         {str(self.cuenta.pk): '100.00', str(self.otra.pk): '60.00'})
+
+    def test_baja(self):
+        mov = create_movement(cuenta_in=self.cuenta, monto=10)
+        pk = mov.pk
+        with self.captureOnCommitCallbacks(execute=True):
+            mov.delete()
+        self.assertEqual(Recorder.events[-1], {
+            'action': 'deleted', 'id': pk, 'movement': None,
+            'balances': {str(self.cuenta.pk): '100.00'}})
+
+    def test_sin_eventos_si_se_deshace(self):
+        with self.captureOnCommitCallbacks(execute=True) as callbacks:
+            with self.assertRaises(ValueError):
+                with transaction.atomic():
+                    create_movement(cuenta_in=self.cuenta, monto=10)
+                    raise ValueError
+        self.assertEqual(callbacks, [])
+        self.assertEqual(Recorder.events, [])
+
+    def test_lote_publica_todo_junto(self):
+        with self.captureOnCommitCallbacks() as callbacks:
+            with LedgerBatch():
+                for monto in (1, 2, 3):
+                    create_movement(cuenta_in=self.cuenta, monto=monto)
+        self.assertEqual(len(callbacks), 1)
+        with self.assertNumQueries(2):
+            callbacks[0]()
+        self.assertEqual([event['action'] for event in Recorder.events], ['created'] * 3)
+        self.assertEqual(Recorder.events[-1]['balances'], {str(self.cuenta.pk): '106.00'})
+
+    def test_borrado_antes_de_publicar(self):
+        mov = create_movement(cuenta_in=self.cuenta, monto=10)
+        change = ('updated', mov.pk, (self.cuenta.pk,))
+        mov.delete()
+        publish_movements([change])
+        self.assertEqual(Recorder.events, [])
+
+
+class LocalBroadcasterTest(SimpleTestCase):
+    """ Pruebas para el broadcaster local"""
+
+    async def test_publicar_desde_otro_hilo(self):
+        broadcaster = LocalBroadcaster()
+        subscription = broadcaster.subscribe()
+        hilo = threading.Thread(target=broadcaster.publish, args=({'action': 'created'},))
+        hilo.start()
+        self.assertEqual(await subscription.get(timeout=1), {'action': 'created'})
+        self.assertIsNone(await subscription.get(timeout=0.01))
+        subscription.close()
+        self.assertEqual(broadcaster.subscriptions, set())
+
+    async def test_conexion_lenta_recibe_resync(self):
+        broadcaster = LocalBroadcaster(queue_size=2)
+        subscription = broadcaster.subscribe()
+        for i in range(5):
+            broadcaster.publish({'action': 'created', 'id': i})
+        await asyncio.sleep(0)
+        eventos = [await subscription.get(timeout=0.01) for i in range(3)]
+        self.assertEqual(eventos, [{'action': 'resync'}, None, None])
+
+    async def test_vista_sse(self):
+        response = await async_views.movement_events(AsyncRequestFactory().get('/'))
+        self.assertEqual(response['Content-Type'], 'text/event-stream')
+        self.assertEqual(await anext(response.streaming_content), b'retry: 5000\n\n')
+
+    async def test_vista_sse_bajo_wsgi(self):
+        response = await async_views.movement_events(RequestFactory().get('/'))
+        self.assertEqual(response.status_code, 204)
+        self.assertFalse(response.streaming)
+        with override_settings(FINPER_EVENTS={'STREAM': True}):
+            response = await async_views.movement_events(RequestFactory().get('/'))
+        self.assertEqual(response['Content-Type'], 'text/event-stream')
+        await response.streaming_content.aclose()
+
+    async def test_flujo_de_eventos(self):
+        abiertas = len(get_broadcaster().subscriptions)
+        stream = async_views._event_stream(keepalive=0.01)
+        self.assertEqual(await anext(stream), 'retry: 5000\n\n')
+        self.assertEqual(len(get_broadcaster().subscriptions), abiertas + 1)
+        self.assertEqual(await anext(stream), ': keepalive\n\n')
+        get_broadcaster().publish({'action': 'deleted', 'id': 3})
+        self.assertEqual(await anext(stream),
+                         'event: movement\ndata: {"action": "deleted", "id": 3}\n\n')
+        # Al cerrarse la conexión se cancela la suscripción
+        await stream.aclose()
+        self.assertEqual(len(get_broadcaster().subscriptions), abiertas)
+
+
+@unittest.skipUnless(importlib.util.find_spec('nandotools'),
+                     'Las vistas de la planilla requieren nandotools')
+class MovSheetEventsTest(TestCase):
+    """ Pruebas para la conexión de la planilla a los eventos en vivo"""
+
+    def setUp(self):
+        create_movement(cuenta_in=create_account('ca', 'Cuenta', 100), monto=1)
+
+    def test_bajo_wsgi_no_se_conecta(self):
+        response = self.client.get('/mov_sheet/')
+        self.assertNotContains(response, 'data-events=')
+
+    @override_settings(FINPER_EVENTS={'STREAM': True})
+    def test_con_stream_se_conecta(self):
+        response = self.client.get('/mov_sheet/')
+        self.assertContains(response, 'data-events="/async/events/"')
@@ -0,0 +1,229 @@
+import datetime
+
+from django.db import connection
+from django.test import TestCase
+from django.test.utils import CaptureQueriesContext
+
+from finper.forms import (AccountMergeForm, MovementBulkActionForm, MovementBulkFormSet,
+                          MovementFilterForm, MovementForm, MovementModelForm,
+                          movement_choices)
+from finper.models import Account, Category, Movement
+from finper.tests.test_models import create_account, create_category, create_movement
+
+
+class MovementFilterFormTest(TestCase):
+    """ Pruebas para el formulario de filtro de movimientos"""
+
+    def setUp(self):
+        self.acc1 = create_account(cod='a1', nombre='Account1', saldo_inicial=1000)
+        self.acc2 = create_account(cod='a2', nombre='Account2', saldo_inicial=500)
+        self.mov1 = create_movement(cuenta_in=self.acc1, monto=100,
+                                    fecha=datetime.date(2020, 3, 1))
+        self.mov2 = create_movement(cuenta_out=self.acc1, cuenta_in=self.acc2,
+                                    monto=50, fecha=datetime.date(2020, 3, 2))
+        self.mov3 = create_movement(cuenta_out=self.acc2, monto=20,
+                                    fecha=datetime.date(2020, 3, 3))
+
+    def filtrar(self, **params):
+        form = MovementFilterForm(params)
+        return list(form.filter(Movement.objects.order_by('date', 'pk')))
+
+    def test_sin_filtros_devuelve_todos_los_movimientos(self):
+        self.assertEqual(self.filtrar(), [self.mov1, self.mov2, self.mov3])
+
+    def test_filtra_por_rango_de_fechas(self):
+        self.assertEqual(self.filtrar(date_from='2020-03-02', date_to='2020-03-02'),
+                         [self.mov2])
+
+    def test_filtra_por_cuenta_de_entrada_salida_o_cualquiera(self):
+        self.assertEqual(self.filtrar(account=self.acc1.pk, direction='in'),
+                         [self.mov1])
+        self.assertEqual(self.filtrar(account=self.acc1.pk, direction='out'),
+                         [self.mov2])
+        self.assertEqual(self.filtrar(account=self.acc2.pk),
+                         [self.mov2, self.mov3])
+
+    def test_filtra_por_rango_de_montos(self):
+        self.assertEqual(self.filtrar(amount_min='30', amount_max='60'),
+                         [self.mov2])
+
+    def test_saldos_de_la_ventana_de_fechas(self):
+        """ Chequear:   Los saldos al comienzo y al final de la ventana
+                        filtrada surgen de los movimientos anteriores"""
+        form = MovementFilterForm({'date_from': '2020-03-02',
+                                   'date_to': '2020-03-02'})
+        self.assertTrue(form.is_filtered())
+        self.assertEqual((form.opening_balance(self.acc1),
+                          form.closing_balance(self.acc1)),
+                         (1100, 1050))
+        self.assertEqual((form.opening_balance(self.acc2),
+                          form.closing_balance(self.acc2)),
+                         (500, 550))
+
+
+class MovementChoicesTest(TestCase):
+    """ Pruebas para las opciones cacheadas de cuentas y categorías"""
+
+    def setUp(self):
+        self.acc1 = create_account(cod='a1', nombre='Account1', saldo_inicial=1000)
+        self.categoria = create_category()
+
+    def test_sin_consultas_con_el_cache_caliente(self):
+        movement_choices()
+        with self.assertNumQueries(0):
+            form = MovementModelForm({'date': '2020-03-01', 'title': 'Mov',
+                                      'amount': '10', 'currency': '$',
+                                      'account_in': self.acc1.pk,
+                                      'category': self.categoria.pk})
+            self.assertTrue(form.is_valid())
+            str(form)
+            str(MovementForm())
+        self.assertEqual(form.cleaned_data['account_in'], self.acc1)
+
+    def test_cuenta_cacheada_vieja_no_pisa_la_base(self):
+        """ Chequear:   Guardar un movimiento con una cuenta del caché no
+                        pisa los datos de la cuenta cambiados después (en
+                        otro proceso, sin invalidar este caché)"""
+        movement_choices()
+        Account.objects.filter(pk=self.acc1.pk).update(name='Renombrada',
+                                                       balance_start=2000)
+        form = MovementModelForm({'date': '2020-03-01', 'title': 'Mov',
+                                  'amount': '10', 'currency': '$',
+                                  'account_in': self.acc1.pk,
+                                  'category': self.categoria.pk})
+        self.assertTrue(form.is_valid())
+        form.save()
+        cuenta = Account.objects.get(pk=self.acc1.pk)
+        self.assertEqual((cuenta.name, cuenta.balance_start, cuenta.balance),
+                         ('Renombrada', 2000, 1010))
+
+    def test_cuentas_compartidas_entre_campos(self):
+        form = MovementForm()
+        self.assertIs(form.fields['account_in'].objects,
+                      form.fields['account_out'].objects)
+
+    def test_se_invalida_al_cambiar_cuentas_o_categorias(self):
+        movement_choices()
+        create_account(cod='a2', nombre='Account2', saldo_inicial=0)
+        Category.objects.create(name='otra', description='')
+        with self.assertNumQueries(2):
+            choices = movement_choices()
+        self.assertEqual(len(choices['accounts']), 2)
+        self.assertEqual(len(choices['categories']), 2)
+
+    def test_opcion_inexistente(self):
+        form = MovementModelForm({'date': '2020-03-01', 'title': 'Mov',
+                                  'amount': '10', 'currency': '$',
+                                  'account_in': 999, 'category': self.categoria.pk})
+        self.assertFalse(form.is_valid())
+        self.assertEqual(form.errors.as_data()['account_in'][0].code, 'invalid_choice')
+
+
+class MovementBulkFormSetTest(TestCase):
+    """ Pruebas para el formset de carga masiva de movimientos"""
+
+    def setUp(self):
+        self.acc1 = create_account(cod='a1', nombre='Account1', saldo_inicial=1000)
+        self.acc2 = create_account(cod='a2', nombre='Account2', saldo_inicial=500)
+        self.categoria = create_category()
+
+    def datos(self, filas, vacias=0):
+        """ Datos como los envía el navegador: las filas vacías llevan los
+            valores iniciales del formulario."""
+        vacia = {'date': '2020-03-01', 'initial-date': '2020-03-01',
+                 'title': 'Movimiento', 'amount': '0.0', 'currency': '$'}
+        filas = filas + [vacia] * vacias
+        data = {'form-TOTAL_FORMS': str(len(filas)), 'form-INITIAL_FORMS': '0'}
+        for i, fila in enumerate(filas):
+            data.update({name.replace('initial-', f'initial-form-{i}-')
+                         if name.startswith('initial-') else f'form-{i}-{name}': value
+                         for name, value in fila.items()})
+        return data
+
+    def fila(self, **cambios):
+        return {'date': '2020-03-01', 'title': 'Mov', 'amount': '10',
+                'currency': '$', 'account_in': self.acc1.pk,
+                'category': self.categoria.pk, **cambios}
+
+    def test_opciones_compartidas(self):
+        """ Chequear:   Las cuentas y las categorías se leen una sola vez,
+                        para dibujar y para validar todas las filas"""
+        with self.assertNumQueries(2):
+            formset = MovementBulkFormSet(self.datos([self.fila()] * 20))
+        with self.assertNumQueries(0):
+            self.assertTrue(formset.is_valid())
+            html = str(formset)
+        self.assertEqual(html.count('>Account1: 1000'), 40)
+
+    def test_errores_por_fila(self):
+        formset = MovementBulkFormSet(self.datos([
+            self.fila(), self.fila(amount='x'), self.fila(account_in=''),
+            self.fila(category='999')], vacias=2))
+        self.assertEqual(formset.save_valid(), 1)
+        self.assertIn('amount', formset.forms[1].errors)
+        self.assertIn('cuenta', str(formset.forms[2].non_field_errors()))
+        self.assertIn('category', formset.forms[3].errors)
+        # Las filas vacías no cuentan como pendientes
+        self.assertEqual(formset.pending_forms(), formset.forms[1:4])
+        self.assertEqual(Account.objects.get(pk=self.acc1.pk).balance, 1010)
+
+    def test_guardado_en_lote(self):
+        filas = [self.fila(amount=str(monto)) for monto in (1, 2, 3)]
+        filas.append(self.fila(account_in=self.acc2.pk, account_out=self.acc1.pk))
+        formset = MovementBulkFormSet(self.datos(filas))
+        with CaptureQueriesContext(connection) as queries:
+            self.assertEqual(formset.save_valid(), 4)
+        # Una actualización de saldo por cuenta tocada
+        updates = [query['sql'] for query in queries.captured_queries
+                   if query['sql'].startswith('UPDATE "finper_account"')]
+        self.assertEqual(len(updates), 2)
+        self.assertEqual(Account.objects.get(pk=self.acc1.pk).balance, 996)
+        self.assertEqual(Account.objects.get(pk=self.acc2.pk).balance, 510)
+        self.assertEqual(Movement.objects.count(), 4)
+        self.assertEqual(self.acc1.check_running_balances(), [])
+
+
+class MovementBulkActionFormTest(TestCase):
+    """ Pruebas para las acciones sobre movimientos seleccionados"""
+
+    def setUp(self):
+        self.acc1 = create_account(cod='a1', nombre='Account1', saldo_inicial=1000)
+        self.acc2 = create_account(cod='a2', nombre='Account2', saldo_inicial=500)
+        self.mov = create_movement(cuenta_in=self.acc1, monto=100)
+
+    def test_requiere_el_destino(self):
+        form = MovementBulkActionForm({'action': 'recategorize', 'account': self.acc2.pk})
+        self.assertFalse(form.is_valid())
+        self.assertIn('category', form.errors)
+        form = MovementBulkActionForm({'action': 'account_in'})
+        self.assertFalse(form.is_valid())
+        self.assertIn('account', form.errors)
+
+    def test_cambia_la_cuenta(self):
+        form = MovementBulkActionForm({'action': 'account_in', 'account': self.acc2.pk})
+        self.assertTrue(form.is_valid())
+        self.assertEqual(form.apply(Movement.objects.all()), 1)
+        self.assertEqual(Movement.objects.get(pk=self.mov.pk).account_in, self.acc2)
+        self.assertEqual(Account.objects.get(pk=self.acc1.pk).balance, 1000)
+        self.assertEqual(Account.objects.get(pk=self.acc2.pk).balance, 600)
+
+
+class AccountMergeFormTest(TestCase):
+    """ Pruebas para la fusión de cuentas desde la vista"""
+
+    def setUp(self):
+        self.origen = create_account(cod='a1', nombre='Origen', saldo_inicial=100)
+        self.destino = create_account(cod='a2', nombre='Destino', saldo_inicial=50)
+        self.traspaso = create_movement(cuenta_in=self.destino, cuenta_out=self.origen,
+                                        monto=30)
+
+    def test_traspasos_requieren_confirmacion(self):
+        form = AccountMergeForm({'target': self.destino.pk}, source=self.origen)
+        self.assertFalse(form.is_valid())
+        self.assertIn('delete_transfers', form.errors)
+        self.assertEqual(form.transfers, [self.traspaso])
+        form = AccountMergeForm({'target': self.destino.pk, 'delete_transfers': 'on'},
+                                source=self.origen)
+        self.assertTrue(form.is_valid())
+        self.assertEqual(form.merge(), (0, 1))
+        self.assertFalse(Movement.objects.filter(pk=self.traspaso.pk).exists())
@@ -0,0 +1,99 @@
+import datetime
+import io
+import json
+
+from django.db import connection
+from django.test import TestCase
+from django.test.utils import CaptureQueriesContext
+
+from finper.ingest import INGEST_DEFAULTS, ingest, read_lines
+from finper.memory import memory_budget, track_memory
+from finper.models import Account, Movement
+from finper.tests.test_models import create_account, create_category
+
+
+class Feed:
+    """ Flujo de movimientos generado a medida que se lee, como el cuerpo de
+        un request: no guarda en memoria más que la línea en curso. Las
+        fechas avanzan, así que cada lote recalcula sólo sus saldos."""
+
+    def __init__(self, cantidad, cuenta, categoria):
+        inicio = datetime.date(2020, 1, 1)
+        self.lineas = (
+            json.dumps({'date': str(inicio + datetime.timedelta(days=i)),
+                        'title': f'Mov {i}', 'amount': '1',
+                        'currency': '$', 'account_in': cuenta.pk,
+                        'category': categoria.pk}).encode() + b'\n'
+            for i in range(cantidad))
+        self.resto = b''
+
+    def readline(self, size=-1):
+        if not self.resto:
+            self.resto = next(self.lineas, b'')
+        linea, self.resto = self.resto[:size], self.resto[size:]
+        return linea
+
+
+class IngestTest(TestCase):
+    """ Pruebas para la ingesta de movimientos en NDJSON"""
+
+    def setUp(self):
+        self.cuenta = create_account('ca', 'Cuenta', 100)
+        self.categoria = create_category()
+
+    def linea(self, **cambios):
+        return json.dumps({'date': '2020-01-01', 'title': 'Mov', 'amount': '10',
+                           'currency': '$', 'account_in': self.cuenta.pk,
+                           'category': self.categoria.pk, **cambios})
+
+    def ingerir(self, lineas, **config):
+        stream = io.BytesIO('\n'.join(lineas).encode())
+        return list(ingest(stream, {**INGEST_DEFAULTS, **config}))
+
+    def test_resultados_por_linea(self):
+        resultados = self.ingerir([
+            self.linea(), '', 'no es json', '[1]', self.linea(amount='x'),
+            self.linea(account_in=None), self.linea(amount='5')], BATCH_SIZE=3)
+        self.assertEqual([(r['line'], r['status']) for r in resultados[:-1]],
+                         [(1, 201), (3, 400), (4, 400), (5, 400), (6, 400), (7, 201)])
+        self.assertIn('amount', resultados[3]['error'])
+        self.assertIn('cuenta', resultados[4]['error'])
+        self.assertEqual(resultados[-1], {'summary': {'lines': 6, 'saved': 2, 'errors': 4}})
+        self.assertEqual(Account.objects.get(pk=self.cuenta.pk).balance, 115)
+        self.assertEqual(self.cuenta.check_running_balances(), [])
+
+    def test_lotes_por_tamanio(self):
+        with CaptureQueriesContext(connection) as queries:
+            resultados = self.ingerir([self.linea() for i in range(10)], BATCH_SIZE=5)
+        # Una actualización de la cuenta por lote
+        updates = [query['sql'] for query in queries.captured_queries
+                   if query['sql'].startswith('UPDATE "finper_account"')]
+        self.assertEqual(len(updates), 2)
+        self.assertEqual(resultados[-1]['summary']['saved'], 10)
+        self.assertEqual(Account.objects.get(pk=self.cuenta.pk).balance, 200)
+
+    def test_lotes_por_tiempo(self):
+        stream = io.BytesIO('\n'.join([self.linea()] * 3).encode())
+        resultados = ingest(stream, {**INGEST_DEFAULTS, 'BATCH_SECONDS': 0})
+        # Con BATCH_SECONDS en 0 cada línea se guarda apenas se lee
+        self.assertEqual(next(resultados)['status'], 201)
+        self.assertEqual(Movement.objects.count(), 1)
+
+    def test_lineas_largas(self):
+        stream = io.BytesIO(b'x' * 100 + b'\n' + self.linea().encode())
+        self.assertEqual([(numero, linea is None)
+                          for numero, linea in read_lines(stream, 40)],
+                         [(1, True), (2, True)])
+        stream = io.BytesIO(b'x' * 100 + b'\n{}\n')
+        self.assertEqual(list(read_lines(stream, 40)), [(1, None), (2, b'{}\n')])
+
+    def test_memoria_constante(self):
+        config = {**INGEST_DEFAULTS, 'BATCH_SIZE': 20}
+        with track_memory('ingesta', snapshots=False) as report:
+            for resultado in ingest(Feed(200, self.cuenta, self.categoria), config):
+                pass
+        with memory_budget(report.peak * 1.5, 'ingesta'):
+            otra = create_account('co', 'Otra', 0)
+            for resultado in ingest(Feed(600, otra, self.categoria), config):
+                pass
+        self.assertEqual(resultado['summary']['saved'], 600)
@@ -0,0 +1,251 @@
+import datetime
+from io import StringIO
+
+from django.core.management import CommandError, call_command
+from django.db import connection
+from django.test import TestCase
+from django.test.utils import CaptureQueriesContext
+
+from finper.cache import ledger_version
+from finper.errors import AccountError
+from finper.ledger import (LedgerBatch, current_batch, internal_transfers, merge_accounts,
+                           reassign_account, recategorize)
+from finper.models import Account, Change, Movement
+from finper.tests.test_models import create_account, create_category, create_movement
+
+
+class LedgerBatchTest(TestCase):
+    """ Pruebas para las operaciones en lote sobre el libro"""
+
+    def setUp(self):
+        self.cuenta_a = create_account('ca', 'Cuenta A', 100)
+        self.cuenta_b = create_account('cb', 'Cuenta B', 50)
+        self.previo = create_movement(cuenta_in=self.cuenta_a, monto=5,
+                                      fecha=datetime.date(2020, 1, 10))
+
+    def saldo(self, cuenta):
+        return Account.objects.get(pk=cuenta.pk).balance
+
+    def verificar(self):
+        for cuenta in Account.objects.all():
+            self.assertTrue(cuenta.check_balance()['saldoOk'], cuenta.codename)
+            self.assertEqual(cuenta.check_running_balances(), [], cuenta.codename)
+
+    def test_altas_modificaciones_y_bajas(self):
+        with LedgerBatch():
+            nuevo = create_movement(cuenta_in=self.cuenta_a, cuenta_out=self.cuenta_b,
+                                    monto=20, fecha=datetime.date(2020, 1, 5))
+            create_movement(cuenta_out=self.cuenta_a, monto=3,
+                            fecha=datetime.date(2020, 1, 20))
+            nuevo.amount = 30
+            nuevo.save()
+            self.previo.delete()
+            # Dentro del lote los saldos todavía no cambiaron
+            self.assertEqual(self.saldo(self.cuenta_a), 105)
+        self.assertEqual(self.saldo(self.cuenta_a), 127)
+        self.assertEqual(self.saldo(self.cuenta_b), 20)
+        self.verificar()
+
+    def test_una_actualizacion_por_cuenta(self):
+        with CaptureQueriesContext(connection) as queries:
+            with LedgerBatch():
+                for dia in range(1, 11):
+                    create_movement(cuenta_in=self.cuenta_a, cuenta_out=self.cuenta_b,
+                                    monto=1, fecha=datetime.date(2020, 2, dia))
+        updates = [query['sql'] for query in queries.captured_queries
+                   if query['sql'].startswith('UPDATE "finper_account"')]
+        self.assertEqual(len(updates), 2)
+        self.assertEqual(self.saldo(self.cuenta_a), 115)
+        self.assertEqual(self.saldo(self.cuenta_b), 40)
+        self.verificar()
+
+    def test_bajas_viejas_corren_los_saldos_sin_recalcular(self):
+        viejos = [create_movement(cuenta_in=self.cuenta_a, monto=2,
+                                  fecha=datetime.date(2020, 1, dia)) for dia in (5, 20)]
+        editado = create_movement(cuenta_out=self.cuenta_a, monto=1,
+                                  fecha=datetime.date(2020, 1, 25))
+        for dia in range(1, 29):
+            create_movement(cuenta_in=self.cuenta_a, cuenta_out=self.cuenta_b, monto=1,
+                            fecha=datetime.date(2020, 2, dia))
+        with CaptureQueriesContext(connection) as queries:
+            with LedgerBatch():
+                for mov in viejos:
+                    mov.delete()
+                editado.amount = 4
+                editado.save()
+        sqls = [query['sql'] for query in queries.captured_queries]
+        updates = [sql for sql in sqls if sql.startswith('UPDATE "finper_movement"')
+                   and 'balance_after_in' in sql]
+        # Un UPDATE por rangos, sin recorrer los movimientos de la cuenta
+        self.assertEqual(len(updates), 1)
+        self.assertFalse(any(' IN (' in sql for sql in updates))
+        self.assertFalse(any('"finper_movement"."date" ASC' in sql for sql in sqls))
+        self.assertEqual(self.saldo(self.cuenta_a), 129)
+        self.verificar()
+
+    def test_cambio_de_fecha_recalcula(self):
+        otro = create_movement(cuenta_in=self.cuenta_a, cuenta_out=self.cuenta_b, monto=7,
+                               fecha=datetime.date(2020, 1, 15))
+        with LedgerBatch():
+            self.previo.delete()
+            otro.date = datetime.date(2020, 1, 1)
+            otro.save()
+        self.assertEqual(self.saldo(self.cuenta_a), 107)
+        self.verificar()
+
+    def test_error_deshace_todo(self):
+        with self.assertRaises(AccountError):
+            with LedgerBatch():
+                create_movement(cuenta_in=self.cuenta_a, monto=10)
+                create_movement(monto=10)
+        self.assertIsNone(current_batch())
+        self.assertEqual(Movement.objects.count(), 1)
+        self.assertEqual(self.saldo(self.cuenta_a), 105)
+
+    def test_lote_anidado_se_suma_al_exterior(self):
+        with LedgerBatch() as exterior:
+            with LedgerBatch() as interior:
+                self.assertIs(interior, exterior)
+                create_movement(cuenta_in=self.cuenta_a, monto=1)
+            self.assertEqual(self.saldo(self.cuenta_a), 105)
+        self.assertEqual(self.saldo(self.cuenta_a), 106)
+
+    def test_incrementa_la_version_del_libro(self):
+        version = ledger_version()
+        with LedgerBatch():
+            pass
+        self.assertEqual(ledger_version(), version)
+        with LedgerBatch():
+            create_movement(cuenta_in=self.cuenta_a, monto=1)
+        self.assertGreater(ledger_version(), version)
+
+
+class BulkUpdateTest(TestCase):
+    """ Pruebas para los cambios masivos de categoría y de cuenta"""
+
+    def setUp(self):
+        self.cuenta_a = create_account('ca', 'Cuenta A', 100)
+        self.cuenta_b = create_account('cb', 'Cuenta B', 50)
+        self.cuenta_c = create_account('cc', 'Cuenta C', 0)
+        self.movs = [
+            create_movement(cuenta_in=self.cuenta_a, monto=10, fecha=datetime.date(2020, 1, 1)),
+            create_movement(cuenta_in=self.cuenta_b, cuenta_out=self.cuenta_a, monto=4,
+                            fecha=datetime.date(2020, 1, 2)),
+            create_movement(cuenta_out=self.cuenta_b, monto=3, fecha=datetime.date(2020, 1, 3)),
+            create_movement(cuenta_in=self.cuenta_b, monto=7, fecha=datetime.date(2020, 1, 4)),
+        ]
+
+    def saldos(self):
+        return [Account.objects.get(pk=cuenta.pk).balance
+                for cuenta in (self.cuenta_a, self.cuenta_b, self.cuenta_c)]
+
+    def verificar(self):
+        for cuenta in Account.objects.all():
+            self.assertTrue(cuenta.check_balance()['saldoOk'], cuenta.codename)
+            self.assertEqual(cuenta.check_running_balances(), [], cuenta.codename)
+
+    def test_categoria_sin_tocar_saldos(self):
+        categoria = create_category()
+        saldos = self.saldos()
+        seq = Change.objects.order_by('-pk').values_list('pk', flat=True).first()
+        with CaptureQueriesContext(connection) as queries:
+            cambiados = recategorize(
+                Movement.objects.filter(pk__in=[mov.pk for mov in self.movs[:3]]), categoria)
+        self.assertEqual(cambiados, 3)
+        updates = [query['sql'] for query in queries.captured_queries
+                   if query['sql'].startswith('UPDATE')]
+        self.assertEqual(len(updates), 1)
+        self.assertEqual(Movement.objects.filter(category=categoria).count(), 3)
+        self.assertEqual(self.saldos(), saldos)
+        self.assertEqual(Change.objects.filter(pk__gt=seq, model=Change.MOVEMENT).count(), 3)
+
+    def test_cambio_de_cuenta_de_entrada(self):
+        # Los movimientos 1, 2 y 4 entran en A, B y B; pasan a C
+        with CaptureQueriesContext(connection) as queries:
+            cambiados = reassign_account(Movement.objects.filter(account_in__isnull=False),
+                                         'in', self.cuenta_c)
+        self.assertEqual(cambiados, 3)
+        self.assertEqual(self.saldos(), [96, 47, 21])
+        # Una consulta agrupada para los saldos y un UPDATE por cuenta
+        updates = [query['sql'] for query in queries.captured_queries
+                   if query['sql'].startswith('UPDATE "finper_account"')]
+        self.assertEqual(len(updates), 3)
+        self.assertEqual(Movement.objects.filter(account_in=self.cuenta_c).count(), 3)
+        self.verificar()
+
+    def test_cambio_de_cuenta_de_salida(self):
+        # El ingreso en A pasa a ser un traspaso desde C, y el gasto de B
+        # sale de C
+        movimientos = Movement.objects.filter(pk__in=[self.movs[0].pk, self.movs[2].pk])
+        cambiados = reassign_account(movimientos, 'out', self.cuenta_c)
+        self.assertEqual(cambiados, 2)
+        self.assertEqual(self.saldos(), [106, 61, -13])
+        self.verificar()
+
+    def test_eventos_al_confirmar(self):
+        with self.captureOnCommitCallbacks() as callbacks:
+            reassign_account(Movement.objects.filter(pk=self.movs[0].pk), 'in', self.cuenta_c)
+            recategorize(Movement.objects.filter(pk=self.movs[0].pk), create_category())
+        self.assertEqual(len(callbacks), 2)
+
+
+class MergeAccountsTest(TestCase):
+    """ Pruebas para la fusión de cuentas"""
+
+    def setUp(self):
+        self.origen = create_account('co', 'Origen', 100)
+        self.destino = create_account('cd', 'Destino', 50)
+        self.otra = create_account('cx', 'Otra', 10)
+        create_movement(cuenta_in=self.origen, monto=20, fecha=datetime.date(2020, 1, 1))
+        create_movement(cuenta_in=self.destino, monto=5, fecha=datetime.date(2020, 1, 2))
+        # Traspasos entre las dos cuentas: se borran
+        create_movement(cuenta_in=self.destino, cuenta_out=self.origen, monto=30,
+                        fecha=datetime.date(2020, 1, 3))
+        create_movement(cuenta_in=self.origen, cuenta_out=self.destino, monto=8,
+                        fecha=datetime.date(2020, 1, 4))
+        create_movement(cuenta_in=self.otra, cuenta_out=self.origen, monto=7,
+                        fecha=datetime.date(2020, 1, 5))
+
+    def test_fusion(self):
+        total = sum(Account.objects.values_list('balance', flat=True))
+        traspasos = set(internal_transfers(self.origen, self.destino)
+                        .values_list('pk', flat=True))
+        seq = Change.objects.order_by('-pk').values_list('pk', flat=True).first()
+        self.assertEqual(merge_accounts(self.origen, self.destino, delete_transfers=True),
+                         (2, 2))
+        # Los traspasos borrados quedan como bajas en el registro de cambios
+        self.assertEqual(set(Change.objects.filter(pk__gt=seq, model=Change.MOVEMENT,
+                                                   deleted=True)
+                             .values_list('object_id', flat=True)), traspasos)
+        self.assertFalse(Account.objects.filter(pk=self.origen.pk).exists())
+        destino = Account.objects.get(pk=self.destino.pk)
+        self.assertEqual(destino.balance_start, 150)
+        self.assertEqual(destino.balance, 168)
+        self.assertEqual(sum(Account.objects.values_list('balance', flat=True)), total)
+        self.assertEqual(Movement.objects.filter(account_in=destino,
+                                                 account_out=destino).count(), 0)
+        self.assertEqual(Movement.objects.count(), 3)
+        for cuenta in Account.objects.all():
+            self.assertTrue(cuenta.check_balance()['saldoOk'], cuenta.codename)
+            self.assertEqual(cuenta.check_running_balances(), [], cuenta.codename)
+
+    def test_con_traspasos_sin_confirmar_no_fusiona(self):
+        movimientos = Movement.objects.count()
+        with self.assertRaises(AccountError):
+            merge_accounts(self.origen, self.destino)
+        self.assertTrue(Account.objects.filter(pk=self.origen.pk).exists())
+        self.assertEqual(Movement.objects.count(), movimientos)
+        self.assertEqual(Account.objects.get(pk=self.destino.pk).balance, 77)
+
+    def test_cuenta_consigo_misma(self):
+        with self.assertRaises(AccountError):
+            merge_accounts(self.origen, self.origen)
+
+    def test_comando(self):
+        out = StringIO()
+        with self.assertRaises(CommandError):
+            call_command('merge_accounts', 'co', 'cd', stdout=out)
+        call_command('merge_accounts', 'co', 'cd', '--delete-transfers', stdout=out)
+        self.assertIn('2 movimientos pasados, 2 traspasos', out.getvalue())
+        with self.assertRaises(CommandError):
+            call_command('merge_accounts', 'co', 'cd')
@@ -0,0 +1,123 @@
+import datetime
+import decimal
+import io
+import threading
+import tracemalloc
+
+from django.core.management import call_command
+from django.http import HttpResponse
+from django.test import RequestFactory, TestCase, override_settings
+
+from finper.memory import MemoryMiddleware, memory_budget, track_memory
+from finper.models import Movement
+from finper.tests.test_models import create_account, create_category
+
+
+class TrackMemoryTest(TestCase):
+    """ Pruebas para la medición de memoria"""
+
+    def test_informa_el_pico_y_los_lugares_de_asignacion(self):
+        with track_memory('prueba') as report:
+            datos = [bytearray(1024) for _ in range(1000)]
+        self.assertGreater(report.peak, 1000 * 1024)
+        site, size, count = report.top[0]
+        self.assertIn('test_memory.py', site)
+        self.assertGreater(size, 1000 * 1024)
+        del datos
+
+    def test_memory_budget_falla_si_se_excede(self):
+        with memory_budget(1024 * 1024):
+            bytearray(100 * 1024)
+        with self.assertRaises(AssertionError):
+            with memory_budget(1024 * 1024, 'grande'):
+                bytearray(2 * 1024 * 1024)
+
+    def test_anidado_conserva_el_pico_exterior(self):
+        with track_memory('exterior', snapshots=False) as exterior:
+            datos = bytearray(2 * 1024 * 1024)
+            del datos
+            with track_memory('interior', snapshots=False) as interior:
+                bytearray(1024)
+            self.assertTrue(tracemalloc.is_tracing())
+        self.assertGreater(exterior.peak, 2 * 1024 * 1024)
+        self.assertLess(interior.peak, 1024 * 1024)
+        self.assertFalse(tracemalloc.is_tracing())
+
+    @override_settings(FINPER_MEMORY={'ENABLED': True})
+    def test_middleware_con_requests_concurrentes(self):
+        """ Chequear:   El request que empezó la medición termina antes que
+                        otro en curso, sin detenerle la medición"""
+        primero_adentro, segundo_adentro = threading.Event(), threading.Event()
+        primero_termino = threading.Event()
+        errores = []
+
+        def primero(request):
+            primero_adentro.set()
+            segundo_adentro.wait(5)
+            return HttpResponse('primero')
+
+        def segundo(request):
+            segundo_adentro.set()
+            primero_termino.wait(5)
+            return HttpResponse('segundo')
+
+        def atender(handler, terminado=None):
+            try:
+                MemoryMiddleware(handler)(RequestFactory().get('/prueba/'))
+            except Exception as error:
+                errores.append(error)
+            finally:
+                if terminado is not None:
+                    terminado.set()
+
+        hilos = [threading.Thread(target=atender, args=(primero, primero_termino)),
+                 threading.Thread(target=atender, args=(segundo,))]
+        hilos[0].start()
+        primero_adentro.wait(5)
+        hilos[1].start()
+        for hilo in hilos:
+            hilo.join(5)
+        self.assertEqual(errores, [])
+        self.assertFalse(tracemalloc.is_tracing())
+
+    @override_settings(FINPER_MEMORY={'ENABLED': True})
+    def test_middleware_agrega_header(self):
+        middleware = MemoryMiddleware(lambda request: HttpResponse('x' * 100000))
+        response = middleware(RequestFactory().get('/prueba/'))
+        self.assertGreater(float(response['X-Memory-Peak']), 90)
+
+    def test_middleware_desactivado(self):
+        middleware = MemoryMiddleware(lambda request: HttpResponse('ok'))
+        response = middleware(RequestFactory().get('/prueba/'))
+        self.assertFalse(response.has_header('X-Memory-Peak'))
+
+    def test_comando_con_track_memory(self):
+        create_account('ca', 'Cuenta', 0)
+        stderr = io.StringIO()
+        call_command('rebuild_balances', track_memory=True,
+                     stdout=io.StringIO(), stderr=stderr)
+        self.assertIn('rebuild_balances: pico', stderr.getvalue())
+
+
+class RebuildMemoryTest(TestCase):
+    """ El recálculo de saldos recorre el libro por partes: el pico de memoria
+        no debe crecer con la cantidad de movimientos."""
+
+    def crear_libro(self, cantidad):
+        cuenta = create_account(f'c{cantidad}', 'Cuenta', 0)
+        categoria = create_category()
+        fecha = datetime.date(2020, 1, 1)
+        Movement.objects.bulk_create(
+            Movement(date=fecha + datetime.timedelta(days=i % 1000),
+                     title='Movimiento de prueba', amount=decimal.Decimal(1),
+                     account_in=cuenta, category=categoria)
+            for i in range(cantidad))
+        return cuenta
+
+    def test_pico_constante(self):
+        cuenta = self.crear_libro(2500)
+        with track_memory('rebuild', snapshots=False) as report:
+            self.assertEqual(cuenta.rebuild_running_balances(), 2500)
+        cuenta = self.crear_libro(7500)
+        with memory_budget(report.peak * 1.5, 'rebuild'):
+            self.assertEqual(cuenta.rebuild_running_balances(), 7500)
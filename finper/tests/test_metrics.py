@@ -0,0 +1,118 @@
+import importlib.util
+import json
+import os
+import tempfile
+import unittest
+
+from django.test import TestCase, override_settings
+
+from finper.metrics import Counter, Gauge, Histogram, REGISTRY, Registry
+from finper.models import Account, Movement, reconcile
+from finper.tests.test_models import create_account, create_movement
+
+
+class MetricsRegistryTest(TestCase):
+    """ Pruebas para el registro de métricas"""
+
+    def setUp(self):
+        self.registry = Registry()
+        self.contador = Counter('prueba_total', 'Contador de prueba',
+                                labelnames=['tipo'], registry=self.registry)
+        self.histograma = Histogram('prueba_seconds', 'Histograma de prueba',
+                                    buckets=(0.1, 1), registry=self.registry)
+        self.gauge = Gauge('prueba_gauge', 'Gauge de prueba', registry=self.registry)
+
+    def test_exposicion_en_formato_de_texto(self):
+        self.contador.inc(tipo='a')
+        self.contador.inc(2, tipo='a')
+        self.histograma.observe(0.05)
+        self.histograma.observe(0.5)
+        self.histograma.observe(5)
+        self.gauge.set(3)
+        lineas = self.registry.exposition().splitlines()
+        self.assertIn('# TYPE prueba_total counter', lineas)
+        self.assertIn('prueba_total{tipo="a"} 3', lineas)
+        self.assertIn('prueba_seconds_bucket{le="0.1"} 1', lineas)
+        self.assertIn('prueba_seconds_bucket{le="1"} 2', lineas)
+        self.assertIn('prueba_seconds_bucket{le="+Inf"} 3', lineas)
+        self.assertIn('prueba_seconds_count 3', lineas)
+        self.assertIn('prueba_gauge 3', lineas)
+
+    def test_suma_las_metricas_de_otros_procesos(self):
+        with tempfile.TemporaryDirectory() as directorio, \
+                override_settings(FINPER_METRICS={'DIR': directorio}):
+            self.contador.inc(tipo='a')
+            otro = {'prueba_total': {json.dumps(['a']): 5},
+                    'prueba_seconds': {}, 'prueba_gauge': {}}
+            with open(os.path.join(directorio, 'metrics-999999.json'), 'w') as archivo:
+                json.dump(otro, archivo)
+            self.assertIn('prueba_total{tipo="a"} 6',
+                          self.registry.exposition().splitlines())
+
+    def test_gauge_por_proceso_se_suma(self):
+        conexiones = Gauge('prueba_conexiones', 'Gauge sumado', multiprocess='sum',
+                           registry=self.registry)
+        with tempfile.TemporaryDirectory() as directorio, \
+                override_settings(FINPER_METRICS={'DIR': directorio}):
+            conexiones.set(2)
+            self.gauge.set(3)
+            otro = {'prueba_conexiones': {'[]': [5, 0]}, 'prueba_gauge': {'[]': [7, 0]}}
+            with open(os.path.join(directorio, 'metrics-999999.json'), 'w') as archivo:
+                json.dump(otro, archivo)
+            lineas = self.registry.exposition().splitlines()
+        self.assertIn('prueba_conexiones 7', lineas)
+        # El gauge común vale el último valor fijado
+        self.assertIn('prueba_gauge 3', lineas)
+
+    def test_etiquetas_incorrectas_fallan(self):
+        with self.assertRaises(ValueError):
+            self.contador.inc(otra='a')
+
+
+class LedgerMetricsTest(TestCase):
+    """ Pruebas para la instrumentación del libro de movimientos"""
+
+    def contar(self, tipo):
+        valores = REGISTRY.collect()['finper_movement_save_seconds']
+        clave = json.dumps([tipo])
+        return sum(valores[clave][0]) if clave in valores else 0
+
+    def test_save_se_mide_por_tipo_de_operacion(self):
+        altas, cambios = self.contar('create'), self.contar('account_swap')
+        acc1 = create_account(cod='a1', nombre='Account1', saldo_inicial=100)
+        acc2 = create_account(cod='a2', nombre='Account2', saldo_inicial=100)
+        mov = create_movement(cuenta_in=acc1, monto=10)
+        mov.account_in = acc2
+        mov.save()
+        self.assertEqual((self.contar('create'), self.contar('account_swap')),
+                         (altas + 1, cambios + 1))
+
+    def test_reconcile_informa_cuentas_con_diferencias(self):
+        acc = create_account(cod='a1', nombre='Account1', saldo_inicial=100)
+        create_movement(cuenta_in=acc, monto=10)
+        self.assertEqual(reconcile(), [])
+        Account.objects.filter(pk=acc.pk).update(balance=0)
+        self.assertEqual(reconcile(), [acc])
+        self.assertIn('finper_drifting_accounts 1',
+                      REGISTRY.exposition().splitlines())
+
+
+@unittest.skipUnless(importlib.util.find_spec('nandotools'),
+                     'Las vistas de la planilla requieren nandotools')
+class MultipleDeleteTest(TestCase):
+    """ Pruebas para el borrado de los movimientos seleccionados en la planilla"""
+
+    def observaciones(self):
+        valores = REGISTRY.collect()['finper_multiple_delete_batch_size']
+        return sum(valores['[]'][0]) if '[]' in valores else 0
+
+    def test_borra_los_seleccionados_y_mide_la_cantidad(self):
+        acc = create_account(cod='a1', nombre='Account1', saldo_inicial=100)
+        movs = [create_movement(cuenta_in=acc, monto=monto) for monto in (1, 2, 3)]
+        antes = self.observaciones()
+        response = self.client.post('/mov_sheet/',
+                                    {'mult_delete': [movs[0].pk, movs[2].pk]})
+        self.assertEqual(response.status_code, 302)
+        self.assertEqual(list(Movement.objects.all()), [movs[1]])
+        self.assertEqual(Account.objects.get(pk=acc.pk).balance, 102)
+        self.assertEqual(self.observaciones(), antes + 1)
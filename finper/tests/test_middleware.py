@@ -0,0 +1,153 @@
+import json
+import os
+import tempfile
+from types import SimpleNamespace
+
+from asgiref.sync import iscoroutinefunction
+
+from django.http import HttpResponse
+from django.template import engines
+from django.template.response import TemplateResponse
+from django.test import RequestFactory, TestCase, override_settings
+
+from finper.middleware import CProfileMiddleware, ProfilingMiddleware
+from finper.models import Account
+from finper.profiling import list_profiles, read_summary
+
+
+def vista_con_consultas(request):
+    list(Account.objects.all())
+    list(Account.objects.all())
+    return HttpResponse('ok')
+
+
+def vista_con_plantilla(request):
+    template = engines['django'].from_string('{{ cuentas|length }}')
+    return TemplateResponse(request, template, {'cuentas': Account.objects.all()})
+
+
+@override_settings(DEBUG=True)
+class ProfilingMiddlewareTest(TestCase):
+    """ Pruebas para el middleware de medición de consultas y tiempos"""
+
+    def procesar(self, vista):
+        middleware = ProfilingMiddleware(
+            lambda request: self.responder(middleware, request, vista))
+        return middleware(RequestFactory().get('/prueba/'))
+
+    @staticmethod
+    def responder(middleware, request, vista):
+        """ Reproduce lo que hace el handler de Django con la vista"""
+        middleware.process_view(request, vista, (), {})
+        response = vista(request)
+        if hasattr(response, 'render'):
+            response = middleware.process_template_response(request, response)
+            response.render()
+        return response
+
+    def test_cuenta_consultas_en_header(self):
+        response = self.procesar(vista_con_consultas)
+        self.assertEqual(response['X-Query-Count'], '2')
+
+    def test_server_timing_separa_sql_vista_y_render(self):
+        response = self.procesar(vista_con_plantilla)
+        nombres = [metrica.split(';')[0]
+                   for metrica in response['Server-Timing'].split(', ')]
+        self.assertEqual(nombres, ['sql', 'view', 'render', 'total'])
+        # La consulta se hace al renderizar la plantilla
+        self.assertEqual(response['X-Query-Count'], '1')
+
+    @override_settings(FINPER_PROFILING={'SLOW_REQUEST_MS': 0})
+    def test_request_lento_se_registra_con_su_sql(self):
+        with self.assertLogs('finper.profiling', level='WARNING') as logs:
+            self.procesar(vista_con_consultas)
+        registro = json.loads(logs.records[0].getMessage())
+        self.assertEqual(registro['queries'], 2)
+        self.assertIn('finper_account', registro['sql'][0]['sql'])
+
+    @override_settings(FINPER_PROFILING={'ENABLED': False})
+    def test_deshabilitado_no_agrega_headers(self):
+        response = self.procesar(vista_con_consultas)
+        self.assertFalse(response.has_header('X-Query-Count'))
+
+    @override_settings(DEBUG=False)
+    def test_sin_debug_no_mide(self):
+        with self.assertNoLogs('finper.profiling'):
+            response = self.procesar(vista_con_consultas)
+        self.assertFalse(response.has_header('Server-Timing'))
+        self.assertFalse(response.has_header('X-Query-Count'))
+
+    @override_settings(DEBUG=False, FINPER_PROFILING={'ENABLED': True})
+    def test_sin_debug_mide_sin_headers(self):
+        with self.assertLogs('finper.profiling', level='INFO'):
+            response = self.procesar(vista_con_consultas)
+        self.assertFalse(response.has_header('Server-Timing'))
+        self.assertFalse(response.has_header('X-Query-Count'))
+
+    async def test_cadena_asincronica(self):
+        async def vista(request):
+            return HttpResponse('ok')
+
+        middleware = ProfilingMiddleware(vista)
+        self.assertTrue(iscoroutinefunction(middleware))
+        response = await middleware(RequestFactory().get('/prueba/'))
+        nombres = [metrica.split(';')[0]
+                   for metrica in response['Server-Timing'].split(', ')]
+        self.assertEqual(nombres, ['view', 'render', 'total'])
+        self.assertFalse(response.has_header('X-Query-Count'))
+
+
+class CProfileMiddlewareTest(TestCase):
+    """ Pruebas para los perfiles cProfile a pedido"""
+
+    def setUp(self):
+        self.dir = tempfile.TemporaryDirectory()
+        self.config = override_settings(FINPER_CPROFILE={'DIR': self.dir.name,
+                                                         'KEEP': 2})
+        self.config.enable()
+        self.middleware = CProfileMiddleware(self.responder)
+
+    @staticmethod
+    def responder(request):
+        """ El resto de la cadena: la vista y el render de su plantilla"""
+        response = vista_con_plantilla(request)
+        response.render()
+        return response
+
+    def tearDown(self):
+        self.config.disable()
+        self.dir.cleanup()
+
+    def pedir(self, staff, **params):
+        request = RequestFactory().get('/prueba/', params)
+        request.user = SimpleNamespace(is_staff=staff)
+        return self.middleware(request)
+
+    def test_staff_con_parametro_guarda_perfil_y_resumen(self):
+        response = self.pedir(staff=True, _profile='1')
+        nombre = response['X-Finper-Profile']
+        self.assertEqual(list_profiles(), [nombre])
+        self.assertTrue(os.path.exists(os.path.join(self.dir.name, nombre + '.prof')))
+        self.assertIn('vista_con_plantilla', read_summary(nombre))
+        self.assertEqual(response.content, b'0')
+
+    def test_sin_staff_o_sin_pedido_no_perfila(self):
+        self.assertFalse(self.pedir(staff=False, _profile='1').has_header('X-Finper-Profile'))
+        self.assertFalse(self.pedir(staff=True).has_header('X-Finper-Profile'))
+        self.assertEqual(list_profiles(), [])
+
+    def test_excepcion_de_la_vista_sigue_por_la_cadena(self):
+        def falla(request):
+            raise ValueError('vista')
+
+        middleware = CProfileMiddleware(falla)
+        request = RequestFactory().get('/prueba/', {'_profile': '1'})
+        request.user = SimpleNamespace(is_staff=True)
+        with self.assertRaises(ValueError):
+            middleware(request)
+        self.assertEqual(list_profiles(), [])
+
+    def test_conserva_solamente_los_ultimos_perfiles(self):
+        for x in range(3):
+            self.pedir(staff=True, _profile='1')
+        self.assertEqual(len(list_profiles()), 2)
@@ -0,0 +1,73 @@
+from django.db import connection
+from django.db.migrations.executor import MigrationExecutor
+from django.test import TransactionTestCase
+
+from finper.search import fts_enabled
+
+
+class MigrationTest(TransactionTestCase):
+    """ Pruebas para las migraciones de finper sobre una base con datos"""
+    migrate_from = [('finper', '0008_auto_20200307_1234')]
+
+    def setUp(self):
+        self.executor = MigrationExecutor(connection)
+        self.latest = self.executor.loader.graph.leaf_nodes('finper')
+        self.migrate(self.migrate_from)
+
+    def tearDown(self):
+        self.migrate(self.latest)
+
+    def migrate(self, targets):
+        self.executor.loader.build_graph()
+        self.executor.migrate(targets)
+        return self.executor.loader.project_state(targets).apps
+
+    def cargar_datos_viejos(self):
+        apps = self.executor.loader.project_state(self.migrate_from).apps
+        Account = apps.get_model('finper', 'Account')
+        Category = apps.get_model('finper', 'Category')
+        Movement = apps.get_model('finper', 'Movement')
+        banco = Account.objects.create(name='Banco', balance=100)
+        Account.objects.create(name='Banco', balance=0)
+        Account.objects.create(name='Efectivo', balance=0)
+        Movement.objects.create(concept='Plomero', detail='caño', amount=10,
+                                account_in=banco, account_out=banco,
+                                category=Category.objects.create(name='Casa'))
+
+    def test_conserva_el_concepto_y_asigna_codigos_distintos(self):
+        self.cargar_datos_viejos()
+        apps = self.migrate(self.latest)
+        Account = apps.get_model('finper', 'Account')
+        Movement = apps.get_model('finper', 'Movement')
+        self.assertEqual(list(Movement.objects.values_list('title', flat=True)), ['Plomero'])
+        self.assertEqual(list(Account.objects.order_by('pk').values_list('codename', flat=True)),
+                         ['BANC', 'BAN1', 'EFEC'])
+
+    def test_vuelve_atras_con_datos(self):
+        self.cargar_datos_viejos()
+        self.migrate(self.latest)
+        apps = self.migrate(self.migrate_from)
+        Movement = apps.get_model('finper', 'Movement')
+        self.assertEqual(list(Movement.objects.values_list('concept', 'direction')),
+                         [('Plomero', '=')])
+
+    def test_indice_fts_se_crea_y_se_borra_con_su_migracion(self):
+        self.cargar_datos_viejos()
+        self.migrate(self.latest)
+        self.assertTrue(fts_enabled())
+        with connection.cursor() as cursor:
+            cursor.execute("SELECT rowid FROM finper_movement_fts "
+                           "WHERE finper_movement_fts MATCH 'plomero'")
+            self.assertEqual(len(cursor.fetchall()), 1)
+        apps = self.migrate(self.migrate_from)
+        self.assertFalse(fts_enabled())
+        # Sin triggers que usen la columna title, que en 0008 no existe
+        Movement = apps.get_model('finper', 'Movement')
+        movement = Movement.objects.get()
+        Movement.objects.create(concept='Gas', detail='', amount=1,
+                                account_in=movement.account_in,
+                                account_out=movement.account_out,
+                                category=movement.category)
+        Movement.objects.all().delete()
+        self.executor.loader.build_graph()
+        self.executor.migrate([('finper', None)])
@@ -8,6 +8,7 @@
                                 account_in y account_out
 """
 
+import datetime
 import decimal
 import random
 
@@ -15,7 +16,8 @@ from django.db.models import Sum
 from django.test import TestCase
 from django.utils import timezone
 
-from finper.models import Account, Movement, Category
+from finper.cache import ledger_cached
+from finper.models import Account, Movement, Category, account_stats
 
 
 def create_account(cod, nombre, saldo_inicial):
@@ -29,8 +31,9 @@ def create_category():
     return Category.objects.create(name='test', description='para pruebas')
 
 
-def create_movement(cuenta_in=None, cuenta_out=None, monto=0):
-    fecha = timezone.now()
+def create_movement(cuenta_in=None, cuenta_out=None, monto=0, fecha=None):
+    if fecha is None:
+        fecha = timezone.now()
     concepto = 'Movimiento de prueba'
     categoria = create_category()
     return Movement.objects.create(date=fecha,
@@ -1959,3 +1962,225 @@ class AccountModelTest(TestCase):
         saldo_inicial = accin.balance - sum_mov_in + sum_mov_out
 
         self.assertEqual(accin.balance_start, saldo_inicial)
+
+
+class RunningBalanceTest(TestCase):
+    """ Pruebas para los saldos materializados de Movement
+        (balance_after_in, balance_after_out)"""
+
+    def setUp(self):
+        self.acc1 = create_account(cod='a1', nombre='Account1', saldo_inicial=1000)
+        self.acc2 = create_account(cod='a2', nombre='Account2', saldo_inicial=500)
+        self.dia1 = datetime.date(2020, 3, 1)
+        self.dia2 = datetime.date(2020, 3, 2)
+        self.dia3 = datetime.date(2020, 3, 3)
+
+    def saldos(self, cuenta):
+        """ Devuelve la lista de saldos materializados de la cuenta, en el
+            orden de la planilla"""
+        saldos = []
+        for mov in cuenta.movements().order_by('date', 'pk'):
+            saldos.append(mov.balance_after_in if mov.account_in_id == cuenta.pk
+                          else mov.balance_after_out)
+        return saldos
+
+    def test_mov_nuevo_guarda_saldo_posterior_de_sus_cuentas(self):
+        """ Acción:     Se crea un movimiento de traspaso
+            Chequear:   balance_after_in y balance_after_out son los saldos
+                        de las cuentas después del movimiento"""
+        mov = create_movement(cuenta_in=self.acc1, cuenta_out=self.acc2,
+                              monto=200, fecha=self.dia1)
+        mov.refresh_from_db()
+        self.assertEqual((mov.balance_after_in, mov.balance_after_out),
+                         (1200, 300))
+
+    def test_mov_con_fecha_anterior_corre_saldos_de_movs_posteriores(self):
+        """ Acción:     Se crea un movimiento con fecha anterior a la de otros
+                        movimientos de la cuenta
+            Chequear:   Los saldos de los movimientos posteriores incluyen
+                        el nuevo movimiento"""
+        create_movement(cuenta_in=self.acc1, monto=100, fecha=self.dia2)
+        create_movement(cuenta_out=self.acc1, monto=50, fecha=self.dia3)
+        create_movement(cuenta_out=self.acc1, monto=300, fecha=self.dia1)
+        self.assertEqual(self.saldos(self.acc1), [700, 800, 750])
+
+    def test_mov_nuevo_en_la_misma_fecha_queda_ultimo(self):
+        """ Acción:     Se crean dos movimientos con la misma fecha
+            Chequear:   El segundo parte del saldo posterior al primero"""
+        create_movement(cuenta_in=self.acc1, monto=100, fecha=self.dia2)
+        create_movement(cuenta_in=self.acc1, monto=200, fecha=self.dia3)
+        create_movement(cuenta_in=self.acc1, monto=10, fecha=self.dia2)
+        self.assertEqual(self.saldos(self.acc1), [1100, 1110, 1310])
+
+    def test_mod_monto_corre_saldos_de_movs_posteriores(self):
+        """ Acción:     Se modifica el monto de un movimiento
+            Chequear:   Los saldos de los movimientos posteriores reflejan
+                        la diferencia"""
+        mov = create_movement(cuenta_in=self.acc1, monto=100, fecha=self.dia1)
+        create_movement(cuenta_out=self.acc1, monto=50, fecha=self.dia2)
+        mov.amount = 400
+        mov.save()
+        self.assertEqual(self.saldos(self.acc1), [1400, 1350])
+
+    def test_mod_fecha_cambia_posicion_del_mov(self):
+        """ Acción:     Se modifica la fecha de un movimiento, pasándolo
+                        después de otro
+            Chequear:   Los saldos se recalculan según el nuevo orden"""
+        mov = create_movement(cuenta_in=self.acc1, monto=100, fecha=self.dia1)
+        create_movement(cuenta_out=self.acc1, monto=50, fecha=self.dia2)
+        mov.date = self.dia3
+        mov.save()
+        self.assertEqual(self.saldos(self.acc1), [950, 1050])
+
+    def test_mod_fecha_posterior_sin_movs_intermedios(self):
+        """ Acción:     Se pasa un movimiento a una fecha posterior, sin otro
+                        movimiento de la cuenta entre la fecha anterior y la
+                        nueva
+            Chequear:   El movimiento no se cuenta dos veces en su saldo"""
+        create_movement(cuenta_in=self.acc1, monto=10, fecha=self.dia1)
+        mov = create_movement(cuenta_in=self.acc1, monto=5, fecha=self.dia2)
+        mov.date = self.dia3
+        mov.save()
+        self.assertEqual(self.saldos(self.acc1), [1010, 1015])
+        self.assertEqual(self.acc1.check_running_balances(), [])
+
+    def test_cambio_de_cuenta_corre_saldos_de_ambas_cuentas(self):
+        """ Acción:     Se cambia la cuenta de entrada de un movimiento
+            Chequear:   Los saldos posteriores de la cuenta anterior y de la
+                        nueva reflejan el cambio"""
+        mov = create_movement(cuenta_in=self.acc1, monto=100, fecha=self.dia1)
+        create_movement(cuenta_out=self.acc1, monto=50, fecha=self.dia2)
+        create_movement(cuenta_out=self.acc2, monto=20, fecha=self.dia2)
+        mov.account_in = self.acc2
+        mov.save()
+        self.assertEqual((self.saldos(self.acc1), self.saldos(self.acc2)),
+                         ([950], [600, 580]))
+
+    def test_borrar_mov_corre_saldos_de_movs_posteriores(self):
+        """ Acción:     Se borra un movimiento
+            Chequear:   Los saldos de los movimientos posteriores ya no lo
+                        incluyen"""
+        mov = create_movement(cuenta_in=self.acc1, cuenta_out=self.acc2,
+                              monto=100, fecha=self.dia1)
+        create_movement(cuenta_out=self.acc1, monto=50, fecha=self.dia2)
+        create_movement(cuenta_in=self.acc2, monto=20, fecha=self.dia3)
+        mov.delete()
+        self.assertEqual((self.saldos(self.acc1), self.saldos(self.acc2)),
+                         ([950], [520]))
+
+    def test_saldo_materializado_del_ultimo_mov_es_igual_a_saldo_final(self):
+        """ Acción:     Se crean, modifican y borran movimientos al azar
+            Chequear:   Ningún saldo materializado queda inconsistente y el
+                        del último movimiento coincide con el saldo de la cuenta"""
+        dias = [self.dia1, self.dia2, self.dia3]
+        movs = []
+        for x in range(30):
+            movs.append(create_movement(cuenta_in=random.choice([self.acc1, None]),
+                                        cuenta_out=self.acc2,
+                                        monto=random.randint(1, 500),
+                                        fecha=random.choice(dias)))
+        for mov in random.sample(movs, 10):
+            mov.date = random.choice(dias)
+            mov.amount = random.randint(1, 500)
+            mov.save()
+        for mov in random.sample(movs, 5):
+            mov.delete()
+
+        for cuenta in (self.acc1.reconnect(), self.acc2.reconnect()):
+            self.assertEqual(cuenta.check_running_balances(), [])
+            self.assertEqual(cuenta.running_balance(), cuenta.balance)
+
+    def test_rebuild_corrige_saldos_materializados(self):
+        """ Acción:     Se alteran los saldos materializados y se los recalcula
+            Chequear:   Los saldos vuelven a ser correctos"""
+        create_movement(cuenta_in=self.acc1, monto=100, fecha=self.dia1)
+        create_movement(cuenta_out=self.acc1, monto=50, fecha=self.dia2)
+        Movement.objects.update(balance_after_in=0, balance_after_out=0)
+        self.assertEqual(len(self.acc1.check_running_balances()), 2)
+        self.assertEqual(self.acc1.rebuild_running_balances(), 2)
+        self.assertEqual(self.saldos(self.acc1), [1100, 1050])
+
+
+class AccountHistoryTest(TestCase):
+    """ Pruebas para el historial de movimientos de una cuenta"""
+
+    def setUp(self):
+        self.acc1 = create_account(cod='a1', nombre='Account1', saldo_inicial=1000)
+        self.acc2 = create_account(cod='a2', nombre='Account2', saldo_inicial=500)
+        self.movs = [
+            create_movement(cuenta_in=self.acc1, monto=100,
+                            fecha=datetime.date(2020, 3, 1)),
+            create_movement(cuenta_out=self.acc1, cuenta_in=self.acc2, monto=50,
+                            fecha=datetime.date(2020, 3, 2)),
+            create_movement(cuenta_out=self.acc2, monto=20,
+                            fecha=datetime.date(2020, 3, 2)),
+            create_movement(cuenta_out=self.acc1, monto=30,
+                            fecha=datetime.date(2020, 3, 2)),
+            create_movement(cuenta_in=self.acc1, monto=5,
+                            fecha=datetime.date(2020, 3, 3)),
+        ]
+
+    def test_historial_une_movs_de_entrada_y_salida_del_mas_nuevo_al_mas_viejo(self):
+        """ Chequear:   El historial tiene los movimientos de la cuenta, con el
+                        monto con signo y el saldo posterior a cada uno"""
+        historial = self.acc1.history()
+        self.assertEqual(
+            [(mov.pk, mov.signed_amount, mov.running_balance) for mov in historial],
+            [(self.movs[4].pk, 5, 1025),
+             (self.movs[3].pk, -30, 1020),
+             (self.movs[1].pk, -50, 1050),
+             (self.movs[0].pk, 100, 1100)])
+
+    def test_historial_paginado_por_clave(self):
+        """ Chequear:   Cada página sigue desde la posición del último
+                        movimiento de la anterior"""
+        pagina1 = self.acc1.history(limit=2)
+        ultimo = pagina1[-1]
+        pagina2 = self.acc1.history(before=(ultimo.date, ultimo.pk), limit=2)
+        self.assertEqual([mov.pk for mov in pagina1 + pagina2],
+                         [self.movs[4].pk, self.movs[3].pk,
+                          self.movs[1].pk, self.movs[0].pk])
+
+
+class AccountStatsTest(TestCase):
+    """ Pruebas para las estadísticas de cuentas (account_stats)"""
+
+    def setUp(self):
+        self.acc1 = create_account(cod='a1', nombre='Account1', saldo_inicial=100)
+        self.acc2 = create_account(cod='a2', nombre='Account2', saldo_inicial=50)
+        self.acc3 = create_account(cod='a3', nombre='Account3', saldo_inicial=0)
+        create_movement(cuenta_in=self.acc1, monto=decimal.Decimal('0.1'),
+                        fecha=datetime.date(2020, 1, 1))
+        create_movement(cuenta_in=self.acc1, monto=decimal.Decimal('0.2'),
+                        fecha=datetime.date(2020, 1, 2))
+        create_movement(cuenta_in=self.acc2, cuenta_out=self.acc1, monto=30,
+                        fecha=datetime.date(2020, 1, 5))
+        create_movement(cuenta_out=self.acc2, monto=5, fecha=datetime.date(2020, 1, 3))
+
+    def test_una_consulta_para_todas_las_cuentas(self):
+        with self.assertNumQueries(1):
+            acc1, acc2, acc3 = account_stats()
+        self.assertEqual((acc1.movements_in_count, acc1.inflow, acc1.movements_out_count,
+                          acc1.outflow, acc1.last_movement),
+                         (2, decimal.Decimal('0.3'), 1, 30, datetime.date(2020, 1, 5)))
+        self.assertEqual((acc2.movements_in_count, acc2.inflow, acc2.movements_out_count,
+                          acc2.outflow, acc2.last_movement),
+                         (1, 30, 1, 5, datetime.date(2020, 1, 5)))
+        # Sin movimientos
+        self.assertEqual((acc3.movements_in_count, acc3.inflow, acc3.last_movement),
+                         (0, 0, None))
+        self.assertTrue(all(account.reconciled for account in (acc1, acc2, acc3)))
+
+    def test_cuenta_sin_conciliar(self):
+        Account.objects.filter(pk=self.acc2.pk).update(balance=0)
+        self.assertEqual([account.reconciled for account in account_stats()],
+                         [True, False, True])
+
+    def test_cacheadas_bajo_la_version_del_libro(self):
+        ledger_cached('account_stats', [], account_stats)
+        with self.assertNumQueries(0):
+            cached = ledger_cached('account_stats', [], account_stats)
+        self.assertEqual(cached[0].inflow, decimal.Decimal('0.3'))
+        create_movement(cuenta_in=self.acc3, monto=1)
+        cached = ledger_cached('account_stats', [], account_stats)
+        self.assertEqual(cached[2].movements_in_count, 1)
@@ -0,0 +1,88 @@
+from django.contrib.auth.models import User
+from django.db import transaction
+from django.http import HttpResponse
+from django.test import RequestFactory, SimpleTestCase, TestCase, override_settings
+
+from finper.models import Account, Movement
+from finper.routers import (PIN_SESSION_KEY, PrimaryPinningMiddleware,
+                            ReplicaRouter, replica_reads)
+
+router = ReplicaRouter()
+
+
+# En las pruebas no hay una segunda base: se usa 'default' como alias de la
+# réplica, y se distingue porque el router devuelve None cuando no la elige.
+@override_settings(FINPER_REPLICA={'ALIAS': 'default', 'PIN_SECONDS': 10})
+class ReplicaRouterTest(SimpleTestCase):
+    """ Pruebas para el router de lecturas desde la réplica"""
+
+    def test_fuera_de_un_request_de_lectura_usa_la_principal(self):
+        self.assertIsNone(router.db_for_read(Movement))
+
+    def test_lecturas_de_finper_van_a_la_replica(self):
+        with replica_reads():
+            self.assertEqual(router.db_for_read(Movement), 'default')
+            self.assertEqual(router.db_for_read(Account), 'default')
+            self.assertIsNone(router.db_for_read(User))
+
+    def test_despues_de_escribir_lee_de_la_principal(self):
+        with replica_reads():
+            self.assertEqual(router.db_for_write(Movement), 'default')
+            self.assertIsNone(router.db_for_read(Movement))
+
+    @override_settings(FINPER_REPLICA={'ALIAS': 'replica'})
+    def test_sin_replica_configurada(self):
+        with replica_reads():
+            self.assertIsNone(router.db_for_read(Movement))
+
+    def test_la_replica_no_se_migra(self):
+        self.assertFalse(router.allow_migrate('default', 'finper'))
+        self.assertIsNone(router.allow_migrate('otra', 'finper'))
+
+
+@override_settings(FINPER_REPLICA={'ALIAS': 'default', 'PIN_SECONDS': 10})
+class ReplicaRouterAtomicTest(TestCase):
+
+    def test_dentro_de_atomic_usa_la_principal(self):
+        with replica_reads(), transaction.atomic():
+            self.assertIsNone(router.db_for_read(Movement))
+
+
+@override_settings(FINPER_REPLICA={'ALIAS': 'default', 'PIN_SECONDS': 10})
+class PrimaryPinningMiddlewareTest(SimpleTestCase):
+    """ Pruebas para el middleware que fija la sesión a la base principal"""
+
+    def procesar(self, method, session, escribe=False):
+        elegida = []
+
+        def vista(request):
+            if escribe:
+                router.db_for_write(Movement)
+            elegida.append(router.db_for_read(Movement))
+            return HttpResponse('ok')
+
+        request = getattr(RequestFactory(), method)('/prueba/')
+        request.session = session
+        PrimaryPinningMiddleware(vista)(request)
+        return elegida[0]
+
+    def test_get_lee_de_la_replica(self):
+        self.assertEqual(self.procesar('get', {}), 'default')
+
+    def test_post_usa_la_principal(self):
+        self.assertIsNone(self.procesar('post', {}))
+
+    def test_escribir_fija_la_sesion_a_la_principal(self):
+        session = {}
+        self.procesar('post', session, escribe=True)
+        self.assertIn(PIN_SESSION_KEY, session)
+        self.assertIsNone(self.procesar('get', session))
+
+    def test_la_fijacion_vence(self):
+        session = {PIN_SESSION_KEY: 0}
+        self.assertEqual(self.procesar('get', session), 'default')
+
+    def test_get_sin_escrituras_no_fija(self):
+        session = {}
+        self.procesar('get', session)
+        self.assertNotIn(PIN_SESSION_KEY, session)
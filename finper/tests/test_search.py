@@ -0,0 +1,59 @@
+from django.core.paginator import Paginator
+from django.test import TestCase
+
+from finper.search import autocomplete_titles, fts_enabled, search_movements
+from finper.tests.test_models import create_account, create_category
+from finper.models import Movement
+
+
+def create_titled_movement(cuenta, concepto, detalle=None):
+    return Movement.objects.create(title=concepto,
+                                   detail=detalle,
+                                   amount=100,
+                                   account_out=cuenta,
+                                   category=create_category())
+
+
+class MovementSearchTest(TestCase):
+    """ Pruebas para la búsqueda de movimientos por concepto y detalle"""
+
+    def setUp(self):
+        self.acc = create_account(cod='act', nombre='Account', saldo_inicial=1000)
+        self.plomero = create_titled_movement(self.acc, 'Plomero', 'arreglo caño')
+        self.super = create_titled_movement(self.acc, 'Supermercado', 'compras')
+        self.gas = create_titled_movement(self.acc, 'Gas', 'pago al plomero')
+
+    def test_la_base_de_pruebas_tiene_indice_fts(self):
+        self.assertTrue(fts_enabled())
+
+    def test_busca_en_concepto_y_detalle(self):
+        self.assertEqual({mov.pk for mov in search_movements('plomero')},
+                         {self.plomero.pk, self.gas.pk})
+
+    def test_busca_por_prefijo_e_ignora_acentos(self):
+        self.assertEqual([mov.pk for mov in search_movements('cano')],
+                         [self.plomero.pk])
+        self.assertEqual([mov.pk for mov in search_movements('superm')],
+                         [self.super.pk])
+
+    def test_modificar_y_borrar_actualizan_el_indice(self):
+        self.super.title = 'Verdulería'
+        self.super.save()
+        self.gas.delete()
+        self.assertEqual(list(search_movements('superm')), [])
+        self.assertEqual([mov.pk for mov in search_movements('plomero')],
+                         [self.plomero.pk])
+        self.assertEqual([mov.pk for mov in search_movements('verdu')],
+                         [self.super.pk])
+
+    def test_resultados_paginados(self):
+        for x in range(5):
+            create_titled_movement(self.acc, f'Plomero {x}')
+        page = Paginator(search_movements('plomero'), 3).page(2)
+        self.assertEqual((page.paginator.count, len(page.object_list)), (7, 3))
+
+    def test_texto_con_sintaxis_fts_no_falla(self):
+        self.assertEqual(list(search_movements('"plomero" OR (')), [])
+
+    def test_autocompleta_conceptos(self):
+        self.assertEqual(autocomplete_titles('plo'), ['Plomero'])
@@ -0,0 +1,51 @@
+import json
+import os
+import tempfile
+
+from django.db import connection
+from django.test import TestCase, override_settings
+
+from finper import slowqueries
+from finper.middleware import current_view
+from finper.tests.test_models import create_account
+
+
+class SlowQueryRecorderTest(TestCase):
+    """ Pruebas para el registro de consultas lentas"""
+
+    def setUp(self):
+        self.dir = tempfile.TemporaryDirectory()
+        self.archivo = os.path.join(self.dir.name, 'slow.log')
+        self.acc = create_account(cod='act', nombre='Account', saldo_inicial=100)
+
+    def tearDown(self):
+        for handler in slowqueries.get_logger(self.archivo, 0, 0).handlers:
+            handler.close()
+        self.dir.cleanup()
+
+    def registros(self):
+        with open(self.archivo, encoding='utf-8') as archivo:
+            return [json.loads(linea) for linea in archivo]
+
+    def test_registra_consulta_con_funcion_vista_y_plan(self):
+        config = {'ENABLED': True, 'THRESHOLD_MS': 0, 'FILE': self.archivo}
+        token = current_view.set('finper:accdetail')
+        try:
+            with override_settings(FINPER_SLOW_QUERIES=config), \
+                    connection.execute_wrapper(slowqueries.recorder):
+                self.acc.check_balance()
+        finally:
+            current_view.reset(token)
+        registro = self.registros()[0]
+        self.assertEqual(registro['view'], 'finper:accdetail')
+        self.assertTrue(registro['function'].startswith(
+            'finper.models.Account.check_balance:'))
+        self.assertEqual(registro['params'], [self.acc.pk])
+        self.assertTrue(registro['explain'])
+
+    def test_no_registra_consultas_rapidas(self):
+        config = {'ENABLED': True, 'THRESHOLD_MS': 10000, 'FILE': self.archivo}
+        with override_settings(FINPER_SLOW_QUERIES=config), \
+                connection.execute_wrapper(slowqueries.recorder):
+            self.acc.check_balance()
+        self.assertFalse(os.path.exists(self.archivo))
@@ -0,0 +1,102 @@
+from django.db import OperationalError, connection
+from django.test import TestCase, TransactionTestCase, override_settings
+
+from finper.metrics import BUSY_RETRIES
+from finper.models import Account, Movement
+from finper.sqlite import profile_pragmas
+from finper.tests.test_models import create_account, create_category
+
+
+class SQLiteProfileTest(TestCase):
+    """ Pruebas para el perfil de rendimiento de SQLite"""
+
+    def pragma(self, name):
+        with connection.cursor() as cursor:
+            cursor.execute(f'PRAGMA {name}')
+            return cursor.fetchone()[0]
+
+    def test_perfil_aplicado_a_la_conexion(self):
+        self.assertEqual(self.pragma('busy_timeout'), 5000)
+        self.assertEqual(self.pragma('synchronous'), 1)  # NORMAL
+        self.assertEqual(self.pragma('temp_store'), 2)  # MEMORY
+
+    def test_pragmas_configurables(self):
+        pragmas = profile_pragmas({'JOURNAL_MODE': 'DELETE', 'SYNCHRONOUS': 'FULL',
+                                   'CACHE_SIZE': 2000, 'MMAP_SIZE': 0,
+                                   'TEMP_STORE': 'DEFAULT', 'BUSY_TIMEOUT': 100})
+        self.assertIn('PRAGMA journal_mode=DELETE', pragmas)
+        self.assertIn('PRAGMA busy_timeout=100', pragmas)
+
+
+class Bloqueo:
+    """ Execute wrapper que hace fallar las consultas que contienen
+        sql_parcial (las primeras veces, después de saltear algunas), como si
+        otra conexión tuviera el lock de escritura."""
+
+    def __init__(self, sql_parcial, veces=1, saltear=0, mensaje='database is locked'):
+        self.sql_parcial = sql_parcial
+        self.veces = veces
+        self.saltear = saltear
+        self.mensaje = mensaje
+
+    def __call__(self, execute, sql, params, many, context):
+        if self.sql_parcial in sql:
+            if self.saltear:
+                self.saltear -= 1
+            elif self.veces:
+                self.veces -= 1
+                raise OperationalError(self.mensaje)
+        return execute(sql, params, many, context)
+
+
+@override_settings(FINPER_SQLITE={'RETRY_DELAY': 0})
+class RetryOnBusyTest(TransactionTestCase):
+    """ Pruebas para el reintento de escrituras con la base ocupada"""
+
+    def setUp(self):
+        self.cuenta_in = create_account('ci', 'Cuenta de entrada', 100)
+        self.cuenta_out = create_account('co', 'Cuenta de salida', 100)
+        self.categoria = create_category()
+
+    def crear_movimiento(self):
+        return Movement.objects.create(
+            date='2020-01-01', title='Movimiento de prueba', amount=10,
+            account_in=self.cuenta_in, account_out=self.cuenta_out,
+            category=self.categoria)
+
+    def test_reintenta_y_descarta_los_saldos_del_intento_fallido(self):
+        reintentos = sum(BUSY_RETRIES.snapshot().values())
+        # Falla la segunda escritura de cuenta: la primera ya se hizo y la
+        # transacción debe deshacerla
+        with connection.execute_wrapper(Bloqueo('UPDATE "finper_account"', saltear=1)):
+            mov = self.crear_movimiento()
+
+        self.assertEqual(Account.objects.get(pk=self.cuenta_in.pk).balance, 110)
+        self.assertEqual(Account.objects.get(pk=self.cuenta_out.pk).balance, 90)
+        self.assertEqual(mov.balance_after_in, 110)
+        self.assertEqual(Movement.objects.count(), 1)
+        self.assertEqual(sum(BUSY_RETRIES.snapshot().values()), reintentos + 1)
+
+    def test_borrado_reintentado(self):
+        mov = self.crear_movimiento()
+        with connection.execute_wrapper(Bloqueo('DELETE FROM "finper_movement"')):
+            mov.delete()
+        self.assertEqual(Account.objects.get(pk=self.cuenta_in.pk).balance, 100)
+        self.assertEqual(Account.objects.get(pk=self.cuenta_out.pk).balance, 100)
+
+    def test_se_rinde_despues_de_los_reintentos(self):
+        with override_settings(FINPER_SQLITE={'RETRY_DELAY': 0, 'RETRIES': 2}):
+            with connection.execute_wrapper(Bloqueo('INSERT INTO "finper_movement"', 3)):
+                with self.assertRaises(OperationalError):
+                    self.crear_movimiento()
+        self.assertEqual(Movement.objects.count(), 0)
+        self.assertEqual(Account.objects.get(pk=self.cuenta_in.pk).balance, 100)
+
+    def test_otros_errores_no_se_reintentan(self):
+        bloqueo = Bloqueo('INSERT INTO "finper_movement"', veces=2,
+                          mensaje='no such table: finper_movement')
+        with connection.execute_wrapper(bloqueo):
+            with self.assertRaises(OperationalError):
+                self.crear_movimiento()
+        self.assertEqual(bloqueo.veces, 1)
+        self.assertEqual(Account.objects.get(pk=self.cuenta_in.pk).balance, 100)
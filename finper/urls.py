@@ -1,6 +1,6 @@
 from django.urls import path
 
-from . import views
+from . import api, async_views, views
 
 app_name = 'finper'
 
@@ -9,13 +9,17 @@ urlpatterns = [
     path('movs/', views.MovListView.as_view(), name='movlist'),
     # path('mov_sheet/', views.movsheet, name='mov_sheet'),
     path('mov_sheet/', views.MovTableView.as_view(), name='mov_sheet'),
+    path('search/', views.MovSearchView.as_view(), name='mov_search'),
+    path('search/autocomplete/', views.mov_autocomplete, name='mov_autocomplete'),
     path('add_movement/', views.MovCreate.as_view(), name='add_movement'),
+    path('bulk_movements/', views.MovBulkCreate.as_view(), name='bulk_movements'),
     path('<int:pk>/mod_movement', views.MovEdit.as_view(), name='mod_mov'),
     path('<int:pk>/del_movement/', views.MovDelete.as_view(), name='del_mov'),
     path('accounts/', views.AccListView.as_view(), name='acclist'),
     path('add_account/', views.AccountCreate.as_view(), name='add_acc'),
     path('<int:pk>/mod_account/', views.AccountEdit.as_view(), name='mod_acc'),
     path('<int:pk>/del_account/', views.AccountDelete.as_view(), name='del_acc'),
+    path('<int:pk>/merge_account/', views.AccountMerge.as_view(), name='merge_acc'),
     path('<int:pk>/mov_detail', views.MovDetailView.as_view(), name='movdetail'),
     path('<int:pk>/acc_detail', views.AccDetailView.as_view(), name='accdetail'),
     # Vistas basadas en funciones, destinadas a verificar y corregir posibles
@@ -26,4 +30,26 @@ urlpatterns = [
     path('<int:pk>/correct_start_balance',
          views.correct_start_balance,
          name='bal_start_correc'),
+    # Datos para gráficos
+    path('charts/balance_history/', views.balance_history, name='balance_history'),
+    # Datos en JSON, en versión sincrónica y asincrónica (para ASGI)
+    path('json/movements/', views.movements_json, name='movements_json'),
+    path('json/accounts/', views.accounts_json, name='accounts_json'),
+    path('json/report/', views.report_json, name='report_json'),
+    path('async/movements/', async_views.movements_json, name='async_movements_json'),
+    path('async/accounts/', async_views.accounts_json, name='async_accounts_json'),
+    path('async/report/', async_views.report_json, name='async_report_json'),
+    path('async/events/', async_views.movement_events, name='movement_events'),
+    # API JSON (ver finper/api.py)
+    path('api/movements/', api.movements, name='api_movements'),
+    path('api/movements/<int:pk>/', api.movement, name='api_movement'),
+    path('api/movements/batch/', api.movement_batch, name='api_movement_batch'),
+    path('api/movements/ingest/', api.movement_ingest, name='api_movement_ingest'),
+    path('api/accounts/', api.accounts, name='api_accounts'),
+    path('api/accounts/<int:pk>/', api.account, name='api_account'),
+    path('api/changes/', api.changes, name='api_changes'),
+    path('metrics', views.metrics, name='metrics'),
+    # Perfiles cProfile (sólo staff)
+    path('profiles/', views.profiles, name='profiles'),
+    path('profiles/<str:name>.prof', views.profile_download, name='profile_download'),
 ]
@@ -1,14 +1,30 @@
+import datetime
+
 from django.contrib import messages
+from django.contrib.admin.views.decorators import staff_member_required
 from django.db.models import Sum
-from django.http import HttpResponseRedirect
-from django.shortcuts import render
+from django.http import (FileResponse, Http404, HttpResponse,
+                         HttpResponseRedirect, JsonResponse)
+from django.shortcuts import get_object_or_404, render
 from django.urls import reverse, reverse_lazy
 from django.views import generic
 
 from nandotools import debug
 
+from .cache import ledger_cached
+from .charts import DOWNSAMPLERS, balance_history as balance_series
 from .errors import AccountError
-from .models import Account, Movement
+from .events import streaming_enabled
+from .forms import (AccountMergeForm, MovementBulkActionForm, MovementBulkFormSet,
+                    MovementFilterForm, MovementModelForm)
+from .ledger import LedgerBatch
+from .metrics import MULTIPLE_DELETE_BATCH_SIZE, REGISTRY
+from .profiling import list_profiles, profile_path, read_summary
+from .models import Account, Movement, account_stats
+from .search import autocomplete_titles, search_movements
+from .serializers import (account_rows, category_report_rows, movement_page,
+                          movement_rows, page_size, parse_cursor,
+                          serialize_account, serialize_report_row)
 
 
 def index(request):
@@ -47,7 +63,10 @@ def correct_start_balance(request, pk):
         restando los movimientos de entrada y sumando los de salida.
     """
     cuenta = Account.objects.get(pk=pk)
-    cuenta.balance_start = cuenta.balance - cuenta.check_balance()['movsum']
+    balance_start = cuenta.balance - cuenta.check_balance()['movsum']
+    # Todos los saldos materializados de la cuenta se corren en la misma cifra
+    cuenta.shift_running_balances(balance_start - cuenta.balance_start)
+    cuenta.balance_start = balance_start
     cuenta.save()
     return HttpResponseRedirect(reverse('finper:mov_sheet'))
 
@@ -62,6 +81,116 @@ def check_movements(request, pk):
     pass
 
 
+def mov_autocomplete(request):
+    """ Devuelve en JSON los conceptos de movimientos que empiezan con el texto
+        del parámetro q, para autocompletar el campo de búsqueda."""
+    return JsonResponse({'results': autocomplete_titles(request.GET.get('q', ''))})
+
+
+def balance_history(request):
+    """ Devuelve en JSON la serie de saldos de una cuenta (parámetro account)
+        o del patrimonio neto (sin account) entre las fechas from y to,
+        reducida a points puntos con el método method ('lttb' o 'minmax').
+        La serie se cachea por cuenta, rango, resolución y versión del libro.
+    """
+    try:
+        date_from = datetime.date.fromisoformat(request.GET['from']) \
+            if request.GET.get('from') else None
+        date_to = datetime.date.fromisoformat(request.GET['to']) \
+            if request.GET.get('to') else None
+        points = min(max(int(request.GET.get('points', 500)), 3), 10000)
+    except ValueError as error:
+        return JsonResponse({'error': str(error)}, status=400)
+    method = request.GET.get('method', 'lttb')
+    if method not in DOWNSAMPLERS:
+        return JsonResponse({'error': f'Método desconocido: {method}'}, status=400)
+    account = get_object_or_404(Account, pk=request.GET['account']) \
+        if request.GET.get('account') else None
+    accountid = account.pk if account is not None else None
+
+    def compute():
+        return [(date.isoformat(), float(balance))
+                for date, balance in balance_series(account, date_from, date_to,
+                                                    points, method)]
+
+    series = ledger_cached(
+        'balance_history',
+        (accountid, date_from, date_to, points, method),
+        compute)
+    return JsonResponse({
+        'account': accountid,
+        'from': date_from,
+        'to': date_to,
+        'method': method,
+        'points': series,
+    })
+
+
+def movements_json(request):
+    """ Movimientos en JSON, del más nuevo al más viejo, con los filtros de
+        MovementFilterForm. Se pagina con limit y con before (la posición
+        'AAAA-MM-DD_pk' que devuelve la página anterior en next).
+        Ver también finper.async_views.movements_json."""
+    try:
+        before = parse_cursor(request.GET.get('before'))
+        limit = page_size(request.GET.get('limit'))
+    except ValueError as error:
+        return JsonResponse({'error': str(error)}, status=400)
+    form = MovementFilterForm(request.GET)
+    if request.GET and not form.is_valid():
+        return JsonResponse({'error': form.errors}, status=400)
+    movements = form.filter(Movement.objects.all())
+    rows = list(movement_rows(movements, before, limit))
+    return JsonResponse(movement_page(rows, limit, movements.count()))
+
+
+def accounts_json(request):
+    """ Cuentas con su saldo en JSON (ver finper.async_views.accounts_json)."""
+    return JsonResponse({'results': [serialize_account(row) for row in account_rows()]})
+
+
+def report_json(request):
+    """ Ingresos, egresos y cantidad de movimientos por categoría, con los
+        filtros de MovementFilterForm (ver finper.async_views.report_json)."""
+    form = MovementFilterForm(request.GET)
+    if request.GET and not form.is_valid():
+        return JsonResponse({'error': form.errors}, status=400)
+    rows = category_report_rows(form.filter(Movement.objects.all()))
+    return JsonResponse({'results': [serialize_report_row(row) for row in rows]})
+
+
+def metrics(request):
+    """ Métricas de operación del libro en el formato de texto de Prometheus,
+        sumando las de todos los procesos (ver finper/metrics.py)."""
+    return HttpResponse(REGISTRY.exposition(),
+                        content_type='text/plain; version=0.0.4; charset=utf-8')
+
+
+@staff_member_required
+def profiles(request):
+    """ Lista los perfiles cProfile guardados más recientes, con el resumen de
+        las funciones de mayor tiempo acumulado (ver finper/profiling.py)."""
+    return render(
+        request,
+        'finper/profiles.html',
+        {
+            'title': 'Perfiles de ejecución',
+            'profiles': [{'name': name, 'summary': read_summary(name)}
+                         for name in list_profiles()[:20]],
+        }
+    )
+
+
+@staff_member_required
+def profile_download(request, name):
+    """ Descarga el archivo .prof de un perfil guardado."""
+    path = profile_path(name, '.prof')
+    if path is None:
+        raise Http404('No existe el perfil')
+    return FileResponse(open(path, 'rb'), as_attachment=True,
+                        filename=f'{name}.prof')
+
+
 def balance_error(request, pk):
     """ Muestra la plantilla balance_error.html, con opciones para la corrección
         de un saldo erróneo."""
@@ -92,7 +221,9 @@ class AccListView(generic.ListView):
         return data
 
     def get_queryset(self):
-        return Account.objects.order_by('name')
+        # Movimientos, totales, última fecha y conciliación de cada cuenta en
+        # una consulta (ver account_stats()), cacheados bajo la versión del libro
+        return ledger_cached('account_stats', [], account_stats)
 
 
 class AccDetailView(generic.DetailView):
@@ -100,6 +231,27 @@ class AccDetailView(generic.DetailView):
     model = Account
     template_name = 'finper/acc_detail.html'
 
+    history_size = 50
+
+    def get_history_cursor(self):
+        """ Lee del parámetro before la posición 'AAAA-MM-DD_pk' desde la que
+            continúa el historial. Si no hay o es inválida, devuelve None."""
+        try:
+            return parse_cursor(self.request.GET.get('before'))
+        except ValueError:
+            return None
+
+    def get_context_data(self, **kwargs):
+        data = super(AccDetailView, self).get_context_data(**kwargs)
+        data['running_balance'] = self.object.running_balance()
+        history = self.object.history(before=self.get_history_cursor(),
+                                      limit=self.history_size + 1)
+        data['history'] = history[:self.history_size]
+        if len(history) > self.history_size:
+            last = data['history'][-1]
+            data['history_next'] = f'{last.date.isoformat()}_{last.pk}'
+        return data
+
 
 class AccountCreate(generic.edit.CreateView):
     model = Account
@@ -120,10 +272,58 @@ class AccountDelete(generic.edit.DeleteView):
     success_url = reverse_lazy('finper:mov_sheet')
 
 
-class MovListView(generic.ListView):
+class AccountMerge(generic.detail.SingleObjectMixin, generic.FormView):
+    """ Fusiona la cuenta en otra: le pasa todos sus movimientos y sus
+        saldos, y la borra (ver ledger.merge_accounts)."""
+    model = Account
+    form_class = AccountMergeForm
+    template_name = 'finper/account_merge.html'
+    success_url = reverse_lazy('finper:mov_sheet')
+
+    def dispatch(self, request, *args, **kwargs):
+        self.object = self.get_object()
+        return super().dispatch(request, *args, **kwargs)
+
+    def get_form_kwargs(self):
+        kwargs = super().get_form_kwargs()
+        kwargs['source'] = self.object
+        return kwargs
+
+    def form_valid(self, form):
+        moved, removed = form.merge()
+        messages.add_message(self.request, messages.SUCCESS,
+                             f"{self.object.name} fusionada en "
+                             f"{form.cleaned_data['target'].name}: {moved} movimientos "
+                             f"pasados, {removed} traspasos entre las dos borrados")
+        return super().form_valid(form)
+
+
+class MovementFilterMixin:
+    """ Filtra los movimientos de una vista de lista según los parámetros de
+        la query string (ver MovementFilterForm)."""
+
+    def get_filter_form(self):
+        if getattr(self, '_filter_form', None) is None:
+            self._filter_form = MovementFilterForm(self.request.GET or None)
+        return self._filter_form
+
+    def filter_movements(self, queryset):
+        return self.get_filter_form().filter(queryset)
+
+    def get_context_data(self, *args, **kwargs):
+        data = super().get_context_data(*args, **kwargs)
+        query = self.request.GET.copy()
+        query.pop('page', None)
+        data['filter_form'] = self.get_filter_form()
+        data['filter_query'] = query.urlencode()
+        return data
+
+
+class MovListView(MovementFilterMixin, generic.ListView):
     """ Clase de vista de lista de movimientos """
     template_name = 'finper/movements.html'
     context_object_name = 'movements_list'
+    paginate_by = 100
 
     def get_context_data(self, *args, object_list=None, **kwargs):
         data = super(MovListView, self).get_context_data(*args, **kwargs)
@@ -131,28 +331,96 @@ class MovListView(generic.ListView):
         return data
 
     def get_queryset(self):
-        return Movement.objects.order_by('-date')
+        return self.filter_movements(
+            Movement.objects
+            .select_related('account_in', 'account_out', 'category')
+            .order_by('-date', '-pk'))
+
 
+class MovSearchView(generic.ListView):
+    """ Clase de vista de búsqueda de movimientos por concepto y detalle.
+        Los resultados se ordenan por relevancia."""
+    template_name = 'finper/mov_search.html'
+    context_object_name = 'movements_list'
+    paginate_by = 25
+
+    def get_queryset(self):
+        self.query = self.request.GET.get('q', '').strip()
+        if not self.query:
+            return Movement.objects.none()
+        return search_movements(self.query)
 
-class MovTableView(generic.ListView):
+    def get_context_data(self, *args, **kwargs):
+        data = super(MovSearchView, self).get_context_data(*args, **kwargs)
+        data['title'] = 'Búsqueda de movimientos'
+        data['query'] = self.query
+        query = self.request.GET.copy()
+        query.pop('page', None)
+        data['filter_query'] = query.urlencode()
+        return data
+
+
+class MovTableView(MovementFilterMixin, generic.ListView):
     template_name = 'finper/mov_sheet.html'
     object_list = Movement.objects.order_by('date', 'pk')
 
     def get_queryset(self):
-        return Movement.objects.order_by('date', 'pk')
+        return self.filter_movements(
+            Movement.objects.select_related('category').order_by('date', 'pk'))
 
     def get_context_data(self, *args, **kwargs):
         arguments = super(MovTableView, self).get_context_data(*args, **kwargs)
+        form = self.get_filter_form()
+        accounts = list(Account.objects.order_by('name'))
+        # Saldos al comienzo y al final de la ventana de fechas filtrada,
+        # leídos de los saldos materializados (dos búsquedas por índice
+        # por cuenta, sin importar la cantidad de movimientos)
+        for cta in accounts:
+            cta.opening_balance = form.opening_balance(cta)
+            cta.closing_balance = form.closing_balance(cta)
+        if form.is_filtered():
+            # Suma de los movimientos filtrados por cuenta
+            sums = {}
+            movements = self.object_list.order_by()
+            for accountid, total in movements.values_list('account_in')\
+                    .annotate(Sum('amount')):
+                sums[accountid] = sums.get(accountid, 0) + total
+            for accountid, total in movements.values_list('account_out')\
+                    .annotate(Sum('amount')):
+                sums[accountid] = sums.get(accountid, 0) - total
+            for cta in accounts:
+                cta.filtered_sum = sums.get(cta.pk, 0)
+            arguments['filtered_sum'] = sum(cta.filtered_sum for cta in accounts)
         arguments['title'] = 'Finanzas Personales - Planilla de movimientos'
-        arguments['movements_list'] = Movement.objects.order_by('date', 'pk')
-        arguments['accounts_list'] = Account.objects.order_by('name')
-        arguments['accounts_sum'] = Account.objects.aggregate(Sum('balance'))
-        arguments['accounts_start_sum'] = Account.objects.aggregate(Sum('balance_start'))
+        arguments['movements_list'] = self.object_list
+        arguments['accounts_list'] = accounts
+        arguments['accounts_sum'] = sum(cta.closing_balance for cta in accounts)
+        arguments['accounts_start_sum'] = sum(cta.opening_balance for cta in accounts)
+        arguments['is_filtered'] = form.is_filtered()
+        arguments['live_events'] = streaming_enabled(self.request)
+        arguments['action_form'] = MovementBulkActionForm()
         return arguments
 
     def post(self, request, *args, **kwargs):
+        if 'bulk_action' in request.POST:
+            return self.bulk_action(request)
         return MovMultipleDelete.as_view()(request, *args, **kwargs)
 
+    def bulk_action(self, request):
+        """ Cambia la categoría o una cuenta de los movimientos seleccionados
+            (ver MovementBulkActionForm)."""
+        form = MovementBulkActionForm(request.POST)
+        if form.is_valid():
+            updated = form.apply(
+                Movement.objects.filter(pk__in=request.POST.getlist('mult_delete')))
+            messages.add_message(request, messages.SUCCESS,
+                                 f"{updated} movimientos modificados")
+        else:
+            for errors in form.errors.values():
+                for error in errors:
+                    messages.add_message(request, messages.ERROR, error)
+        return HttpResponseRedirect(request.get_full_path())
+
 
 class MovDetailView(generic.DetailView):
     """ Clase de vista de detalle de movimientos """
@@ -162,8 +430,8 @@ class MovDetailView(generic.DetailView):
 
 class MovCreate(generic.edit.CreateView):
     model = Movement
+    form_class = MovementModelForm
     success_url = reverse_lazy('finper:mov_sheet')
-    fields = '__all__'
 
     def post(self, request, *args, **kwargs):
         try:
@@ -178,10 +446,31 @@ class MovCreate(generic.edit.CreateView):
                           context=self.get_context_data())
 
 
+class MovBulkCreate(generic.FormView):
+    """ Carga de varios movimientos a la vez, una fila por movimiento. Las
+        filas válidas se guardan juntas; las que tienen errores se vuelven
+        a mostrar, con sus errores, para corregirlas."""
+    form_class = MovementBulkFormSet
+    template_name = 'finper/mov_bulk.html'
+    success_url = reverse_lazy('finper:mov_sheet')
+
+    def post(self, request, *args, **kwargs):
+        form = self.get_form()
+        saved = form.save_valid()
+        if saved:
+            messages.add_message(request, messages.SUCCESS,
+                                 f"{saved} movimientos guardados")
+        if not form.pending_forms() and not form.non_form_errors():
+            return HttpResponseRedirect(self.get_success_url())
+        # El template omite las filas guardadas: al volver a enviar el
+        # formset llegan vacías y se ignoran
+        return self.render_to_response(self.get_context_data(form=form))
+
+
 class MovEdit(generic.edit.UpdateView):
     model = Movement
+    form_class = MovementModelForm
     success_url = reverse_lazy('finper:mov_sheet')
-    fields = '__all__'
 
     def post(self, request, *args, **kwargs):
         try:
@@ -264,12 +553,16 @@ class MovMultipleDelete(generic.edit.DeleteView):
     args = None
     kwargs = None
 
-    def delete(self, request, *args, **kwargs):
+    def post(self, request, *args, **kwargs):
+        # DeleteView.post() borra un solo objeto (form_valid()), buscado por
+        # el pk de la url: acá se borran los seleccionados en la planilla, en
+        # un LedgerBatch (una actualización de saldo por cuenta)
         para_borrar = request.POST.getlist("mult_delete")
-        success_url = self.success_url
-        for num in para_borrar:
-            Movement.objects.get(pk=num).delete()
+        MULTIPLE_DELETE_BATCH_SIZE.observe(len(para_borrar))
+        with LedgerBatch():
+            for movement in Movement.objects.filter(pk__in=para_borrar):
+                movement.delete()
 
-        return HttpResponseRedirect(success_url)
+        return HttpResponseRedirect(self.success_url)
 
 